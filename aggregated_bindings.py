@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client
+
+import audit
+from cluster_sync import LONG_ACCOUNT_LABEL, iter_pages
+from k8s_writes import aggregated_role_binding_body, aggregated_role_binding_name, serialize, user_subject
+
+# How user roles are bound:
+#   "per-user"   - one RoleBinding per user, "{username}-{role}-binding"
+#   "aggregated" - one RoleBinding per (namespace, role), "{role}-users-binding",
+#                  whose subjects list every user with that role
+BINDING_MODE = os.environ.get("K8S_BINDING_MODE", "per-user")
+
+# Writes of one subjects change before giving up when other writers keep
+# changing the binding in between
+CONFLICT_RETRIES = int(os.environ.get("K8S_CONFLICT_RETRIES", "10"))
+
+# Per-user RoleBindings deleted at the same time while migrating
+MIGRATE_PARALLELISM = 16
+
+
+def aggregated():
+    return BINDING_MODE == "aggregated"
+
+
+# Bindings are handled as plain JSON: with thousands of subjects, building
+# client model objects for every read and write costs more than the call.
+def _json(response):
+    return json.loads(response.data)
+
+
+def _read(rbac_api, namespace, name):
+    try:
+        return _json(rbac_api.read_namespaced_role_binding(name=name, namespace=namespace, _preload_content=False))
+    except client.exceptions.ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+# The subjects list with the users in add appended and those in remove
+# dropped, plus the usernames that actually changed. Subjects other than
+# users are kept as they are.
+def _merged_subjects(subjects, add, remove):
+    names = {s["name"] for s in subjects if s.get("kind") == "User"}
+    added = [username for username in dict.fromkeys(add) if username not in names]
+    removed = names & set(remove)
+    kept = [s for s in subjects if not (s.get("kind") == "User" and s["name"] in removed)]
+    return kept + [serialize(user_subject(username)) for username in added], set(added) | removed
+
+
+# Add and remove users in the aggregated RoleBinding of (namespace, role) in
+# a single write, creating the binding if needed.
+#
+# The patch (a strategic merge patch, which replaces subjects as a whole)
+# carries the resourceVersion it was computed from, so if anyone else changed
+# the binding in between it fails with 409 Conflict; the binding is then read
+# again and the change re-applied. known is the binding as last seen, which
+# saves the read when nobody else wrote it since. It only ever supplies that
+# precondition: a change that looks like a no-op against it is checked
+# against a fresh read, as another worker may have written the binding.
+#
+# Returns (binding as a dict, usernames that changed).
+def update_subjects(rbac_api, namespace, role_name, add=(), remove=(), known=None):
+    name = aggregated_role_binding_name(role_name)
+    binding = known
+    error = None
+    for _ in range(CONFLICT_RETRIES):
+        fresh = binding is None
+        if fresh:
+            binding = _read(rbac_api, namespace, name)
+        try:
+            if binding is None:
+                if not add:
+                    return None, set()
+                body = aggregated_role_binding_body(namespace, role_name, add)
+                response = rbac_api.create_namespaced_role_binding(namespace=namespace, body=body, _preload_content=False)
+                return _json(response), set(add)
+            subjects, changed = _merged_subjects(binding.get("subjects") or [], add, remove)
+            if not changed:
+                if not fresh:
+                    binding = None
+                    continue
+                return binding, changed
+            patch = {"metadata": {"resourceVersion": binding["metadata"]["resourceVersion"]}, "subjects": subjects}
+            response = rbac_api.patch_namespaced_role_binding(
+                name=name, namespace=namespace, body=patch, _preload_content=False
+            )
+            return _json(response), changed
+        except client.exceptions.ApiException as e:
+            # 409: changed or created by someone else; 404: deleted since last seen
+            if e.status not in (404, 409) or (e.status == 404 and binding is None):
+                raise
+            error = e
+            binding = None
+    raise error
+
+
+# Net change per user of queued (username, add) changes, last one wins
+def _net(changes):
+    final = {}
+    for change in changes:
+        final[change["username"]] = change["add"]
+    return [u for u, add in final.items() if add], [u for u, add in final.items() if not add]
+
+
+# Writes subject changes to the aggregated bindings with group commit:
+# callers queue their change, and the first caller for a binding becomes its
+# writer, writing everything queued in one patch until nothing is left while
+# the others wait for their change to be written. With N users being
+# onboarded at once, a batch costs about one write per N users instead of
+# one RoleBinding each.
+#
+# add and remove return True if the user was actually added or removed, and
+# raise the error of the write (usually an ApiException) if it failed.
+class SubjectBatcher:
+    def __init__(self, rbac_api):
+        self.rbac_api = rbac_api
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._bindings = {}
+
+    def add(self, namespace, role_name, username):
+        return self._submit(namespace, role_name, username, True)
+
+    def remove(self, namespace, role_name, username):
+        return self._submit(namespace, role_name, username, False)
+
+    def _entry(self, namespace, role_name):
+        return self._bindings.setdefault((namespace, role_name), {"writing": False, "pending": [], "binding": None})
+
+    def _submit(self, namespace, role_name, username, add):
+        change = {"username": username, "add": add, "done": False, "changed": False, "error": None}
+        with self._lock:
+            entry = self._entry(namespace, role_name)
+            entry["pending"].append(change)
+            self._written.wait_for(lambda: change["done"] or not entry["writing"])
+            if not change["done"]:
+                entry["writing"] = True
+        if not change["done"]:
+            # The writer stops in the same locked block that finds the queue
+            # empty, so a change queued after that always finds no writer
+            finished = False
+            try:
+                while not finished:
+                    with self._lock:
+                        changes, entry["pending"] = entry["pending"], []
+                        if not changes:
+                            entry["writing"] = False
+                            finished = True
+                    if changes:
+                        self._write(namespace, role_name, entry, changes)
+            finally:
+                with self._lock:
+                    if not finished:
+                        entry["writing"] = False
+                    self._written.notify_all()
+        if change["error"] is not None:
+            raise change["error"]
+        return change["changed"]
+
+    # Every change taken is marked done, with the error if the write failed
+    # for any reason (timeouts included), and its waiters are woken
+    def _write(self, namespace, role_name, entry, changes):
+        add, remove = _net(changes)
+        changed, error = set(), None
+        try:
+            entry["binding"], changed = update_subjects(
+                self.rbac_api, namespace, role_name, add, remove, known=entry["binding"]
+            )
+        except Exception as e:
+            entry["binding"], error = None, e
+        finally:
+            with self._lock:
+                for change in changes:
+                    change["changed"] = change["username"] in changed
+                    change["error"] = error
+                    change["done"] = True
+                self._written.notify_all()
+
+
+# SubjectBatcher for the asyncio engine. Waiting callers are tasks on the
+# engine's loop; only the one writing a batch uses a thread, so thousands of
+# users in flight fold into a handful of writes.
+class AsyncSubjectBatcher(SubjectBatcher):
+    async def add(self, namespace, role_name, username):
+        return await self._submit(namespace, role_name, username, True)
+
+    async def remove(self, namespace, role_name, username):
+        return await self._submit(namespace, role_name, username, False)
+
+    async def _submit(self, namespace, role_name, username, add):
+        change = {"username": username, "add": add, "done": False, "changed": False, "error": None}
+        entry = self._entry(namespace, role_name)
+        entry.setdefault("lock", asyncio.Lock())
+        entry["pending"].append(change)
+        async with entry["lock"]:
+            if not change["done"]:
+                changes, entry["pending"] = entry["pending"], []
+                await asyncio.to_thread(self._write, namespace, role_name, entry, changes)
+        if change["error"] is not None:
+            raise change["error"]
+        return change["changed"]
+
+
+# Fold per-user RoleBindings ({username}-{role}-binding) into the aggregated
+# binding of their namespace and role, then delete them. The aggregated
+# binding is written before any per-user binding of its users is deleted, so
+# nobody loses access midway. namespaces limits the migration to those
+# namespaces. Every write is recorded in the audit journal. Returns counts
+# and errors.
+def migrate_user_bindings(rbac_api, namespaces=None, dry_run=False):
+    by_role = {}
+    for items in iter_pages(rbac_api.list_role_binding_for_all_namespaces, LONG_ACCOUNT_LABEL):
+        for rb in items:
+            if namespaces and rb.metadata.namespace not in namespaces:
+                continue
+            by_role.setdefault((rb.metadata.namespace, rb.role_ref.name), []).append(
+                (rb.metadata.labels[LONG_ACCOUNT_LABEL], rb.metadata.name)
+            )
+
+    result = {
+        "per_user_bindings": sum(len(users) for users in by_role.values()),
+        "aggregated_bindings": len(by_role),
+        "deleted": 0,
+        "errors": [],
+        "dry_run": dry_run,
+    }
+    if dry_run:
+        return result
+
+    def delete(namespace, role_name, username, name):
+        error = None
+        try:
+            rbac_api.delete_namespaced_role_binding(name=name, namespace=namespace)
+        except client.exceptions.ApiException as e:
+            if e.status != 404:
+                error = f"An error occurred while deleting RoleBinding '{name}' from namespace '{namespace}': {e}"
+        audit.journal.record(
+            action="delete", kind="RoleBinding", group=namespace, name=name, user=username, role=role_name,
+            ok=error is None, message=error,
+        )
+        return error
+
+    with ThreadPoolExecutor(max_workers=MIGRATE_PARALLELISM) as executor:
+        for (namespace, role_name), users in by_role.items():
+            usernames = [username for username, _ in users]
+            error = None
+            try:
+                update_subjects(rbac_api, namespace, role_name, add=usernames)
+            except client.exceptions.ApiException as e:
+                error = f"An error occurred while aggregating the '{role_name}' RoleBindings of namespace '{namespace}': {e}"
+            audit.journal.record(
+                action="migrate", kind="RoleBinding", group=namespace, name=aggregated_role_binding_name(role_name),
+                role=role_name, users=usernames, ok=error is None, message=error,
+            )
+            if error:
+                result["errors"].append(error)
+                continue
+            for error in executor.map(lambda user: delete(namespace, role_name, *user), users):
+                if error:
+                    result["errors"].append(error)
+                else:
+                    result["deleted"] += 1
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fold per-user RoleBindings into one RoleBinding per namespace and role.")
+    parser.add_argument("--namespace", action="append", help="only migrate this namespace (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="only count the bindings that would be migrated")
+    args = parser.parse_args(argv)
+
+    import k8s_client
+
+    result = migrate_user_bindings(k8s_client.rbac_api(), namespaces=args.namespace, dry_run=args.dry_run)
+    audit.journal.close()
+    print(json.dumps(result, indent=2))
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
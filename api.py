@@ -0,0 +1,241 @@
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import time
+
+from flask import Blueprint, request
+
+from bulk_import import IMPORT_FORMATS, iter_rows, run_import
+from bulk_provision import provision_users
+from pagination import Page, iter_sorted_names, page_args
+
+# Records provisioned per chunk of a batch request
+BATCH_CHUNK_SIZE = 500
+
+USER_FIELDS = ("username", "short_name", "group", "role", "pull_secret")
+
+# What reading a malformed body raises: invalid JSON, or for a gzipped body
+# a corrupt (BadGzipFile, an OSError) or truncated (EOFError) stream
+BODY_ERRORS = (ValueError, OSError, EOFError)
+
+
+# Request body as a file-like object, transparently gunzipped
+def _request_stream():
+    stream = request.stream
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        stream = gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def _is_ndjson():
+    return request.mimetype in ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+
+
+# Yield records from a JSON array/object or an NDJSON stream. NDJSON is parsed
+# line by line so memory does not grow with the size of the upload. Any other
+# JSON body raises ValueError.
+def iter_records():
+    stream = _request_stream()
+    if _is_ndjson():
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+        return
+    data = json.load(stream)
+    if isinstance(data, dict):
+        data = data.get("items", [data])
+    if not isinstance(data, list):
+        raise ValueError("expected a JSON array or object")
+    yield from data
+
+
+def json_response(payload, status=200):
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if "gzip" in request.accept_encodings:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return body, status, headers
+
+
+def error_response(message, status=400):
+    return json_response({"error": message}, status)
+
+
+def validate_user(record, required):
+    if not isinstance(record, dict):
+        return "Each user record must be a JSON object."
+    missing = [field for field in required if not record.get(field)]
+    if missing:
+        return f"Missing required field(s): {', '.join(missing)}."
+    return None
+
+
+# Build the /api/v1 blueprint.
+#
+# create_group(name) returns the (message, created) pair of create_namespace;
+# provision_user(record) adds one user record and returns its message;
+# services provides the shared store and namespace cache; required lists the
+# record fields that provisioning needs; delete_group(name, delete_namespace),
+# if given, enables DELETE /api/v1/groups/<name>.
+def create_api_blueprint(
+    create_group, provision_user, services, required=("username", "group"), delete_group=None
+):
+    api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+    def provision_records(records, start_index=0):
+        results = []
+        pending = []
+        for index, record in enumerate(records, start_index):
+            error = validate_user(record, required)
+            if error:
+                results.append({"index": index, "ok": False, "message": error})
+            else:
+                pending.append((index, {field: record.get(field) for field in USER_FIELDS}))
+        provisioned, _ = provision_users(pending, lambda item: provision_user(item[1]))
+        for result in provisioned:
+            index, record = result["user"]
+            results.append({
+                "index": index,
+                "username": record["username"],
+                "group": record["group"],
+                "ok": result["ok"],
+                "message": result["message"],
+            })
+        results.sort(key=lambda r: r["index"])
+        return results
+
+    @api.route("/groups", methods=["GET"])
+    def list_groups():
+        prefix, after, limit = page_args()
+        page = Page(iter_sorted_names(services.namespace_cache.names(), prefix, after), limit, prefix)
+        return json_response({"items": list(page), "next_cursor": page.next_cursor})
+
+    @api.route("/groups", methods=["POST"])
+    def create_groups():
+        try:
+            records = list(iter_records())
+        except BODY_ERRORS as e:
+            return error_response(f"Invalid request body: {e}")
+        results = []
+        for record in records:
+            name = record.get("name") if isinstance(record, dict) else record
+            if not name:
+                results.append({"name": name, "ok": False, "message": "Missing group name."})
+                continue
+            message, created = create_group(name)
+            results.append({"name": name, "ok": "An error occurred" not in message, "created": created, "message": message})
+        return json_response({"results": results})
+
+    @api.route("/groups/<name>", methods=["DELETE"])
+    def remove_group(name):
+        if delete_group is None:
+            return error_response("Deleting groups is not enabled.", 405)
+        delete_namespace = request.args.get("namespace", "").lower() in ("1", "true", "yes")
+        message, ok = delete_group(name, delete_namespace)
+        return json_response({"name": name, "ok": ok, "message": message}, 200 if ok else 409)
+
+    @api.route("/users", methods=["GET"])
+    def list_users():
+        prefix, after, limit = page_args()
+        page = Page(services.store.iter_user_groups(prefix, after), limit, prefix)
+        items = [{"group": group, "users": users} for group, users in page]
+        return json_response({"items": items, "next_cursor": page.next_cursor})
+
+    @api.route("/users", methods=["POST"])
+    def create_user():
+        try:
+            records = list(iter_records())
+        except BODY_ERRORS as e:
+            return error_response(f"Invalid request body: {e}")
+        if len(records) != 1:
+            return error_response("Expected a single user record; use /api/v1/users:batch for several.")
+        result = provision_records(records)[0]
+        return json_response(result, 201 if result["ok"] else 400)
+
+    @api.route("/users:batch", methods=["POST"])
+    def create_users_batch():
+        start = time.monotonic()
+        results = []
+        chunk = []
+        try:
+            for record in iter_records():
+                chunk.append(record)
+                if len(chunk) == BATCH_CHUNK_SIZE:
+                    results.extend(provision_records(chunk, len(results)))
+                    chunk = []
+            results.extend(provision_records(chunk, len(results)))
+        except BODY_ERRORS as e:
+            # Records before the malformed one have already been provisioned
+            return json_response({
+                "error": f"Invalid request body at record {len(results) + len(chunk)}: {e}",
+                "results": results,
+            }, 400)
+        failed = sum(1 for r in results if not r["ok"])
+        return json_response({
+            "total": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "seconds": time.monotonic() - start,
+            "results": results,
+        })
+
+    # Streaming CSV/NDJSON import from an HR export. The upload is spooled to
+    # a temporary file and imported row by row in a background job, which
+    # writes the next row to import to the store after every chunk; see
+    # /jobs/<id>.json. An interrupted upload starts nothing. Pass
+    # ?offset=<row>, or ?resume=<job id> to continue after the stored offset
+    # of an earlier import job.
+    @api.route("/users:import", methods=["POST"])
+    def import_users():
+        fmt = request.args.get("format") or ("ndjson" if _is_ndjson() else "csv")
+        if fmt not in IMPORT_FORMATS:
+            return error_response(f"Unsupported format '{fmt}'; use one of: {', '.join(IMPORT_FORMATS)}.")
+        try:
+            offset = int(request.args.get("offset", 0))
+        except ValueError:
+            return error_response("offset must be an integer.")
+        resume = request.args.get("resume")
+        if resume:
+            previous = services.job_queue.snapshot(resume)
+            if previous is None or previous.get("offset") is None:
+                return error_response(f"No import job '{resume}' to resume.", 404)
+            offset = previous["offset"]
+
+        upload = request.files.get("file")
+        spool = tempfile.TemporaryFile()
+        try:
+            shutil.copyfileobj(upload.stream if upload else _request_stream(), spool)
+        except BODY_ERRORS as e:
+            spool.close()
+            return error_response(f"Invalid request body: {e}")
+        spool.seek(0)
+
+        def provision(record):
+            error = validate_user(record, required)
+            return f"An error occurred: {error}" if error else provision_user(record)
+
+        def task(job, checkpoint):
+            def on_chunk(summary):
+                job.offset = summary["offset"]
+                job.progress = {key: summary[key] for key in ("processed", "succeeded", "failed")}
+                checkpoint()
+
+            try:
+                summary = run_import(iter_rows(spool, fmt), provision, offset=offset, on_chunk=on_chunk)
+            finally:
+                spool.close()
+            job.progress["failures"] = summary["failures"]
+            return (
+                f"Imported {summary['succeeded']}/{summary['processed']} rows "
+                f"({summary['failed']} failed); next row {summary['offset']}."
+            )
+
+        job = services.job_queue.submit_task(f"Import users from row {offset}", task, offset=offset)
+        return json_response({"job": job.id, "offset": offset, "status": f"/jobs/{job.id}.json"}, 202)
+
+    return api
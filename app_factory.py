@@ -0,0 +1,162 @@
+import json
+import os
+
+from flask import Flask, Response, jsonify, render_template, request, stream_template, url_for
+from kubernetes import client
+
+import audit
+import metrics
+from jobs import create_jobs_blueprint
+from pagination import Page, iter_sorted_names, page_args
+from profiles import PROFILES
+from services import Services
+
+# Profiles served by `python app_factory.py` (comma-separated; default: all)
+ENABLED_PROFILES = [name.strip() for name in os.environ.get("K8S_USER_PROFILES", ",".join(PROFILES)).split(",")]
+
+
+# Build one Flask app serving the given provisioning profiles from a shared
+# Services (one API client, namespace cache, store and job queue).
+#
+# With a single profile its routes keep the URLs of the former standalone app
+# (/add_group, /add_users, /api/v1/...); with several, each profile is mounted
+# under /<profile name>/. Groups, users, jobs and metrics are served once at
+# the top level either way.
+def create_app(profiles=None, services=None):
+    names = list(profiles or ENABLED_PROFILES)
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        raise ValueError(f"Unknown profile(s): {', '.join(unknown)}. Available: {', '.join(PROFILES)}.")
+    enabled = [PROFILES[name] for name in names]
+    services = services or Services(rebuild_store=any(profile.rebuild_store for profile in enabled))
+
+    app = Flask(__name__)
+    app.extensions["services"] = services
+
+    nav = []
+    for profile in enabled:
+        blueprint = profile.blueprint(services)
+        app.register_blueprint(blueprint, url_prefix=f"/{profile.name}" if len(enabled) > 1 else None)
+        for label, endpoint in profile.nav:
+            nav.append((f"{profile.title}: {label}" if len(enabled) > 1 else label, f"{blueprint.name}.{endpoint}"))
+    nav += [("List Groups", "list_groups_page"), ("List Users", "list_users_page"), ("Delete Group", "delete_group_page")]
+
+    # Large onboarding batches run in the background and are polled at /jobs/<id>
+    app.register_blueprint(create_jobs_blueprint(services))
+
+    # Prometheus metrics at /metrics; the cache and jobs are reported once they exist
+    metrics.init_app(
+        app,
+        namespace_cache=lambda: services.loaded("namespace_cache"),
+        job_queue=lambda: services.loaded("job_queue"),
+    )
+
+    # Changes made while handling a request are audited under this actor
+    @app.before_request
+    def set_audit_actor():
+        audit.actor.set(request.headers.get(audit.AUDIT_ACTOR_HEADER) or request.remote_user or request.remote_addr)
+
+    @app.context_processor
+    def navigation():
+        return {"nav": [(label, url_for(endpoint)) for label, endpoint in nav]}
+
+    # Liveness: the process is serving requests
+    @app.route("/healthz")
+    def healthz():
+        return jsonify({"status": "ok"})
+
+    # Readiness: 503 while draining or when the store or API server is unreachable
+    @app.route("/readyz")
+    def readyz():
+        ready, checks = services.readiness()
+        return jsonify({"ready": ready, "checks": checks}), 200 if ready else 503
+
+    @app.route("/")
+    def home():
+        return render_template("home.html")
+
+    @app.route("/list_groups")
+    def list_groups_page():
+        prefix, after, limit = page_args()
+        try:
+            group_namespaces = services.namespace_cache.names()
+        except client.exceptions.ApiException as e:
+            group_namespaces = []
+            print(f"An error occurred while listing namespaces: {e}")
+        groups = Page(iter_sorted_names(group_namespaces, prefix, after), limit, prefix)
+        return stream_template("list_groups.html", groups=groups)
+
+    @app.route("/list_groups/cache")
+    def namespace_cache_stats():
+        return jsonify(services.namespace_cache.stats())
+
+    # Access reviews answered from the RoleBinding index: the roles of a
+    # subject (a User unless ?kind=Group or ?kind=ServiceAccount&namespace=...)
+    # and the subjects of each role in a namespace
+    @app.route("/access/<name>")
+    def subject_access(name):
+        kind = request.args.get("kind", "User")
+        namespace = request.args.get("namespace")
+        subject = {"kind": kind, "name": name}
+        if kind == "ServiceAccount":
+            subject["namespace"] = namespace
+        index = services.rbac_index
+        return jsonify({"subject": subject, "access": index.access(name, kind, namespace), "synced": index.synced})
+
+    @app.route("/access/namespace/<namespace>")
+    def namespace_access(namespace):
+        index = services.rbac_index
+        return jsonify({"namespace": namespace, "roles": index.namespace_access(namespace), "synced": index.synced})
+
+    @app.route("/access/index/stats")
+    def rbac_index_stats():
+        return jsonify(services.rbac_index.stats())
+
+    # Audit records as NDJSON, oldest first, filtered by ?user=, ?group= and
+    # ?since= / ?until= (epoch seconds or ISO 8601), at most ?limit= of them
+    @app.route("/audit")
+    def audit_records():
+        try:
+            since, until = audit.parse_time(request.args.get("since")), audit.parse_time(request.args.get("until"))
+            limit = int(request.args.get("limit", "1000"))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query: {e}"}), 400
+        audit.journal.flush()
+        records = audit.read(
+            audit.journal.directory, request.args.get("user"), request.args.get("group"), since, until
+        )
+
+        def generate():
+            for count, entry in enumerate(records):
+                if count >= limit:
+                    break
+                yield json.dumps(entry) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    @app.route("/audit/stats")
+    def audit_stats():
+        return jsonify(audit.journal.stats())
+
+    @app.route("/list_users")
+    def list_users_page():
+        prefix, after, limit = page_args()
+        user_groups = Page(services.store.iter_user_groups(prefix, after), limit, prefix)
+        return stream_template("list_users.html", user_groups=user_groups)
+
+    @app.route("/delete_group", methods=["GET", "POST"])
+    def delete_group_page():
+        message = ""
+        if request.method == "POST":
+            group_name = request.form.get("group_name")
+            if group_name:
+                message, _ = services.remove_group(
+                    group_name, delete_namespace=request.form.get("delete_namespace") == "on"
+                )
+        return render_template("delete_group.html", message=message)
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(debug=True)
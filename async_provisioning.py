@@ -0,0 +1,273 @@
+import asyncio
+import os
+import threading
+import time
+
+from kubernetes import client
+
+import aggregated_bindings
+import audit
+import k8s_client
+import metrics
+from aggregated_bindings import AsyncSubjectBatcher
+from k8s_retry import rate_limiter, retry_policy
+from k8s_writes import (
+    APPLY_CONTENT_TYPE,
+    FIELD_MANAGER,
+    WRITE_MODE,
+    aggregated_role_binding_name,
+    apply_body,
+    group_role_binding_body,
+    mark_managed,
+    namespace_body,
+    serialize,
+    service_account_body,
+    service_account_conflict,
+    user_role_binding_body,
+)
+from metrics import BATCH_SIZE, IN_FLIGHT_USERS
+
+# kubernetes_asyncio is optional; without it onboarding jobs keep using worker threads
+try:
+    from kubernetes_asyncio import client as async_client, config as async_config
+except ImportError:
+    async_client = async_config = None
+
+# Run onboarding jobs on the asyncio engine instead of a thread per user in flight
+ASYNC_PROVISIONING = os.environ.get("K8S_ASYNC_PROVISIONING", "0") == "1"
+
+# Users the engine provisions at the same time. They are all tasks on one
+# event loop, so this can be far higher than ADD_USERS_MAX_IN_FLIGHT.
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get("ASYNC_MAX_IN_FLIGHT", "1000"))
+
+# Connections the engine keeps open to the API server
+ASYNC_POOL_MAXSIZE = int(os.environ.get("K8S_ASYNC_POOL_MAXSIZE", "256"))
+
+
+# Provisioning engine on kubernetes_asyncio. It owns an event loop running in
+# a background thread, so the Flask views and job workers (plain threads) hand
+# it whole batches with run() and thousands of API calls can be in flight at
+# once without a thread each.
+#
+# The helpers mirror those of Services and return the same messages; calls go
+# through the same rate limit, retry policy and latency stats as the
+# synchronous client. short_names returns the short-name index reservations
+# are given back to, or None while it does not exist.
+class AsyncProvisioner:
+    def __init__(self, max_in_flight=ASYNC_MAX_IN_FLIGHT, short_names=None):
+        self.max_in_flight = max_in_flight
+        self.short_names = short_names
+        self.v1 = None
+        self.rbac_api = None
+        self.subjects = AsyncSubjectBatcher(k8s_client.rbac_api()) if aggregated_bindings.aggregated() else None
+        self._api = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-provisioner", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.run(self._connect())
+        return self
+
+    def stop(self):
+        if self._api is not None:
+            self.run(self._api.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    # Run a coroutine on the engine's loop and wait for its result; called
+    # from any thread but the loop's own
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    # runner for JobQueue.submit: provisions the job's users with the
+    # coroutine function provision_one
+    def runner(self, provision_one):
+        return lambda users, on_result: self.run(self.provision_users(users, provision_one, on_result=on_result))
+
+    # Same configuration sources as k8s_client.load_configuration. The
+    # ApiClient is created on the loop, which its aiohttp session belongs to.
+    async def _connect(self):
+        configuration = async_client.Configuration()
+        if k8s_client.API_HOST:
+            configuration.host = k8s_client.API_HOST
+        else:
+            try:
+                async_config.load_incluster_config(client_configuration=configuration)
+            except async_config.ConfigException:
+                await async_config.load_kube_config(client_configuration=configuration)
+        configuration.connection_pool_maxsize = ASYNC_POOL_MAXSIZE
+        self._api = async_client.ApiClient(configuration)
+        self.v1 = async_client.CoreV1Api(self._api)
+        self.rbac_api = async_client.RbacAuthorizationV1Api(self._api)
+
+    # One API call with the default timeouts, the shared rate limit and retries
+    async def _call(self, verb, fn, **kwargs):
+        kwargs.setdefault("_request_timeout", (k8s_client.CONNECT_TIMEOUT, k8s_client.READ_TIMEOUT))
+
+        async def attempt():
+            await rate_limiter.acquire_async()
+            start = time.monotonic()
+            failed = True
+            try:
+                response = await fn(**kwargs)
+                failed = False
+                return response
+            finally:
+                k8s_client.latency.record(verb, time.monotonic() - start, failed)
+
+        return await retry_policy.call_async(attempt, async_client.exceptions.ApiException)
+
+    # Create-or-skip with the same K8S_WRITE_MODE handling as k8s_writes.
+    # Returns 201 when the object was created; errors other than 409
+    # Conflict are raised.
+    async def _write(self, create, patch, body, api_version, kind, mode=None, **path):
+        mode = mode or WRITE_MODE
+        mark_managed(body)
+        try:
+            if mode == "apply":
+                _, status, _ = await self._call(
+                    "PATCH", patch,
+                    name=body.metadata.name,
+                    body=apply_body(body, api_version, kind),
+                    field_manager=FIELD_MANAGER,
+                    force=True,
+                    _content_type=APPLY_CONTENT_TYPE,
+                    **path,
+                )
+                return status
+            await self._call("POST", create, body=serialize(body), **path)
+            return 201
+        except async_client.exceptions.ApiException as e:
+            if e.status != 409:
+                raise
+            return 409
+
+    # Async create_namespace; returns (message, created). Like ensure_namespace
+    # it always creates, never applies.
+    @metrics.timed_call("create_namespace")
+    @audit.audited("create", "Namespace", skipped=audit.already_existed, group="name", name="name")
+    async def create_namespace(self, name):
+        try:
+            status = await self._write(
+                self.v1.create_namespace, self.v1.patch_namespace_with_http_info, namespace_body(name), "v1", "Namespace",
+                mode="create",
+            )
+        except async_client.exceptions.ApiException as e:
+            return f"An error occurred: {e}", False
+        if status != 201:
+            return f"Namespace '{name}' already exists.", False
+        return f"Namespace '{name}' created successfully.", True
+
+    async def _write_role_binding(self, namespace, role_binding):
+        await self._write(
+            self.rbac_api.create_namespaced_role_binding,
+            self.rbac_api.patch_namespaced_role_binding_with_http_info,
+            role_binding, "rbac.authorization.k8s.io/v1", "RoleBinding",
+            namespace=namespace,
+        )
+
+    # Async create_rolebinding
+    @metrics.timed_call("create_rolebinding")
+    @audit.audited(
+        "create", "RoleBinding", group="namespace", name=lambda a: f"{a['group']}-rolebinding", role="role_name"
+    )
+    async def create_rolebinding(self, namespace, group, role_name="admin"):
+        try:
+            await self._write_role_binding(namespace, group_role_binding_body(namespace, group, role_name))
+            return f"RoleBinding '{group}-rolebinding' created in namespace '{namespace}'."
+        except async_client.exceptions.ApiException as e:
+            return f"An error occurred: {e}"
+
+    # Async create_user_rolebinding. Aggregated RoleBindings are written
+    # through the synchronous client, one write per batch of waiting users.
+    @metrics.timed_call("create_user_rolebinding")
+    @audit.audited("create", "RoleBinding", group="namespace", user="username", role="role_name")
+    async def create_user_rolebinding(self, namespace, username, role_name="admin"):
+        try:
+            if self.subjects is not None:
+                await self.subjects.add(namespace, role_name, username)
+                return (
+                    f"User '{username}' added to RoleBinding '{aggregated_role_binding_name(role_name)}' "
+                    f"in namespace '{namespace}'."
+                )
+            await self._write_role_binding(namespace, user_role_binding_body(namespace, username, role_name))
+            return f"RoleBinding '{username}-{role_name}-binding' created in namespace '{namespace}'."
+        except (async_client.exceptions.ApiException, client.exceptions.ApiException) as e:
+            return f"An error occurred: {e}"
+
+    def _release_short_name(self, namespace, short_name):
+        short_names = self.short_names() if self.short_names is not None else None
+        if short_names is not None:
+            short_names.release(namespace, short_name)
+
+    # Async create_service_account. Like apply_service_account it always
+    # creates first and keeps an existing account only if it belongs to the
+    # same user. A short name reserved for it is given back if the create
+    # fails.
+    @metrics.timed_call("create_service_account")
+    @audit.audited("create", "ServiceAccount", group="namespace", name="short_name", user="username")
+    async def create_service_account(self, namespace, short_name, username, pull_secret=None):
+        body = service_account_body(short_name, username, pull_secret)
+
+        def write(mode):
+            return self._write(
+                self.v1.create_namespaced_service_account,
+                self.v1.patch_namespaced_service_account_with_http_info,
+                body, "v1", "ServiceAccount", mode=mode, namespace=namespace,
+            )
+
+        try:
+            if await write("create") == 409:
+                existing = await self._call(
+                    "GET", self.v1.read_namespaced_service_account, name=short_name, namespace=namespace
+                )
+                conflict = service_account_conflict(existing, body)
+                if conflict is not None:
+                    raise conflict
+                if WRITE_MODE == "apply":
+                    await write("apply")
+        except (async_client.exceptions.ApiException, client.exceptions.ApiException) as e:
+            self._release_short_name(namespace, short_name)
+            return f"An error occurred while creating the ServiceAccount: {e}"
+        if pull_secret:
+            return f"ServiceAccount '{short_name}' created with imagePullSecret '{pull_secret}' in namespace '{namespace}'."
+        return f"ServiceAccount '{short_name}' created in namespace '{namespace}' with label 'hpc/long-account: {username}'."
+
+    # Async counterpart of bulk_provision.provision_users: every user is a task
+    # on the loop, at most max_in_flight of them provisioning at once. Results
+    # come back in input order with the wall-clock time in seconds.
+    async def provision_users(self, users, provision_one, on_result=None):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def run(user):
+            async with semaphore:
+                IN_FLIGHT_USERS.inc()
+                try:
+                    message = await provision_one(user)
+                except Exception as e:
+                    message = f"An error occurred: {e}"
+                finally:
+                    IN_FLIGHT_USERS.dec()
+            result = {"user": user, "message": message, "ok": "An error occurred" not in message}
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        start = time.monotonic()
+        if not users:
+            return [], 0.0
+        BATCH_SIZE.observe(len(users))
+        results = await asyncio.gather(*(run(user) for user in users))
+        return list(results), time.monotonic() - start
+
+
+# The started engine when K8S_ASYNC_PROVISIONING=1 and kubernetes_asyncio is
+# installed, else None
+def create_engine(short_names=None):
+    if not ASYNC_PROVISIONING:
+        return None
+    if async_client is None:
+        print("K8S_ASYNC_PROVISIONING is set but kubernetes_asyncio is not installed; using worker threads.")
+        return None
+    return AsyncProvisioner(short_names=short_names).start()
@@ -0,0 +1,340 @@
+import argparse
+import contextvars
+import datetime
+import functools
+import glob
+import gzip
+import heapq
+import inspect
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+# Directory of the audit journal ("" turns it off). Every process appends to
+# its own segment, journal-<start ms>-<pid>.ndjson; full segments are renamed
+# to journal-<start ms>-<end ms>-<pid>.ndjson and gzipped.
+AUDIT_LOG_DIR = os.environ.get("AUDIT_LOG_DIR", "audit")
+
+# Size at which a segment is closed and compressed
+AUDIT_MAX_BYTES = int(os.environ.get("AUDIT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Longest time written records may wait for an fsync
+AUDIT_FSYNC_INTERVAL = float(os.environ.get("AUDIT_FSYNC_INTERVAL", "1"))
+
+# Records waiting for the writer before record() blocks instead of growing the queue
+AUDIT_QUEUE_MAX = int(os.environ.get("AUDIT_QUEUE_MAX", "100000"))
+
+# Request header naming who made a change; otherwise the authenticated remote
+# user or address is recorded
+AUDIT_ACTOR_HEADER = os.environ.get("AUDIT_ACTOR_HEADER", "X-Remote-User")
+
+# Who is making the current change. Set per request; bind_actor carries it
+# into worker threads, and the async engine's tasks inherit it.
+actor = contextvars.ContextVar("audit_actor", default=None)
+
+
+# fn wrapped to run with the current actor, for handing work to another thread
+def bind_actor(fn):
+    current = actor.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = actor.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            actor.reset(token)
+
+    return run
+
+
+# Append-only NDJSON audit journal with group commit.
+#
+# record() only queues the entry. A writer thread takes everything queued at
+# once, writes it with a single write() and fsyncs at most every
+# AUDIT_FSYNC_INTERVAL seconds, so a 10k-user batch costs the provisioning
+# path one queue append per change. flush() waits until everything recorded
+# so far is on disk.
+class AuditJournal:
+    def __init__(self, directory=AUDIT_LOG_DIR, max_bytes=AUDIT_MAX_BYTES, fsync_interval=AUDIT_FSYNC_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._recorded = 0
+        self._durable = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self._compressing = []
+        self._file = None
+        self._path = None
+        self._start_ms = None
+        self.batches = 0
+        self.fsyncs = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def record(self, **fields):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-journal", daemon=True)
+                self._thread.start()
+            self._changed.wait_for(lambda: len(self._pending) < AUDIT_QUEUE_MAX or self._closed)
+            if self._closed:
+                return
+            entry = {"ts": round(time.time(), 6), "actor": actor.get()}
+            entry.update((key, value) for key, value in fields.items() if value is not None)
+            self._pending.append(entry)
+            self._recorded += 1
+            self._changed.notify_all()
+
+    # Wait until every record so far is written and fsynced
+    def flush(self, timeout=10):
+        with self._lock:
+            if self._thread is None:
+                return True
+            target = self._recorded
+            self._flush_requested = True
+            self._changed.notify_all()
+            return self._changed.wait_for(lambda: self._durable >= target, timeout)
+
+    def close(self, timeout=10):
+        self.flush(timeout)
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for thread in list(self._compressing):
+            thread.join(timeout)
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._start_ms = int(time.time() * 1000)
+        self._path = os.path.join(self.directory, f"journal-{self._start_ms}-{os.getpid()}.ndjson")
+        self._file = open(self._path, "ab")
+
+    # Close the full segment and compress it off the write path
+    def _rotate(self):
+        self._file.close()
+        final = os.path.join(self.directory, f"journal-{self._start_ms}-{int(time.time() * 1000)}-{os.getpid()}.ndjson")
+        os.rename(self._path, final)
+        self._file = None
+        thread = threading.Thread(target=self._compress, args=(final,), name="audit-compress", daemon=True)
+        self._compressing.append(thread)
+        thread.start()
+
+    def _compress(self, path):
+        try:
+            with open(path, "rb") as source, gzip.open(f"{path}.gz.tmp", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.rename(f"{path}.gz.tmp", f"{path}.gz")
+            os.remove(path)
+        except OSError as e:
+            print(f"An error occurred while compressing audit segment '{path}': {e}")
+        finally:
+            self._compressing.remove(threading.current_thread())
+
+    def _run(self):
+        last_fsync = time.monotonic()
+        written = 0
+        while True:
+            with self._lock:
+                self._changed.wait_for(
+                    lambda: self._pending or self._closed or (self._flush_requested and written > self._durable),
+                    timeout=self.fsync_interval if written > self._durable else None,
+                )
+                entries, self._pending = self._pending, []
+                flush, self._flush_requested = self._flush_requested, False
+                closed = self._closed
+                self._changed.notify_all()
+            try:
+                if entries:
+                    if self._file is None:
+                        self._open()
+                    self._file.write("".join(json.dumps(e, separators=(",", ":")) + "\n" for e in entries).encode())
+                    written += len(entries)
+                    self.batches += 1
+                full = self._file is not None and self._file.tell() >= self.max_bytes
+                if self._file is not None and written > self._durable and (
+                    flush or closed or full or time.monotonic() - last_fsync >= self.fsync_interval
+                ):
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self.fsyncs += 1
+                    last_fsync = time.monotonic()
+                    with self._lock:
+                        self._durable = written
+                        self._changed.notify_all()
+                    if full:
+                        self._rotate()
+            except OSError as e:
+                print(f"An error occurred while writing the audit journal: {e}")
+            if closed and not entries:
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "recorded": self._recorded,
+                "durable": self._durable,
+                "pending": len(self._pending),
+                "batches": self.batches,
+                "fsyncs": self.fsyncs,
+                "segment": self._path,
+            }
+
+
+journal = AuditJournal()
+
+
+# ok and message of a helper's result: its message (alone or in a tuple), or
+# for a dict result its errors
+def _outcome(result):
+    if isinstance(result, dict):
+        return not result.get("errors"), None
+    if isinstance(result, tuple):
+        result = next((value for value in result if isinstance(value, str)), None)
+    if isinstance(result, str):
+        return "An error occurred" not in result, result
+    return True, None
+
+
+# skipped for create-or-skip helpers returning (message, created): the call
+# found the object already there and changed nothing
+def already_existed(result):
+    message, created = result
+    return not created and "An error occurred" not in message
+
+
+# Record every call of a Kubernetes helper in the journal. fields maps record
+# keys (group, name, user, role, ...) to the helper's argument names, or to
+# functions of the bound arguments. Calls for which skipped(result) is true
+# changed nothing and are recorded with action "skip". Works for coroutine
+# helpers too.
+def audited(action, kind, skipped=None, **fields):
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def write(args, kwargs, result):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            values = arguments.arguments
+            ok, message = _outcome(result)
+            entry = {
+                key: field(values) if callable(field) else values.get(field)
+                for key, field in fields.items()
+            }
+            recorded = "skip" if skipped is not None and skipped(result) else action
+            journal.record(action=recorded, kind=kind, **entry, ok=ok, message=message)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                result = await fn(*args, **kwargs)
+                write(args, kwargs, result)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            write(args, kwargs, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# Segments of the journal with their time span in seconds, skipping plain
+# segments whose compressed copy is already complete
+def _segments(directory):
+    paths = glob.glob(os.path.join(directory, "journal-*.ndjson")) + glob.glob(os.path.join(directory, "journal-*.ndjson.gz"))
+    for path in paths:
+        if not path.endswith(".gz") and os.path.exists(f"{path}.gz"):
+            continue
+        parts = os.path.basename(path).split(".")[0].split("-")[1:]
+        start = int(parts[0]) / 1000
+        end = int(parts[1]) / 1000 if len(parts) == 3 else float("inf")
+        yield path, start, end
+
+
+def _read_segment(path, needles, since, until):
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rb") as f:
+            for line in f:
+                # Cheap checks on the raw line before parsing it: the timestamp
+                # is the first field, and filters are exact "key":"value" pairs
+                ts = float(line[6:line.index(b",")])
+                if (since is not None and ts < since) or (until is not None and ts >= until):
+                    continue
+                if all(needle in line for needle in needles):
+                    yield json.loads(line)
+    except (OSError, ValueError, EOFError) as e:
+        print(f"An error occurred while reading audit segment '{path}': {e}")
+
+
+# Records matching every given filter, oldest first. user and group match the
+# record fields exactly; since and until are epoch seconds. Segments outside
+# the time range are not opened.
+def read(directory=AUDIT_LOG_DIR, user=None, group=None, since=None, until=None):
+    if not directory:
+        return iter(())
+    needles = [
+        f'"{key}":{json.dumps(value)}'.encode()
+        for key, value in (("user", user), ("group", group))
+        if value is not None
+    ]
+    readers = [
+        _read_segment(path, needles, since, until)
+        for path, start, end in _segments(directory)
+        if (until is None or start < until) and (since is None or end >= since)
+    ]
+    return heapq.merge(*readers, key=lambda entry: entry["ts"])
+
+
+# Epoch seconds from a number or an ISO 8601 time (UTC unless it has an offset)
+def parse_time(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        return moment.timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print audit journal records as NDJSON, oldest first.")
+    parser.add_argument("--dir", default=AUDIT_LOG_DIR, help="journal directory")
+    parser.add_argument("--user", help="only records for this user")
+    parser.add_argument("--group", help="only records for this group")
+    parser.add_argument("--since", help="epoch seconds or ISO 8601 time")
+    parser.add_argument("--until", help="epoch seconds or ISO 8601 time")
+    args = parser.parse_args(argv)
+
+    for entry in read(args.dir, args.user, args.group, parse_time(args.since), parse_time(args.until)):
+        sys.stdout.write(json.dumps(entry) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
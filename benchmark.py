@@ -0,0 +1,357 @@
+import argparse
+import functools
+import importlib.util
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_apiserver import FakeApiServer
+
+# Throughput benchmark for the add_group / add_users / edit_users flows.
+#
+# Every app module runs in-process against fake_apiserver.FakeApiServer and is
+# driven through its Flask test client. For each scenario the report gives
+# ops/sec (groups or users per second), p50/p99 latency of the HTTP requests
+# (for background-job flows, until the job has finished) and the API calls
+# the fake server received.
+#
+#   python benchmark.py --users 10000 --latency 0.005 --throttle-rate 0.02
+#   python benchmark.py --save-baseline benchmarks/baseline.json
+#   python benchmark.py --baseline benchmarks/baseline.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+JOB_ID = re.compile(r"Queued job (?:'|&#39;)([0-9a-f]+)")
+
+_apps = {}
+
+
+# Import an app script (most have dashes in their names) once per run
+def load_app(filename):
+    if filename not in _apps:
+        name = os.path.splitext(filename)[0].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(f"bench_{name}", os.path.join(HERE, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _apps[filename] = module
+    return _apps[filename]
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# "An error occurred" messages in a page; a 5xx response counts as at least one
+def errors_in(response):
+    errors = response.get_data(as_text=True).count("An error occurred")
+    return max(errors, 1) if response.status_code >= 500 else errors
+
+
+# Wait for every job queued by a response and return its failed user count
+def wait_for_jobs(module, response):
+    failed = 0
+    for job_id in JOB_ID.findall(response.get_data(as_text=True)):
+        job = module.app.extensions["services"].job_queue.get(job_id)
+        while job.status in ("queued", "running"):
+            time.sleep(0.005)
+        failed += job.to_dict()["failed"] + sum("An error occurred" in m for m in job.messages)
+    return failed
+
+
+def usernames(prefix, count):
+    return [f"{prefix}-u{i}" for i in range(count)]
+
+
+def short_names(prefix, count):
+    return [f"{prefix}-s{i}" for i in range(count)]
+
+
+# Each scenario does its untimed setup and returns the timed requests as
+# callables that return (ops, errors)
+
+def add_group(args):
+    client = load_app("app.py").app.test_client()
+
+    def request(name):
+        return 1, errors_in(client.post("/add_group", data={"group_name": name}))
+
+    return [functools.partial(request, f"bench-group-{i}") for i in range(args.groups)]
+
+
+def sa_add_users(args):
+    module = load_app("sa-appl.py")
+    client = module.app.test_client()
+
+    def request(batch):
+        response = client.post("/add_users", data={
+            "usernames": ",".join(u for u, _ in batch),
+            "short_names": ",".join(s for _, s in batch),
+            "group": "bench-sa",
+            "role": "edit",
+        })
+        return len(batch), errors_in(response) + wait_for_jobs(module, response)
+
+    names = list(zip(usernames("sa", args.users), short_names("sa", args.users)))
+    return [functools.partial(request, batch) for batch in chunks(names, args.batch_size)]
+
+
+# Same as sa_add_users, but the short names are generated from the usernames
+def sa_generated_names(args):
+    module = load_app("sa-appl.py")
+    client = module.app.test_client()
+
+    def request(batch):
+        response = client.post("/add_users", data={
+            "usernames": ",".join(f"{u}@example.org" for u in batch),
+            "group": "bench-sa-generated",
+            "role": "edit",
+        })
+        return len(batch), errors_in(response) + wait_for_jobs(module, response)
+
+    return [functools.partial(request, batch) for batch in chunks(usernames("sagen", args.users), args.batch_size)]
+
+
+def multi_add_users(args):
+    module = load_app("multi-app.py")
+    client = module.app.test_client()
+
+    def request(batch):
+        response = client.post("/add_users", data={"usernames": ",".join(batch), "group": "bench-multi", "role": "edit"})
+        return len(batch), errors_in(response) + wait_for_jobs(module, response)
+
+    return [functools.partial(request, batch) for batch in chunks(usernames("multi", args.users), args.batch_size)]
+
+
+def image_pull_add_users(args):
+    module = load_app("image-pull-app.py")
+    client = module.app.test_client()
+
+    def request(batch):
+        response = client.post("/add_user", data={
+            "users": ", ".join(f"{u}:{s}" for u, s in batch),
+            "group": "bench-pull",
+        })
+        return len(batch), errors_in(response) + wait_for_jobs(module, response)
+
+    names = list(zip(usernames("pull", args.users), short_names("pull", args.users)))
+    return [functools.partial(request, batch) for batch in chunks(names, args.batch_size)]
+
+
+def shortname_add_users(args):
+    module = load_app("shortname-app.py")
+    client = module.app.test_client()
+    client.post("/add_group", data={"group_name": "bench-short"})
+
+    def request(batch):
+        response = client.post("/add_users", data={
+            "usernames": ",".join(u for u, _ in batch),
+            "short_names": ",".join(s for _, s in batch),
+            "group": "bench-short",
+            "role": "edit",
+        })
+        return len(batch), errors_in(response) + wait_for_jobs(module, response)
+
+    names = list(zip(usernames("short", args.users), short_names("short", args.users)))
+    return [functools.partial(request, batch) for batch in chunks(names, args.batch_size)]
+
+
+def perms_add_user(args):
+    client = load_app("app_witth_perms.py").app.test_client()
+    client.post("/add_group", data={"group_name": "bench-perms"})
+
+    def request(username):
+        response = client.post("/add_user", data={"username": username, "group": "bench-perms", "role": "edit"})
+        return 1, errors_in(response)
+
+    return [functools.partial(request, username) for username in usernames("perms", args.users)]
+
+
+def _user_records(prefix, group, count):
+    return [
+        {"username": u, "short_name": s, "group": group, "role": "edit"}
+        for u, s in zip(usernames(prefix, count), short_names(prefix, count))
+    ]
+
+
+def api_batch(args):
+    client = load_app("sa-appl.py").app.test_client()
+    client.post("/api/v1/groups", json={"name": "bench-api"})
+
+    def request(batch):
+        return len(batch), client.post("/api/v1/users:batch", json=batch).get_json()["failed"]
+
+    return [functools.partial(request, batch) for batch in chunks(_user_records("api", "bench-api", args.users), args.batch_size)]
+
+
+# The edit scenarios first create their users through the JSON API
+def _seed_edit_users(prefix, group, count):
+    client = load_app("sa-appl.py").app.test_client()
+    client.post("/api/v1/groups", json={"name": group})
+    records = _user_records(prefix, group, count)
+    for batch in chunks(records, 1000):
+        client.post("/api/v1/users:batch", json=batch)
+    return [f"{r['group']}/{r['short_name']}/{r['username']}" for r in records]
+
+
+def edit_bulk_update(args):
+    selected = _seed_edit_users("move", "bench-move", args.users)
+    client = load_app("edit-user-app.py").app.test_client()
+
+    def request(batch):
+        response = client.post("/edit_users", data={"action": "bulk_update", "new_role": "view", "selected": batch})
+        return len(batch), errors_in(response)
+
+    return [functools.partial(request, batch) for batch in chunks(selected, args.batch_size)]
+
+
+def edit_bulk_delete(args):
+    selected = _seed_edit_users("del", "bench-del", args.users)
+    client = load_app("edit-user-app.py").app.test_client()
+
+    def request(batch):
+        response = client.post("/edit_users", data={"action": "bulk_delete", "selected": batch})
+        return len(batch), errors_in(response)
+
+    return [functools.partial(request, batch) for batch in chunks(selected, args.batch_size)]
+
+
+SCENARIOS = {
+    "add_group": add_group,
+    "sa_add_users": sa_add_users,
+    "sa_generated_names": sa_generated_names,
+    "multi_add_users": multi_add_users,
+    "image_pull_add_users": image_pull_add_users,
+    "shortname_add_users": shortname_add_users,
+    "perms_add_user": perms_add_user,
+    "api_batch": api_batch,
+    "edit_bulk_update": edit_bulk_update,
+    "edit_bulk_delete": edit_bulk_delete,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_scenario(name, args):
+    requests = SCENARIOS[name](args)
+    args.server.reset_stats()
+    latencies = []
+    ops = errors = 0
+    start = time.monotonic()
+    for request in requests:
+        request_start = time.monotonic()
+        done, failed = request()
+        latencies.append(time.monotonic() - request_start)
+        ops += done
+        errors += failed
+    elapsed = time.monotonic() - start
+    stats = args.server.stats()
+    return {
+        "ops": ops,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "ops_per_sec": round(ops / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "api_calls": stats["total_calls"],
+        "api_calls_per_op": round(stats["total_calls"] / ops, 2) if ops else 0.0,
+        "throttled": stats["throttled"],
+        "calls": stats["calls"],
+    }
+
+
+def print_report(results):
+    print(f"{'scenario':<22}{'ops':>8}{'errors':>8}{'ops/sec':>10}{'p50 ms':>10}{'p99 ms':>10}{'calls/op':>10}{'429s':>7}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['ops']:>8}{r['errors']:>8}{r['ops_per_sec']:>10}{r['p50_ms']:>10}"
+              f"{r['p99_ms']:>10}{r['api_calls_per_op']:>10}{r['throttled']:>7}")
+
+
+# Regressions against a saved baseline: lower throughput or higher p99 beyond
+# the tolerance, or more API calls per op than before
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, r in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if r["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: ops/sec {r['ops_per_sec']} < baseline {base['ops_per_sec']}")
+        if r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {r['p99_ms']} ms > baseline {base['p99_ms']} ms")
+        if r["api_calls_per_op"] > base["api_calls_per_op"] * (1 + tolerance):
+            regressions.append(f"{name}: {r['api_calls_per_op']} API calls/op > baseline {base['api_calls_per_op']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the apps against a fake Kubernetes API server.")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all): {', '.join(SCENARIOS)}.")
+    parser.add_argument("--users", type=int, default=1000, help="Users per user scenario.")
+    parser.add_argument("--groups", type=int, default=100, help="Groups for add_group.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users per request in the batch flows.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake server adds to every request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds on top of --latency.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429.")
+    parser.add_argument("--qps", type=float, help="Client-side rate limit (K8S_QPS); 0 disables it.")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to PATH.")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare against the results saved in PATH.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 0.2).")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    server = FakeApiServer(
+        latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+    ).start()
+    args.server = server
+    workdir = tempfile.mkdtemp(prefix="k8s-user-bench-")
+
+    # Must be set before the apps import k8s_client and user_store
+    os.environ["K8S_API_HOST"] = server.url
+    os.environ["USER_STORE_PATH"] = os.path.join(workdir, "bench.db")
+    if args.qps is not None:
+        os.environ["K8S_QPS"] = str(args.qps)
+
+    parameters = {k: getattr(args, k) for k in ("users", "groups", "batch_size", "latency", "jitter", "throttle_rate")}
+    print(f"Fake API server at {server.url}; {parameters}")
+    results = {}
+    try:
+        for name in args.scenarios or SCENARIOS:
+            results[name] = run_scenario(name, args)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_report(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({"parameters": parameters, "results": results}, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != parameters:
+            print(f"Warning: baseline was recorded with {baseline['parameters']}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
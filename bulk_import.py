@@ -0,0 +1,185 @@
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+
+from bulk_provision import provision_users
+
+# Rows provisioned per chunk; the checkpoint advances after every chunk
+CHUNK_SIZE = 500
+
+# Failures kept for the summary; the rest are only counted
+MAX_REPORTED_FAILURES = 1000
+
+IMPORT_FIELDS = ("username", "short_name", "group", "role", "pull_secret")
+
+# Formats iter_rows reads
+IMPORT_FORMATS = ("csv", "ndjson")
+
+DNS_1123_LABEL = re.compile(r"[a-z0-9]([-a-z0-9]{0,61}[a-z0-9])?")
+
+
+# Yield (row_number, record) from a binary CSV or NDJSON stream, one row at a
+# time. Row numbers count data rows from 0 and are what checkpoints store.
+def iter_rows(stream, fmt="csv"):
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "ndjson":
+        row_number = 0
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {"_error": f"Invalid JSON: {e}"}
+            yield row_number, record
+            row_number += 1
+    else:
+        for row_number, row in enumerate(csv.DictReader(text)):
+            yield row_number, {key.strip(): (value or "").strip() for key, value in row.items() if key}
+
+
+def validate_row(record):
+    if not isinstance(record, dict):
+        return "Row must be an object."
+    if "_error" in record:
+        return record["_error"]
+    if not record.get("username") or not record.get("group"):
+        return "Row needs at least a username and a group."
+    if not DNS_1123_LABEL.fullmatch(record["group"]):
+        return f"Group '{record['group']}' is not a valid namespace name."
+    short_name = record.get("short_name")
+    if short_name and not DNS_1123_LABEL.fullmatch(short_name):
+        return f"Short name '{short_name}' is not a valid ServiceAccount name."
+    return None
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get("offset", 0)
+
+
+def write_checkpoint(path, offset):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(tmp, path)
+
+
+# Validate and provision rows in chunks, skipping rows before offset. Only the
+# current chunk and a bounded list of failures are held in memory, so the
+# import runs in constant memory regardless of file size. on_chunk(summary),
+# if given, is called after every chunk, once the offset has advanced.
+def run_import(rows, provision_record, offset=0, checkpoint=None, chunk_size=CHUNK_SIZE, on_failure=None,
+               on_chunk=None):
+    summary = {"processed": 0, "succeeded": 0, "failed": 0, "offset": offset, "failures": []}
+
+    def fail(row_number, message):
+        summary["failed"] += 1
+        if len(summary["failures"]) < MAX_REPORTED_FAILURES:
+            summary["failures"].append({"row": row_number, "message": message})
+        if on_failure is not None:
+            on_failure(row_number, message)
+
+    def flush(chunk, next_offset):
+        results, _ = provision_users(chunk, lambda item: provision_record(item[1]))
+        for result in results:
+            if result["ok"]:
+                summary["succeeded"] += 1
+            else:
+                fail(result["user"][0], result["message"])
+        summary["processed"] += len(chunk)
+        summary["offset"] = next_offset
+        write_checkpoint(checkpoint, next_offset)
+        if on_chunk is not None:
+            on_chunk(summary)
+
+    chunk = []
+    for row_number, record in rows:
+        if row_number < offset:
+            continue
+        error = validate_row(record)
+        if error:
+            summary["processed"] += 1
+            fail(row_number, error)
+        else:
+            chunk.append((row_number, {field: record.get(field) or None for field in IMPORT_FIELDS}))
+        if len(chunk) == chunk_size:
+            flush(chunk, row_number + 1)
+            chunk = []
+        summary["offset"] = row_number + 1
+    flush(chunk, summary["offset"])
+    return summary
+
+
+# Provisioner used by the command line, built on the same Services helpers
+# (and audit records) as the web apps: namespace, membership with a checked or
+# generated short name, role, RoleBinding (or aggregated RoleBinding entry)
+# and ServiceAccount for one row.
+def make_cli_provisioner(services):
+    ready_groups = set()
+
+    def provision_record(record):
+        group = record["group"]
+        if group not in ready_groups:
+            message, _ = services.create_namespace(group)
+            if "An error occurred" in message:
+                return message
+            ready_groups.add(group)
+        record, error = services.with_short_name(record)
+        if error:
+            return error
+        username, short_name, role = record["username"], record["short_name"], record["role"]
+        services.store.add_member(group, username, short_name)
+        messages = []
+        if role:
+            services.store.set_role(username, group, role)
+            messages.append(services.create_user_rolebinding(namespace=group, username=username, role_name=role))
+        messages.append(services.create_service_account(group, short_name, username, pull_secret=record["pull_secret"]))
+        errors = [message for message in messages if "An error occurred" in message]
+        return errors[0] if errors else f"User '{username}' added to group '{group}'."
+
+    return provision_record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a CSV or NDJSON user export into the cluster.")
+    parser.add_argument("path", help="CSV or NDJSON file with username, short_name, group, role, pull_secret")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="defaults to the file extension")
+    parser.add_argument("--checkpoint", help="file recording the next row to import; resumes from it if present")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from services import Services
+
+    services = Services()
+    provision_record = make_cli_provisioner(services)
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    offset = read_checkpoint(args.checkpoint)
+    if offset:
+        print(f"Resuming from row {offset}.")
+    with open(args.path, "rb") as f:
+        summary = run_import(
+            iter_rows(f, fmt),
+            provision_record,
+            offset=offset,
+            checkpoint=args.checkpoint,
+            chunk_size=args.chunk_size,
+            on_failure=lambda row, message: print(f"Row {row}: {message}", file=sys.stderr),
+        )
+    services.drain()
+    print(f"Imported {summary['succeeded']}/{summary['processed']} rows ({summary['failed']} failed); next row {summary['offset']}.")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
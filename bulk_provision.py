@@ -0,0 +1,43 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from audit import bind_actor
+from metrics import BATCH_SIZE, IN_FLIGHT_USERS
+
+# Maximum number of users being provisioned at the same time. Each user in
+# flight issues its RoleBinding and ServiceAccount creates back to back.
+MAX_IN_FLIGHT = int(os.environ.get("ADD_USERS_MAX_IN_FLIGHT", "16"))
+
+
+# Run provision_one(user) for every user with bounded concurrency.
+#
+# provision_one returns the message for that user. Results come back in input
+# order as dicts with the user, the message and whether it succeeded, together
+# with the end-to-end wall-clock time in seconds.
+def provision_users(users, provision_one, max_in_flight=MAX_IN_FLIGHT, on_result=None):
+    def run(user):
+        IN_FLIGHT_USERS.inc()
+        try:
+            message = provision_one(user)
+        except Exception as e:
+            message = f"An error occurred: {e}"
+        finally:
+            IN_FLIGHT_USERS.dec()
+        result = {"user": user, "message": message, "ok": "An error occurred" not in message}
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    start = time.monotonic()
+    if not users:
+        return [], 0.0
+    BATCH_SIZE.observe(len(users))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(users)))) as executor:
+        results = list(executor.map(bind_actor(run), users))
+    return results, time.monotonic() - start
+
+
+def summarize(results, elapsed):
+    failed = sum(1 for r in results if not r["ok"])
+    return f"Provisioned {len(results) - failed}/{len(results)} users in {elapsed:.2f}s."
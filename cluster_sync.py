@@ -0,0 +1,89 @@
+import time
+
+from k8s_writes import AGGREGATED_ROLE_LABEL
+
+# Label set on every ServiceAccount and user RoleBinding the apps create;
+# its value is the user's long account name.
+LONG_ACCOUNT_LABEL = "hpc/long-account"
+
+# Objects fetched per list call while rebuilding
+PAGE_SIZE = 500
+
+
+# Yield the items of a paginated list call one page at a time so only a
+# single page is held in memory. Other keyword arguments (e.g. a
+# field_selector) are passed on to list_fn.
+def iter_pages(list_fn, label_selector, page_size=PAGE_SIZE, **kwargs):
+    _continue = None
+    while True:
+        page = list_fn(label_selector=label_selector, limit=page_size, _continue=_continue, **kwargs)
+        yield page.items
+        _continue = page.metadata._continue
+        if not _continue:
+            break
+
+
+# Rebuild the group/user/role indexes in the store from the labelled
+# ServiceAccounts, per-user RoleBindings and aggregated RoleBindings in the
+# cluster. Existing store entries are kept; what the cluster reports is
+# merged on top. Returns counts and the time the rebuild took.
+def rebuild_from_cluster(v1, rbac_api, store, page_size=PAGE_SIZE):
+    start = time.monotonic()
+    service_accounts = 0
+    role_bindings = 0
+
+    for items in iter_pages(v1.list_service_account_for_all_namespaces, LONG_ACCOUNT_LABEL, page_size):
+        by_group = {}
+        for sa in items:
+            username = sa.metadata.labels[LONG_ACCOUNT_LABEL]
+            by_group.setdefault(sa.metadata.namespace, []).append(
+                {"username": username, "short_name": sa.metadata.name}
+            )
+        for group, members in by_group.items():
+            store.add_members(group, members)
+        service_accounts += len(items)
+
+    for items in iter_pages(rbac_api.list_role_binding_for_all_namespaces, LONG_ACCOUNT_LABEL, page_size):
+        by_group = {}
+        roles = []
+        for rb in items:
+            username = rb.metadata.labels[LONG_ACCOUNT_LABEL]
+            by_group.setdefault(rb.metadata.namespace, []).append({"username": username})
+            roles.append((username, rb.metadata.namespace, rb.role_ref.name))
+        for group, members in by_group.items():
+            store.add_members(group, members)
+        store.set_role_rows(roles)
+        role_bindings += len(items)
+
+    # Aggregated RoleBindings: every User subject holds the binding's role
+    for items in iter_pages(rbac_api.list_role_binding_for_all_namespaces, AGGREGATED_ROLE_LABEL, page_size):
+        by_group = {}
+        roles = []
+        for rb in items:
+            for subject in rb.subjects or []:
+                if subject.kind == "User":
+                    by_group.setdefault(rb.metadata.namespace, []).append({"username": subject.name})
+                    roles.append((subject.name, rb.metadata.namespace, rb.role_ref.name))
+        for group, members in by_group.items():
+            store.add_members(group, members)
+        store.set_role_rows(roles)
+        role_bindings += len(items)
+
+    return {
+        "service_accounts": service_accounts,
+        "role_bindings": role_bindings,
+        "seconds": time.monotonic() - start,
+    }
+
+
+def rebuild_on_startup(v1, rbac_api, store):
+    try:
+        stats = rebuild_from_cluster(v1, rbac_api, store)
+        print(
+            f"Rebuilt user state from {stats['service_accounts']} ServiceAccounts and "
+            f"{stats['role_bindings']} RoleBindings in {stats['seconds']:.2f}s."
+        )
+        return stats
+    except Exception as e:
+        print(f"An error occurred while rebuilding user state from the cluster: {e}")
+        return None
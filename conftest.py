@@ -0,0 +1,28 @@
+import pytest
+
+import audit
+import k8s_client
+from fake_apiserver import FakeApiServer
+from services import Services
+
+
+# A fake API server that k8s_client (and so every helper) talks to for the
+# length of one test
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = FakeApiServer("127.0.0.1", 0)
+    server.start()
+    monkeypatch.setattr(k8s_client, "API_HOST", server.url)
+    monkeypatch.setattr(k8s_client, "_api_client", None)
+    yield server
+    server.stop()
+
+
+# Services backed by the fake API server and a store in tmp_path, with the
+# audit journal switched off
+@pytest.fixture
+def services(fake_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(audit.journal, "directory", "")
+    services = Services(store_path=str(tmp_path / "users.db"))
+    yield services
+    services.drain(5)
@@ -0,0 +1,474 @@
+import argparse
+import base64
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Stand-in Kubernetes API server for benchmarks. It keeps namespaces,
+# ServiceAccounts, Secrets and RoleBindings in memory, understands the list,
+# watch, create, read, patch, replace, delete and deletecollection calls the
+# apps make, and can add latency and answer a share of requests with 429.
+
+# resource -> (apiVersion, kind, namespaced)
+RESOURCES = {
+    "namespaces": ("v1", "Namespace", False),
+    "serviceaccounts": ("v1", "ServiceAccount", True),
+    "secrets": ("v1", "Secret", True),
+    "rolebindings": ("rbac.authorization.k8s.io/v1", "RoleBinding", True),
+}
+
+GROUP_PREFIXES = {
+    ("api", "v1"): 2,
+    ("apis", "rbac.authorization.k8s.io"): 3,
+}
+
+# Events kept for watches that resume from a resourceVersion
+WATCH_HISTORY = 10000
+
+
+class ApiError(Exception):
+    def __init__(self, code, reason, message):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+
+
+def _status(code=200, reason="", message=""):
+    return {
+        "kind": "Status",
+        "apiVersion": "v1",
+        "metadata": {},
+        "status": "Success" if code < 400 else "Failure",
+        "reason": reason,
+        "message": message,
+        "code": code,
+    }
+
+
+# Equality-based selectors: "a=b", "a==b", "a!=b", "a" and "!a", comma-separated
+def _matches(selector, values):
+    for term in filter(None, (selector or "").split(",")):
+        term = term.strip()
+        if "!=" in term:
+            key, value = term.split("!=", 1)
+            if values.get(key) == value:
+                return False
+        elif "=" in term:
+            key, value = term.replace("==", "=").split("=", 1)
+            if values.get(key) != value:
+                return False
+        elif term.startswith("!"):
+            if term[1:] in values:
+                return False
+        elif term not in values:
+            return False
+    return True
+
+
+def _field_values(obj):
+    metadata = obj["metadata"]
+    return {"metadata.name": metadata["name"], "metadata.namespace": metadata.get("namespace", "")}
+
+
+def _merge(target, patch):
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+# Listen backlog large enough for clients that open hundreds of connections
+# at once (the async provisioning engine), so connects are not dropped
+class _HTTPServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+
+
+class FakeApiServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 throttle_rate=0.0, retry_after=1, termination_delay=0.5):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.termination_delay = termination_delay
+        self.calls = Counter()
+        self.throttled = 0
+        self._objects = {resource: {} for resource in RESOURCES}
+        self._resource_version = 0
+        self._watchers = []
+        self._history = deque(maxlen=WATCH_HISTORY)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._httpd = _HTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-apiserver", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            calls = dict(self.calls)
+            objects = {resource: len(items) for resource, items in self._objects.items()}
+            throttled = self.throttled
+        return {
+            "calls": {f"{verb} {resource}": count for (verb, resource), count in sorted(calls.items())},
+            "total_calls": sum(calls.values()),
+            "throttled": throttled,
+            "objects": objects,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled = 0
+
+    # Store helpers; callers hold self._lock
+
+    def _next_version(self):
+        self._resource_version += 1
+        return str(self._resource_version)
+
+    @staticmethod
+    def _watching(watcher, resource, obj):
+        w_resource, w_namespace, label_selector, field_selector, _ = watcher
+        return (
+            w_resource == resource
+            and (not w_namespace or obj["metadata"].get("namespace") == w_namespace)
+            and _matches(label_selector, obj["metadata"].get("labels") or {})
+            and _matches(field_selector, _field_values(obj))
+        )
+
+    # Events are also kept in a short history, so a watch that starts from
+    # the resourceVersion of a list also gets the changes made in between
+    def _publish(self, resource, event_type, obj):
+        self._history.append((self._resource_version, resource, event_type, obj))
+        for watcher in self._watchers:
+            if self._watching(watcher, resource, obj):
+                watcher[4].put({"type": event_type, "object": obj})
+
+    def _get(self, resource, namespace, name):
+        obj = self._objects[resource].get((namespace, name))
+        if obj is None:
+            kind = RESOURCES[resource][1]
+            raise ApiError(404, "NotFound", f'{resource} "{name}" not found ({kind})')
+        return obj
+
+    def _check_namespace(self, namespace):
+        if namespace is not None and (None, namespace) not in self._objects["namespaces"]:
+            raise ApiError(404, "NotFound", f'namespaces "{namespace}" not found')
+
+    def _store(self, resource, namespace, obj, event_type):
+        api_version, kind, _ = RESOURCES[resource]
+        obj["apiVersion"], obj["kind"] = api_version, kind
+        obj["metadata"]["resourceVersion"] = self._next_version()
+        self._objects[resource][(namespace, obj["metadata"]["name"])] = obj
+        self._publish(resource, event_type, obj)
+        return obj
+
+    def create(self, resource, namespace, body):
+        with self._lock:
+            self._check_namespace(namespace)
+            metadata = body.setdefault("metadata", {})
+            name = metadata.get("name")
+            if (namespace, name) in self._objects[resource]:
+                raise ApiError(409, "AlreadyExists", f'{resource} "{name}" already exists')
+            metadata.update(uid=str(uuid.uuid4()), creationTimestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            if namespace is not None:
+                metadata["namespace"] = namespace
+            if resource == "namespaces":
+                body["status"] = {"phase": "Active"}
+            return self._store(resource, namespace, body, "ADDED")
+
+    def read(self, resource, namespace, name):
+        with self._lock:
+            return self._get(resource, namespace, name)
+
+    # Merge and apply patches, and full replaces. A resourceVersion in the body
+    # must match the stored object (optimistic concurrency).
+    def update(self, resource, namespace, name, body, replace=False, apply=False):
+        with self._lock:
+            existing = self._objects[resource].get((namespace, name))
+            if existing is None:
+                if not apply:
+                    self._get(resource, namespace, name)
+                body.setdefault("metadata", {})["name"] = name
+                created = True
+            else:
+                created = False
+            version = (body.get("metadata") or {}).get("resourceVersion")
+            if existing is not None and version and version != existing["metadata"]["resourceVersion"]:
+                raise ApiError(409, "Conflict", f'Operation cannot be fulfilled on {resource} "{name}": '
+                                                "the object has been modified")
+        if created:
+            return self.create(resource, namespace, body), 201
+        with self._lock:
+            if replace:
+                metadata = {**body.get("metadata", {}), **{
+                    key: existing["metadata"][key] for key in ("uid", "creationTimestamp") if key in existing["metadata"]
+                }}
+                obj = {**body, "metadata": metadata}
+            else:
+                obj = _merge(json.loads(json.dumps(existing)), body)
+            if namespace is not None:
+                obj["metadata"]["namespace"] = namespace
+            return self._store(resource, namespace, obj, "MODIFIED"), 200
+
+    def delete(self, resource, namespace, name):
+        with self._lock:
+            obj = self._get(resource, namespace, name)
+            if resource == "namespaces":
+                obj["metadata"]["deletionTimestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                obj["status"] = {"phase": "Terminating"}
+                self._store(resource, namespace, obj, "MODIFIED")
+                timer = threading.Timer(self.termination_delay, self._finish_namespace, (name,))
+                timer.daemon = True
+                timer.start()
+                return obj
+            del self._objects[resource][(namespace, name)]
+            obj["metadata"]["resourceVersion"] = self._next_version()
+            self._publish(resource, "DELETED", obj)
+            return obj
+
+    def _finish_namespace(self, name):
+        with self._lock:
+            for resource, items in self._objects.items():
+                for key in [key for key in items if key[0] == name]:
+                    del items[key]
+            obj = self._objects["namespaces"].pop((None, name), None)
+            if obj is not None:
+                obj["metadata"]["resourceVersion"] = self._next_version()
+                self._publish("namespaces", "DELETED", obj)
+
+    def _select(self, resource, namespace, label_selector, field_selector):
+        items = self._objects[resource]
+        keys = sorted(key for key in items if namespace is None or key[0] == namespace)
+        return [
+            items[key] for key in keys
+            if _matches(label_selector, items[key]["metadata"].get("labels") or {})
+            and _matches(field_selector, _field_values(items[key]))
+        ]
+
+    def delete_collection(self, resource, namespace, label_selector, field_selector):
+        with self._lock:
+            selected = self._select(resource, namespace, label_selector, field_selector)
+        for obj in selected:
+            self.delete(resource, obj["metadata"].get("namespace"), obj["metadata"]["name"])
+        return _status(message=f"deleted {len(selected)} {resource}")
+
+    # Paginated list; the continue token is the offset into the sorted result
+    def list(self, resource, namespace, label_selector, field_selector, limit=None, token=None):
+        with self._lock:
+            selected = self._select(resource, namespace, label_selector, field_selector)
+            version = str(self._resource_version)
+        start = int(base64.urlsafe_b64decode(token).decode()) if token else 0
+        end = start + limit if limit else len(selected)
+        api_version, kind, _ = RESOURCES[resource]
+        metadata = {"resourceVersion": version}
+        if end < len(selected):
+            metadata["continue"] = base64.urlsafe_b64encode(str(end).encode()).decode()
+        return {"kind": f"{kind}List", "apiVersion": api_version, "metadata": metadata, "items": selected[start:end]}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+            def _send(self, code, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+            def _dispatch(self, method):
+                url = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                body = self._body() if method in ("POST", "PUT", "PATCH") else None
+
+                if url.path == "/_fake/stats":
+                    return self._send(200, server.stats())
+                if url.path == "/_fake/reset" and method == "POST":
+                    server.reset_stats()
+                    return self._send(200, server.stats())
+
+                try:
+                    resource, namespace, name = self._route(url.path)
+                except ApiError as e:
+                    return self._send(e.code, _status(e.code, e.reason, str(e)))
+
+                watching = method == "GET" and (query.get("watch") or "").lower() in ("true", "1")
+                verb = self._verb(method, name, watching)
+                with server._lock:
+                    server.calls[(verb, resource)] += 1
+                    throttle = not watching and random.random() < server.throttle_rate
+                    if throttle:
+                        server.throttled += 1
+                if throttle:
+                    return self._send(429, _status(429, "TooManyRequests", "Too many requests, please try again later."),
+                                      {"Retry-After": str(server.retry_after)})
+                if not watching and (server.latency or server.jitter):
+                    time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+                if watching:
+                    return self._watch(resource, namespace, query)
+
+                try:
+                    code, payload = self._handle(verb, resource, namespace, name, query, body)
+                except ApiError as e:
+                    code, payload = e.code, _status(e.code, e.reason, str(e))
+                self._send(code, payload)
+
+            # Returns (resource, namespace, name) for a request path
+            def _route(self, path):
+                parts = [part for part in path.split("/") if part]
+                skip = GROUP_PREFIXES.get(tuple(parts[:2]))
+                rest = parts[skip:] if skip else []
+                if len(rest) == 1 and rest[0] in RESOURCES:
+                    return rest[0], None, None
+                if len(rest) == 2 and rest[0] == "namespaces":
+                    return "namespaces", None, rest[1]
+                if len(rest) in (3, 4) and rest[0] == "namespaces" and rest[2] in RESOURCES:
+                    return rest[2], rest[1], rest[3] if len(rest) == 4 else None
+                raise ApiError(404, "NotFound", f"the server could not find the requested resource ({path})")
+
+            def _verb(self, method, name, watching):
+                if watching:
+                    return "watch"
+                if name is None:
+                    return {"GET": "list", "POST": "create", "DELETE": "deletecollection"}.get(method, method.lower())
+                return {"GET": "get", "PUT": "update", "PATCH": "patch", "DELETE": "delete"}.get(method, method.lower())
+
+            def _handle(self, verb, resource, namespace, name, query, body):
+                label_selector = query.get("labelSelector")
+                field_selector = query.get("fieldSelector")
+                if verb == "list":
+                    limit = int(query["limit"]) if query.get("limit") else None
+                    return 200, server.list(resource, namespace, label_selector, field_selector, limit, query.get("continue"))
+                if verb == "create":
+                    return 201, server.create(resource, namespace, body)
+                if verb == "get":
+                    return 200, server.read(resource, namespace, name)
+                if verb in ("update", "patch"):
+                    apply = self.headers.get("Content-Type", "").startswith("application/apply-patch")
+                    obj, code = server.update(resource, namespace, name, body, replace=verb == "update", apply=apply)
+                    return code, obj
+                if verb == "delete":
+                    return 200, server.delete(resource, namespace, name)
+                if verb == "deletecollection":
+                    return 200, server.delete_collection(resource, namespace, label_selector, field_selector)
+                raise ApiError(405, "MethodNotAllowed", f"{verb} is not supported on {resource}")
+
+            # Stream watch events as JSON lines until timeoutSeconds or shutdown.
+            # Without a resourceVersion the current objects come first as ADDED;
+            # with one, the recorded events after it are replayed first.
+            def _watch(self, resource, namespace, query):
+                events = queue.Queue()
+                label_selector, field_selector = query.get("labelSelector"), query.get("fieldSelector")
+                watcher = (resource, namespace, label_selector, field_selector, events)
+                with server._lock:
+                    if not query.get("resourceVersion"):
+                        for obj in server._select(resource, namespace, label_selector, field_selector):
+                            events.put({"type": "ADDED", "object": obj})
+                    else:
+                        since = int(query["resourceVersion"])
+                        for version, event_resource, event_type, obj in server._history:
+                            if version > since and server._watching(watcher, event_resource, obj):
+                                events.put({"type": event_type, "object": obj})
+                    server._watchers.append(watcher)
+                deadline = time.monotonic() + float(query.get("timeoutSeconds") or 300)
+                # Chunked like the real API server, so clients see each event as it comes
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    while not server._stopping.is_set() and time.monotonic() < deadline:
+                        try:
+                            event = events.get(timeout=min(0.5, max(0.0, deadline - time.monotonic())))
+                        except queue.Empty:
+                            continue
+                        line = json.dumps(event).encode() + b"\n"
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with server._lock:
+                        server._watchers.remove(watcher)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an in-memory stand-in Kubernetes API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds on top of --latency.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429.")
+    args = parser.parse_args()
+
+    server = FakeApiServer(args.host, args.port, args.latency, args.jitter, args.throttle_rate, args.retry_after)
+    print(f"Fake API server listening on {server.url} (call stats at {server.url}/_fake/stats)")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
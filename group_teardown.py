@@ -0,0 +1,121 @@
+import functools
+import time
+
+from kubernetes import client, watch
+from urllib3.exceptions import HTTPError
+
+from cluster_sync import iter_pages
+from k8s_writes import MANAGED_SELECTOR, aggregated_role_binding_name, created_by_app
+
+# Seconds to wait for a namespace to finish terminating
+TERMINATION_TIMEOUT = 300
+
+
+def _read_namespace(v1, name):
+    try:
+        return v1.read_namespace(name)
+    except client.exceptions.ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+# Wait until a deleted namespace is gone. The watch resumes from the
+# resourceVersion of a read, so a namespace that is already gone returns at
+# once and one that goes away in between is not missed.
+def _wait_for_namespace_deletion(v1, name, timeout):
+    deadline = time.monotonic() + timeout
+    namespace = _read_namespace(v1, name)
+    if namespace is None:
+        return True
+    try:
+        stream = watch.Watch().stream(
+            v1.list_namespace,
+            field_selector=f"metadata.name={name}",
+            resource_version=namespace.metadata.resource_version,
+            timeout_seconds=max(1, int(deadline - time.monotonic())),
+        )
+        for event in stream:
+            if event["type"] == "DELETED":
+                return True
+    except HTTPError:
+        # The connection dropped; the read below decides
+        pass
+    return _read_namespace(v1, name) is None
+
+
+# Names of the ServiceAccounts and RoleBindings the apps create for the
+# members of a group, as (kind, name) pairs
+def known_objects(name, members):
+    known = {("RoleBinding", f"{name}-rolebinding")}
+    for member in members:
+        if member.get("short_name"):
+            known.add(("ServiceAccount", member["short_name"]))
+        if member.get("role"):
+            known.add(("RoleBinding", f"{member['username']}-{member['role']}-binding"))
+            known.add(("RoleBinding", aggregated_role_binding_name(member["role"])))
+    return known
+
+
+# Delete the known objects left after the label-selected deletes, e.g. those
+# created before the managed-by label existed. One list per kind finds them,
+# so only objects still there cost a delete.
+def _delete_known(v1, rbac_api, name, known):
+    for kind, list_fn, delete_fn in (
+        ("ServiceAccount", v1.list_namespaced_service_account, v1.delete_namespaced_service_account),
+        ("RoleBinding", rbac_api.list_namespaced_role_binding, rbac_api.delete_namespaced_role_binding),
+    ):
+        leftover = [
+            item.metadata.name
+            for items in iter_pages(functools.partial(list_fn, name), None)
+            for item in items
+            if (kind, item.metadata.name) in known
+        ]
+        for object_name in leftover:
+            try:
+                delete_fn(object_name, name)
+            except client.exceptions.ApiException as e:
+                if e.status != 404:
+                    raise
+
+
+# Tear down a group with a constant number of API calls, plus one delete for
+# each object the label selector misses.
+#
+# By default every managed ServiceAccount and RoleBinding in the namespace is
+# removed with one deletecollection call each, and the namespace is kept.
+# The group's known objects (see known_objects; members come from the store)
+# that carry no managed-by label are then deleted by name. With
+# delete_namespace the whole namespace is deleted instead (only if the apps
+# created it, as recorded by CREATED_BY_ANNOTATION) and the call watches
+# until termination has finished.
+#
+# Returns (message, ok).
+def delete_group(v1, rbac_api, name, delete_namespace=False, timeout=TERMINATION_TIMEOUT, members=()):
+    start = time.monotonic()
+    try:
+        if delete_namespace:
+            namespace = v1.read_namespace(name)
+            if not created_by_app(namespace):
+                return f"Namespace '{name}' was not created by this app and was not deleted.", False
+            v1.delete_namespace(name)
+            if not _wait_for_namespace_deletion(v1, name, timeout):
+                return f"Namespace '{name}' is still terminating after {timeout}s.", False
+            return f"Namespace '{name}' deleted in {time.monotonic() - start:.1f}s.", True
+
+        v1.delete_collection_namespaced_service_account(name, label_selector=MANAGED_SELECTOR)
+        rbac_api.delete_collection_namespaced_role_binding(name, label_selector=MANAGED_SELECTOR)
+        _delete_known(v1, rbac_api, name, known_objects(name, members))
+        remaining = v1.list_namespaced_service_account(name, label_selector=MANAGED_SELECTOR, limit=1).items
+        remaining += rbac_api.list_namespaced_role_binding(name, label_selector=MANAGED_SELECTOR, limit=1).items
+        if remaining:
+            return f"Some ServiceAccounts or RoleBindings in group '{name}' are still terminating.", False
+        return (
+            f"Removed all ServiceAccounts and RoleBindings of group '{name}' "
+            f"in {time.monotonic() - start:.1f}s.",
+            True,
+        )
+    except client.exceptions.ApiException as e:
+        if e.status == 404:
+            return f"Namespace '{name}' does not exist.", False
+        return f"An error occurred while deleting group '{name}': {e}", False
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+import signal
+import threading
+
+from jobs import JOB_DRAIN_TIMEOUT
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Worker processes, each with a thread pool so one long batch does not block
+# other admins
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# Synchronous batch and import requests can run for minutes
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+
+# Seconds a worker keeps serving after SIGTERM while /readyz reports it as
+# draining, so load balancers stop sending it requests before it stops
+# accepting them
+DRAIN_NOTICE_SECONDS = float(os.environ.get("DRAIN_NOTICE_SECONDS", "5"))
+
+# On SIGTERM a worker reports draining, then stops accepting requests,
+# finishes the ones in flight and drains its onboarding jobs; it is killed
+# after graceful_timeout
+graceful_timeout = int(DRAIN_NOTICE_SECONDS + JOB_DRAIN_TIMEOUT) + 30
+
+# Each worker creates its own API client, watch and job threads after the
+# fork instead of inheriting them from the master
+preload_app = False
+
+accesslog = "-"
+
+
+# Mark the worker as draining as soon as it is asked to stop, while it is
+# still serving /readyz, and only stop it DRAIN_NOTICE_SECONDS later
+def post_worker_init(worker):
+    services = worker.wsgi.extensions["services"]
+    handle_exit = worker.handle_exit
+
+    def on_sigterm(sig, frame):
+        if not services.draining:
+            services.draining = True
+            threading.Timer(DRAIN_NOTICE_SECONDS, handle_exit, (sig, frame)).start()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+# A quick shutdown (SIGINT/SIGQUIT) skips the notice but still reports draining
+def worker_int(worker):
+    app = getattr(worker, "wsgi", None)
+    if app is not None:
+        app.extensions["services"].draining = True
+
+
+# Drain the worker's onboarding jobs before it exits
+def worker_exit(server, worker):
+    app = getattr(worker, "wsgi", None)
+    if app is not None:
+        app.extensions["services"].drain()
@@ -0,0 +1,110 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from kubernetes import client, watch
+
+from cluster_sync import PAGE_SIZE
+
+
+# Base of the in-process indexes kept current by a background list and watch
+# (NamespaceCache, ShortNameIndex, RbacIndex).
+#
+# A paginated list of list_fn fills the index, after which a watch stream
+# resumes from the last seen resourceVersion. If the server reports the
+# resourceVersion as expired (410 Gone) the index is rebuilt with a fresh
+# list. Subclasses fill the index in _replace(items) and
+# _apply(event_type, obj), which run under self._lock; kind names what is
+# watched in error messages.
+class Informer(ABC):
+    kind = "objects"
+
+    def __init__(self, list_fn, thread_name, watch_timeout=300, retry_delay=5, page_size=PAGE_SIZE):
+        self.list_fn = list_fn
+        self.thread_name = thread_name
+        self.watch_timeout = watch_timeout
+        self.retry_delay = retry_delay
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._resource_version = None
+        self._synced = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_sync = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @abstractmethod
+    def _replace(self, items):
+        ...
+
+    @abstractmethod
+    def _apply(self, event_type, obj):
+        ...
+
+    # Full paginated list used for the initial fill and after a 410 Gone
+    def _relist(self):
+        items = []
+        _continue = None
+        resource_version = None
+        while True:
+            page = self.list_fn(limit=self.page_size, _continue=_continue)
+            resource_version = resource_version or page.metadata.resource_version
+            items += page.items
+            _continue = page.metadata._continue
+            if not _continue:
+                break
+        with self._lock:
+            self._replace(items)
+            self._resource_version = resource_version
+            self.last_sync = time.time()
+        self._synced.set()
+
+    def _apply_event(self, event):
+        obj = event["object"]
+        with self._lock:
+            self._apply(event["type"], obj)
+            self._resource_version = obj.metadata.resource_version
+            self.last_sync = time.time()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._resource_version is None:
+                    self._relist()
+                stream = watch.Watch().stream(
+                    self.list_fn,
+                    resource_version=self._resource_version,
+                    timeout_seconds=self.watch_timeout,
+                )
+                for event in stream:
+                    if self._stop.is_set():
+                        break
+                    if event["type"] == "ERROR":
+                        # Typically a 410 Gone for an expired resourceVersion
+                        self._resource_version = None
+                        break
+                    if event["type"] == "BOOKMARK":
+                        self._resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+                        continue
+                    self._apply_event(event)
+            except client.exceptions.ApiException as e:
+                if e.status == 410:
+                    self._resource_version = None
+                    continue
+                print(f"An error occurred while watching {self.kind}: {e}")
+                self._stop.wait(self.retry_delay)
+            except Exception as e:
+                print(f"An error occurred while watching {self.kind}: {e}")
+                self._stop.wait(self.retry_delay)
+
+    @property
+    def synced(self):
+        return self._synced.is_set()
@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import Blueprint, abort, jsonify, render_template
+
+from audit import bind_actor
+from bulk_provision import provision_users, summarize
+
+# Number of onboarding batches that can run at the same time
+JOB_WORKERS = int(os.environ.get("ONBOARDING_JOB_WORKERS", "4"))
+
+# Seconds between progress writes of a running job to the shared store
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "1"))
+
+# Seconds a shutting-down worker waits for its queued and running jobs
+JOB_DRAIN_TIMEOUT = float(os.environ.get("JOB_DRAIN_TIMEOUT", "120"))
+
+# Finished jobs are kept in memory for JOB_RETENTION_SECONDS, and only the
+# latest JOB_RETENTION_MAX of them; with a store they can still be read from it
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+JOB_RETENTION_MAX = int(os.environ.get("JOB_RETENTION_MAX", "100"))
+
+
+# One queued onboarding batch and its per-user progress
+class Job:
+    def __init__(self, description, users):
+        self.id = uuid.uuid4().hex[:12]
+        self.description = description
+        self.users = users
+        self.status = "queued"
+        self.messages = []
+        self.results = []
+        self.failed = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.summary = ""
+        self.offset = None
+        self.progress = None
+        self.saved = 0.0
+        self._lock = threading.Lock()
+
+    def add_result(self, result):
+        with self._lock:
+            self.results.append(result)
+            self.failed += not result["ok"]
+
+    # Without results only the counts of the per-user results are included,
+    # e.g. for the frequent progress writes
+    def to_dict(self, results=True):
+        with self._lock:
+            done, failed = len(self.results), self.failed
+            results = list(self.results) if results else []
+        return {
+            "id": self.id,
+            "description": self.description,
+            "status": self.status,
+            "total": len(self.users),
+            "done": done,
+            "failed": failed,
+            "messages": list(self.messages),
+            "results": results,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "summary": self.summary,
+            "offset": self.offset,
+            "progress": self.progress,
+        }
+
+
+# Runs onboarding batches on a worker pool so the POST can return right away.
+#
+# With a store, job state is also written to it, so that /jobs/<id> works on
+# every worker process and not only the one running the job. Progress writes
+# carry the counts only; the per-user results are written with the job's
+# state changes.
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, store=None, retention=JOB_RETENTION_SECONDS,
+                 retention_max=JOB_RETENTION_MAX):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onboarding-job")
+        self.retention = retention
+        self.retention_max = retention_max
+        self._jobs = {}
+        self._futures = {}
+        self._store = store
+        self._lock = threading.Lock()
+
+    # setup, if given, runs once before the users (e.g. creating the namespace)
+    # and returns a message recorded on the job. runner(users, on_result), if
+    # given, provisions the whole batch in place of provision_users, e.g. on
+    # the async engine.
+    def submit(self, description, users, provision_one, setup=None, runner=None):
+        def task(job, checkpoint):
+            def on_result(result):
+                job.add_result(result)
+                self._save(job, progress=True)
+
+            if setup is not None:
+                job.messages.append(setup())
+            if runner is not None:
+                results, elapsed = runner(job.users, on_result)
+            else:
+                results, elapsed = provision_users(job.users, provision_one, on_result=on_result)
+            return summarize(results, elapsed)
+
+        return self.submit_task(description, task, users)
+
+    # Queue a job that does its own work, e.g. a streamed import starting at
+    # row offset. task(job, checkpoint) runs on a worker and returns the
+    # job's summary; it reports progress on job.offset and job.progress and
+    # calls checkpoint() to write them to the store, so an interrupted job
+    # can be resumed from any worker.
+    def submit_task(self, description, task, users=(), offset=None):
+        job = Job(description, list(users))
+        job.offset = offset
+        with self._lock:
+            self._jobs[job.id] = job
+        self._save(job)
+        future = self._executor.submit(bind_actor(self._run), job, task)
+        with self._lock:
+            self._futures[job.id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job.id, None))
+        return job
+
+    # Write the job to the store; progress updates are rate limited and
+    # leave out the per-user results
+    def _save(self, job, progress=False):
+        if self._store is None:
+            return
+        now = time.monotonic()
+        if progress and now - job.saved < JOB_PROGRESS_INTERVAL:
+            return
+        job.saved = now
+        try:
+            self._store.save_job(job.id, job.to_dict(results=not progress))
+        except Exception as e:
+            print(f"An error occurred while saving job '{job.id}': {e}")
+
+    # The job as a dict, from this process or, for jobs run by another
+    # worker, from the store
+    def snapshot(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._store.get_job(job_id) if self._store is not None else None
+
+    # Wait up to timeout seconds for queued and running jobs, e.g. on worker
+    # shutdown. Jobs still unfinished are recorded as interrupted; returns
+    # how many there were.
+    def drain(self, timeout=JOB_DRAIN_TIMEOUT):
+        with self._lock:
+            futures = list(self._futures.values())
+        wait(futures, timeout=timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            unfinished = [job for job in self._jobs.values() if job.status in ("queued", "running")]
+        for job in unfinished:
+            job.messages.append("Interrupted: the worker shut down before the job finished.")
+            job.status = "interrupted"
+            self._save(job)
+        return len(unfinished)
+
+    # Job counts by status and users not yet provisioned, for /metrics
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {"queued": 0, "running": 0, "finished": 0, "failed": 0, "interrupted": 0}
+        pending = 0
+        for job in jobs:
+            counts[job.status] += 1
+            if job.status in ("queued", "running"):
+                pending += len(job.users) - len(job.results)
+        return {"jobs": counts, "pending_users": pending}
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Forget finished jobs older than the retention time or beyond the latest
+    # retention_max
+    def _evict(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.finished is not None), key=lambda job: job.finished)
+            excess = len(finished) - self.retention_max
+            for i, job in enumerate(finished):
+                if i < excess or job.finished < cutoff:
+                    del self._jobs[job.id]
+
+    def _run(self, job, task):
+        job.status = "running"
+        job.started = time.time()
+        self._save(job)
+        try:
+            job.summary = task(job, lambda: self._save(job))
+            job.status = "finished"
+        except Exception as e:
+            job.messages.append(f"An error occurred: {e}")
+            job.status = "failed"
+        job.finished = time.time()
+        self._save(job)
+        self._evict()
+
+
+# services provides the job queue, which is only created once it is used
+def create_jobs_blueprint(services):
+    jobs = Blueprint("jobs", __name__)
+
+    @jobs.route("/jobs/<job_id>")
+    def job_page(job_id):
+        job = services.job_queue.snapshot(job_id)
+        if job is None:
+            abort(404)
+        return render_template("job.html", job=job)
+
+    @jobs.route("/jobs/<job_id>.json")
+    def job_json(job_id):
+        job = services.job_queue.snapshot(job_id)
+        if job is None:
+            abort(404)
+        return jsonify(job)
+
+    return jobs
@@ -0,0 +1,119 @@
+import os
+import socket
+import threading
+import time
+
+from kubernetes import client, config
+from urllib3.connection import HTTPConnection
+
+from k8s_retry import rate_limiter, retry_policy
+
+# Connections kept per API server; should be at least the number of calls
+# in flight at once (bulk provisioning, job workers, reconcile)
+POOL_MAXSIZE = int(os.environ.get("K8S_POOL_MAXSIZE", "64"))
+
+# (connect, read) timeouts in seconds applied to every call that does not set
+# its own. Watches get the read timeout on top of their timeoutSeconds, as
+# they stay idle for as long as nothing changes.
+CONNECT_TIMEOUT = float(os.environ.get("K8S_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("K8S_READ_TIMEOUT", "30"))
+
+# Plain-HTTP API server to use instead of in-cluster or kubeconfig settings,
+# e.g. the fake API server used by benchmark.py
+API_HOST = os.environ.get("K8S_API_HOST")
+
+# TCP keep-alive so idle pooled connections are not silently dropped
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+
+# Count, total and max latency per HTTP verb
+class LatencyStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, verb, seconds, failed=False):
+        with self._lock:
+            stats = self._stats.setdefault(verb, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["errors"] += int(failed)
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                verb: {**stats, "avg_seconds": stats["total_seconds"] / stats["count"]}
+                for verb, stats in self._stats.items()
+            }
+
+
+latency = LatencyStats()
+
+
+# Read timeout of a request: READ_TIMEOUT, past the server-side timeoutSeconds
+# for a watch, and none for a watch without one
+def _read_timeout(query_params):
+    params = dict(query_params or [])
+    if not params.get("watch"):
+        return READ_TIMEOUT
+    if params.get("timeoutSeconds"):
+        return float(params["timeoutSeconds"]) + READ_TIMEOUT
+    return None
+
+
+# ApiClient that applies default timeouts, the shared rate limit and retry
+# policy, and times every request by verb
+class InstrumentedApiClient(client.ApiClient):
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("_request_timeout") is None:
+            kwargs["_request_timeout"] = (CONNECT_TIMEOUT, _read_timeout(kwargs.get("query_params")))
+        return retry_policy.call(lambda: self._timed_request(method, url, *args, **kwargs))
+
+    def _timed_request(self, method, url, *args, **kwargs):
+        rate_limiter.acquire()
+        start = time.monotonic()
+        failed = True
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            failed = False
+            return response
+        finally:
+            latency.record(method, time.monotonic() - start, failed)
+
+
+_lock = threading.Lock()
+_api_client = None
+
+
+def load_configuration():
+    configuration = client.Configuration()
+    if API_HOST:
+        configuration.host = API_HOST
+    else:
+        try:
+            config.load_incluster_config(client_configuration=configuration)
+        except config.ConfigException:
+            config.load_kube_config(client_configuration=configuration)
+    configuration.connection_pool_maxsize = POOL_MAXSIZE
+    return configuration
+
+
+# The single ApiClient shared by every app variant and helper in the process
+def api_client():
+    global _api_client
+    with _lock:
+        if _api_client is None:
+            _api_client = InstrumentedApiClient(load_configuration())
+            _api_client.rest_client.pool_manager.connection_pool_kw["socket_options"] = KEEPALIVE_SOCKET_OPTIONS
+        return _api_client
+
+
+def core_api():
+    return client.CoreV1Api(api_client())
+
+
+def rbac_api():
+    return client.RbacAuthorizationV1Api(api_client())
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+from kubernetes import client
+
+# Client-side rate limit shared by every API call in the process
+QPS = float(os.environ.get("K8S_QPS", "50"))
+BURST = int(os.environ.get("K8S_BURST", "100"))
+
+# Retries for throttled (429) and transient server (5xx) responses
+MAX_RETRIES = int(os.environ.get("K8S_MAX_RETRIES", "5"))
+BASE_DELAY = float(os.environ.get("K8S_RETRY_BASE_DELAY", "0.2"))
+MAX_DELAY = float(os.environ.get("K8S_RETRY_MAX_DELAY", "30"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Token bucket: tokens refill at qps per second up to burst, and every call
+# takes one token, waiting if none is left.
+class TokenBucket:
+    def __init__(self, qps=QPS, burst=BURST):
+        self.qps = qps
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Take a token and return the seconds to wait before using it
+    def _reserve(self):
+        if self.qps <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.qps)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.qps if self._tokens < 0 else 0
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    # Same as acquire, for coroutines: waits without blocking the event loop
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+# Exponential backoff with full jitter that honors the server's Retry-After
+class RetryPolicy:
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, error):
+        retry_after = (error.headers or {}).get("Retry-After") if error is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn):
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except client.exceptions.ApiException as e:
+                if e.status not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                    raise
+                time.sleep(self.delay(attempt, e))
+                attempt += 1
+
+    # Same as call, for coroutine functions. error_type is the ApiException
+    # class of the async client in use.
+    async def call_async(self, fn, error_type):
+        attempt = 0
+        while True:
+            try:
+                return await fn()
+            except error_type as e:
+                if e.status not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.delay(attempt, e))
+                attempt += 1
+
+
+rate_limiter = TokenBucket()
+retry_policy = RetryPolicy()
@@ -0,0 +1,215 @@
+import os
+
+from kubernetes import client
+
+# How objects are written:
+#   "create" - create straight away and treat 409 Conflict as "already exists"
+#   "apply"  - server-side apply, which creates or updates in one call
+WRITE_MODE = os.environ.get("K8S_WRITE_MODE", "create")
+
+FIELD_MANAGER = "k8s-user"
+APPLY_CONTENT_TYPE = "application/apply-patch+yaml"
+MERGE_PATCH_CONTENT_TYPE = "application/merge-patch+json"
+
+# Label carried by every object the apps create, so a group can be torn
+# down with label-selected collection deletes
+MANAGED_BY_LABEL = "app.kubernetes.io/managed-by"
+MANAGED_BY = "k8s-user"
+MANAGED_SELECTOR = f"{MANAGED_BY_LABEL}={MANAGED_BY}"
+
+# Annotation set on a namespace only when the apps create it. Apply never
+# writes it, so unlike the label it cannot end up on a namespace someone else
+# created; only namespaces carrying it are deleted or get the pull secret.
+CREATED_BY_ANNOTATION = "hpc/created-by"
+
+# Label on the aggregated RoleBindings (one per namespace and role, listing
+# every user with that role); its value is the role
+AGGREGATED_ROLE_LABEL = "hpc/aggregated-role"
+
+_serializer = client.ApiClient()
+
+
+def mark_managed(body):
+    body.metadata.labels = {**(body.metadata.labels or {}), MANAGED_BY_LABEL: MANAGED_BY}
+    return body
+
+
+def created_by_app(namespace):
+    return (namespace.metadata.annotations or {}).get(CREATED_BY_ANNOTATION) == MANAGED_BY
+
+
+# Plain JSON-ready dict for a client model object
+def serialize(body):
+    return _serializer.sanitize_for_serialization(body)
+
+
+# Server-side apply needs a plain dict that carries apiVersion and kind
+def apply_body(body, api_version, kind):
+    data = serialize(body)
+    data["apiVersion"] = api_version
+    data["kind"] = kind
+    return data
+
+
+# PATCH of body at path with the given content type. The generated patch_*
+# methods of the synchronous client do not take a content type, so the
+# request goes through call_api. Returns (object, HTTP status, headers).
+def _patch(api, path, body, content_type, query_params=(), **path_params):
+    return api.api_client.call_api(
+        path, "PATCH", path_params,
+        list(query_params),
+        {"Accept": "application/json", "Content-Type": content_type},
+        body=body,
+        response_type="object",
+        auth_settings=["BearerToken"],
+        _return_http_data_only=False,
+    )
+
+
+# Server-side apply of body at path
+def _server_side_apply(api, path, body, **path_params):
+    query_params = [("fieldManager", FIELD_MANAGER), ("force", "true")]
+    return _patch(api, path, body, APPLY_CONTENT_TYPE, query_params, **path_params)
+
+
+# JSON merge patch (RFC 7386) of body at path: unlike the strategic merge
+# patch of the patch_* methods, lists are replaced whole and a null removes
+# the field
+def merge_patch(api, path, body, **path_params):
+    return _patch(api, path, body, MERGE_PATCH_CONTENT_TYPE, **path_params)
+
+
+# Create-or-skip for a namespace. Returns the same (message, created) pair as
+# the old read-then-create helper, but costs a single API call. Namespaces are
+# created even in apply mode: applying to an existing namespace would label
+# it as the apps' own.
+def ensure_namespace(v1, name):
+    try:
+        v1.create_namespace(namespace_body(name))
+        return f"Namespace '{name}' created successfully.", True
+    except client.exceptions.ApiException as e:
+        if e.status == 409:
+            return f"Namespace '{name}' already exists.", False
+        return f"An error occurred: {e}", False
+
+
+# Create-or-skip for a RoleBinding. Errors other than 409 Conflict are raised
+# so callers keep their existing error messages.
+def apply_role_binding(rbac_api, namespace, role_binding, mode=None):
+    mode = mode or WRITE_MODE
+    mark_managed(role_binding)
+    try:
+        if mode == "apply":
+            _server_side_apply(
+                rbac_api, "/apis/rbac.authorization.k8s.io/v1/namespaces/{namespace}/rolebindings/{name}",
+                apply_body(role_binding, "rbac.authorization.k8s.io/v1", "RoleBinding"),
+                namespace=namespace, name=role_binding.metadata.name,
+            )
+        else:
+            rbac_api.create_namespaced_role_binding(namespace=namespace, body=role_binding)
+    except client.exceptions.ApiException as e:
+        if e.status != 409:
+            raise
+
+
+# Error for a ServiceAccount that already exists under another user's
+# "hpc/long-account" label, or None when it is the user's own. Raised as a
+# 409 so callers report it like any failed write instead of recording the
+# user against someone else's account.
+def service_account_conflict(existing, service_account):
+    owner = (existing.metadata.labels or {}).get("hpc/long-account")
+    wanted = service_account.metadata.labels["hpc/long-account"]
+    if owner == wanted:
+        return None
+    return client.exceptions.ApiException(
+        status=409,
+        reason=f"ServiceAccount '{service_account.metadata.name}' already exists for user '{owner}', not '{wanted}'",
+    )
+
+
+# Create-or-skip for a ServiceAccount, with the same error handling as
+# apply_role_binding. The account is always created first: one that already
+# exists is read back and only kept (and in apply mode updated) when it
+# belongs to the same user. Returns whether this call created it.
+def apply_service_account(v1, namespace, service_account, mode=None):
+    mode = mode or WRITE_MODE
+    mark_managed(service_account)
+    name = service_account.metadata.name
+    try:
+        v1.create_namespaced_service_account(namespace=namespace, body=service_account)
+        return True
+    except client.exceptions.ApiException as e:
+        if e.status != 409:
+            raise
+    conflict = service_account_conflict(v1.read_namespaced_service_account(name=name, namespace=namespace), service_account)
+    if conflict is not None:
+        raise conflict
+    if mode == "apply":
+        _server_side_apply(
+            v1, "/api/v1/namespaces/{namespace}/serviceaccounts/{name}",
+            apply_body(service_account, "v1", "ServiceAccount"),
+            namespace=namespace, name=name,
+        )
+    return False
+
+
+# Group namespace as created by create_namespace
+def namespace_body(name):
+    return mark_managed(client.V1Namespace(
+        metadata=client.V1ObjectMeta(name=name, annotations={CREATED_BY_ANNOTATION: MANAGED_BY})
+    ))
+
+
+# Per-user RoleBinding as created by create_user_rolebinding
+def user_role_binding_body(namespace, username, role_name):
+    return client.V1RoleBinding(
+        metadata=client.V1ObjectMeta(
+            name=f"{username}-{role_name}-binding",
+            namespace=namespace,
+            labels={"hpc/long-account": username, MANAGED_BY_LABEL: MANAGED_BY}
+        ),
+        role_ref=client.V1RoleRef(api_group="rbac.authorization.k8s.io", kind="ClusterRole", name=role_name),
+        subjects=[user_subject(username)],
+    )
+
+
+def user_subject(username):
+    return client.RbacV1Subject(kind="User", name=username, api_group="rbac.authorization.k8s.io")
+
+
+def aggregated_role_binding_name(role_name):
+    return f"{role_name}-users-binding"
+
+
+# Aggregated RoleBinding for every user with role_name in a namespace, as
+# kept by aggregated_bindings
+def aggregated_role_binding_body(namespace, role_name, usernames):
+    return client.V1RoleBinding(
+        metadata=client.V1ObjectMeta(
+            name=aggregated_role_binding_name(role_name),
+            namespace=namespace,
+            labels={AGGREGATED_ROLE_LABEL: role_name, MANAGED_BY_LABEL: MANAGED_BY}
+        ),
+        role_ref=client.V1RoleRef(api_group="rbac.authorization.k8s.io", kind="ClusterRole", name=role_name),
+        subjects=[user_subject(username) for username in sorted(set(usernames))],
+    )
+
+
+# Per-user ServiceAccount as created by create_service_account
+def service_account_body(short_name, username, pull_secret=None):
+    return client.V1ServiceAccount(
+        metadata=client.V1ObjectMeta(
+            name=short_name,
+            labels={"hpc/long-account": username, MANAGED_BY_LABEL: MANAGED_BY}
+        ),
+        image_pull_secrets=[client.V1LocalObjectReference(name=pull_secret)] if pull_secret else None,
+    )
+
+
+# Group RoleBinding as created by create_rolebinding
+def group_role_binding_body(namespace, group, role_name="admin"):
+    return client.V1RoleBinding(
+        metadata=client.V1ObjectMeta(name=f"{group}-rolebinding", namespace=namespace),
+        role_ref=client.V1RoleRef(api_group="rbac.authorization.k8s.io", kind="Role", name=role_name),
+        subjects=[client.RbacV1Subject(kind="Group", name=group, api_group="rbac.authorization.k8s.io")],
+    )
@@ -0,0 +1,162 @@
+import functools
+import inspect
+import time
+
+from flask import request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+import k8s_client
+
+REQUEST_LATENCY = Histogram(
+    "k8s_user_http_request_duration_seconds",
+    "Flask request latency by route.",
+    ["route", "method", "status"],
+)
+
+K8S_CALL_LATENCY = Histogram(
+    "k8s_user_k8s_call_duration_seconds",
+    "Latency of the app's Kubernetes helper calls.",
+    ["call"],
+)
+
+K8S_CALL_ERRORS = Counter(
+    "k8s_user_k8s_call_errors_total",
+    "Kubernetes helper calls that raised or reported an error.",
+    ["call"],
+)
+
+BATCH_SIZE = Histogram(
+    "k8s_user_provision_batch_size",
+    "Users per provisioning batch.",
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+)
+
+IN_FLIGHT_USERS = Gauge(
+    "k8s_user_provision_in_flight_users",
+    "Users currently being provisioned.",
+)
+
+
+# Time a Kubernetes helper and count its failures. The helpers report most
+# errors as an "An error occurred" message instead of raising, so both count.
+# Works for the coroutine helpers of the async engine too.
+def timed_call(name):
+    def observe(start, result):
+        K8S_CALL_LATENCY.labels(name).observe(time.monotonic() - start)
+        message = result[0] if isinstance(result, tuple) else result
+        if isinstance(message, str) and "An error occurred" in message:
+            K8S_CALL_ERRORS.labels(name).inc()
+        return result
+
+    def failed(start):
+        K8S_CALL_LATENCY.labels(name).observe(time.monotonic() - start)
+        K8S_CALL_ERRORS.labels(name).inc()
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.monotonic()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception:
+                    failed(start)
+                    raise
+                return observe(start, result)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                failed(start)
+                raise
+            return observe(start, result)
+        return wrapper
+    return decorator
+
+
+# Values read from live objects at scrape time. namespace_cache and job_queue
+# may also be callables returning the object, or None while it does not exist.
+class _StatsCollector:
+    def __init__(self):
+        self.namespace_cache = None
+        self.job_queue = None
+
+    @staticmethod
+    def _resolve(source):
+        return source() if callable(source) else source
+
+    def collect(self):
+        requests = CounterMetricFamily(
+            "k8s_user_api_requests", "Requests sent to the API server by HTTP verb.", labels=["verb"]
+        )
+        failures = CounterMetricFamily(
+            "k8s_user_api_request_failures", "Failed requests to the API server by HTTP verb.", labels=["verb"]
+        )
+        seconds = CounterMetricFamily(
+            "k8s_user_api_request_seconds", "Time spent in API server requests by HTTP verb.", labels=["verb"]
+        )
+        for verb, stats in k8s_client.latency.snapshot().items():
+            requests.add_metric([verb], stats["count"])
+            failures.add_metric([verb], stats["errors"])
+            seconds.add_metric([verb], stats["total_seconds"])
+        yield requests
+        yield failures
+        yield seconds
+
+        namespace_cache = self._resolve(self.namespace_cache)
+        if namespace_cache is not None:
+            stats = namespace_cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            yield CounterMetricFamily("k8s_user_namespace_cache_hits", "Namespace cache hits.", value=stats["hits"])
+            yield CounterMetricFamily("k8s_user_namespace_cache_misses", "Namespace cache misses.", value=stats["misses"])
+            yield GaugeMetricFamily(
+                "k8s_user_namespace_cache_hit_ratio", "Share of namespace lookups served from the cache.",
+                value=stats["hits"] / lookups if lookups else 0,
+            )
+            yield GaugeMetricFamily(
+                "k8s_user_namespace_cache_age_seconds", "Seconds since the namespace cache last changed.",
+                value=stats["age_seconds"] or 0,
+            )
+
+        job_queue = self._resolve(self.job_queue)
+        if job_queue is not None:
+            stats = job_queue.stats()
+            jobs = GaugeMetricFamily("k8s_user_onboarding_jobs", "Onboarding jobs by status.", labels=["status"])
+            for status, count in stats["jobs"].items():
+                jobs.add_metric([status], count)
+            yield jobs
+            yield GaugeMetricFamily(
+                "k8s_user_onboarding_pending_users", "Users in queued or running onboarding jobs not yet done.",
+                value=stats["pending_users"],
+            )
+
+
+_collector = _StatsCollector()
+REGISTRY.register(_collector)
+
+
+# Add per-route timing and a /metrics endpoint to an app
+def init_app(app, namespace_cache=None, job_queue=None):
+    _collector.namespace_cache = namespace_cache or _collector.namespace_cache
+    _collector.job_queue = job_queue or _collector.job_queue
+
+    @app.before_request
+    def start_timer():
+        request.environ["k8s_user.start"] = time.monotonic()
+
+    @app.after_request
+    def record_latency(response):
+        start = request.environ.get("k8s_user.start")
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(time.monotonic() - start)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
@@ -0,0 +1,68 @@
+import time
+
+from informer import Informer
+from metrics import timed_call
+
+
+# In-process namespace index kept current by a background watch (see
+# Informer).
+class NamespaceCache(Informer):
+    kind = "namespaces"
+
+    def __init__(self, core_api, watch_timeout=300, retry_delay=5):
+        super().__init__(core_api.list_namespace, "namespace-cache", watch_timeout, retry_delay)
+        self.core_api = core_api
+        self._namespaces = {}
+        self._sorted_names = []
+        self.hits = 0
+        self.misses = 0
+
+    @timed_call("list_namespace")
+    def _list(self):
+        return self.core_api.list_namespace()
+
+    @timed_call("list_namespace")
+    def _relist(self):
+        super()._relist()
+
+    def _replace(self, items):
+        self._namespaces = {ns.metadata.name: ns for ns in items}
+        self._sorted_names = None
+
+    def _apply(self, event_type, ns):
+        if event_type == "DELETED":
+            self._namespaces.pop(ns.metadata.name, None)
+        else:
+            self._namespaces[ns.metadata.name] = ns
+        self._sorted_names = None
+
+    # Sorted namespace names served from memory. The sorted view is only rebuilt
+    # after a watch event, so repeated page loads are constant time. Until the
+    # first sync completes this falls back to a direct list.
+    def names(self):
+        if self._synced.is_set():
+            with self._lock:
+                self.hits += 1
+                if self._sorted_names is None:
+                    self._sorted_names = sorted(self._namespaces)
+                return self._sorted_names
+        with self._lock:
+            self.misses += 1
+        namespaces = self._list()
+        return sorted(ns.metadata.name for ns in namespaces.items)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._namespaces
+
+    def stats(self):
+        with self._lock:
+            age = time.time() - self.last_sync if self.last_sync else None
+            return {
+                "synced": self._synced.is_set(),
+                "namespaces": len(self._namespaces),
+                "resource_version": self._resource_version,
+                "age_seconds": age,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
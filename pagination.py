@@ -0,0 +1,67 @@
+import base64
+import binascii
+from bisect import bisect_left, bisect_right
+
+from flask import request
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        return base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+
+
+# prefix, cursor key and page size from the query string
+def page_args():
+    prefix = request.args.get("prefix", "")
+    after = decode_cursor(request.args.get("cursor"))
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return prefix, after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+# One page of a sorted listing, consumed lazily so it can be streamed into a
+# template. keyed_items yields (key, item) pairs in key order; next_cursor is
+# set once iteration reaches the end of the page and more items remain.
+class Page:
+    def __init__(self, keyed_items, limit, prefix=""):
+        self._items = iter(keyed_items)
+        self.limit = limit
+        self.prefix = prefix
+        self.next_cursor = None
+
+    def __iter__(self):
+        count = 0
+        last_key = None
+        for key, item in self._items:
+            if count == self.limit:
+                self.next_cursor = encode_cursor(last_key)
+                return
+            yield item
+            last_key = key
+            count += 1
+
+
+# Names from a sorted list starting after the cursor and matching the prefix.
+# Both bounds are found by bisection, so a page costs O(log n + limit).
+def iter_sorted_names(names, prefix="", after=None):
+    start = bisect_left(names, prefix)
+    if after is not None:
+        start = max(start, bisect_right(names, after))
+    for i in range(start, len(names)):
+        name = names[i]
+        if not name.startswith(prefix):
+            break
+        yield name, name
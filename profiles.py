@@ -0,0 +1,477 @@
+from flask import Blueprint, render_template, request
+
+from api import BODY_ERRORS, create_api_blueprint, error_response, iter_records, json_response
+from bulk_provision import provision_users
+from pull_secrets import summary
+from services import IMAGE_PULL_SECRET
+from user_moves import BULK_EDIT_PARALLELISM, delete_users, move_user
+
+
+# One provisioning workflow of the former standalone apps. blueprint(services)
+# builds its routes; nav lists its (label, endpoint) links; rebuild_store
+# marks profiles whose users are labelled objects the store can be rebuilt from.
+class Profile:
+    def __init__(self, name, title, blueprint, nav, rebuild_store=False):
+        self.name = name
+        self.title = title
+        self.blueprint = blueprint
+        self.nav = nav
+        self.rebuild_store = rebuild_store
+
+
+# Add group page; with_group_binding also binds the "admin" Role to the group.
+# on_created(group), if given, runs once the namespace exists and returns a
+# message.
+def _add_group_view(services, with_group_binding, on_created=None):
+    def add_group():
+        message = ""
+        if request.method == "POST":
+            group_name = request.form.get("group_name")
+            if group_name:
+                message, created = services.create_namespace(group_name)
+                if created:
+                    if with_group_binding:
+                        message += f" {services.create_rolebinding(namespace=group_name, group=group_name)}"
+                    else:
+                        message += f" Namespace '{group_name}' is ready."
+                    if on_created is not None:
+                        message += f" {on_created(group_name)}"
+        return render_template("add_group.html", message=message)
+
+    return add_group
+
+
+# Namespaces with a RoleBinding for the group of the same name (app.py)
+def group_binding_blueprint(services):
+    bp = Blueprint("group_binding", __name__)
+    bp.add_url_rule("/add_group", view_func=_add_group_view(services, True), methods=["GET", "POST"])
+
+    @bp.route("/add_user", methods=["GET", "POST"])
+    def add_user():
+        message = ""
+        if request.method == "POST":
+            username = request.form.get("username")
+            group = request.form.get("group")
+            if username and group:
+                # Ensure unique usernames in a group
+                if services.store.add_member(group, username):
+                    message = f"User '{username}' added to group '{group}'."
+                else:
+                    message = f"User '{username}' is already in group '{group}'."
+        return render_template("add_user.html", message=message)
+
+    return bp
+
+
+# Per-user RoleBindings, one user at a time or many in a background job
+# (app_witth_perms.py, multi-app.py, shortname-app.py)
+def user_binding_blueprint(services):
+    bp = Blueprint("user_binding", __name__)
+    bp.add_url_rule("/add_group", view_func=_add_group_view(services, False), methods=["GET", "POST"])
+
+    @bp.route("/add_user", methods=["GET", "POST"])
+    def add_user():
+        message = ""
+        if request.method == "POST":
+            username = request.form.get("username")
+            group = request.form.get("group")
+            role = request.form.get("role")
+            if username and group and role:
+                # Ensure user is added to the group
+                services.store.add_member(group, username)
+
+                # Assign the role to the user in the namespace
+                services.store.set_role(username, group, role)
+                k8s_message = services.create_user_rolebinding(namespace=group, username=username, role_name=role)
+                message = f"User '{username}' added to group '{group}' with role '{role}'. {k8s_message}"
+        return render_template("add_user_role.html", message=message)
+
+    # Short names are only recorded in the store. This profile creates no
+    # ServiceAccounts, so none are generated or reserved for missing ones.
+    @bp.route("/add_users", methods=["GET", "POST"])
+    def add_users():
+        message = ""
+        job_id = None
+        if request.method == "POST":
+            usernames = request.form.get("usernames")  # Comma-separated usernames
+            short_names = request.form.get("short_names")  # Comma-separated short names
+            group = request.form.get("group")
+            role = request.form.get("role")
+
+            if usernames and group and role:
+                username_list = [u.strip() for u in usernames.split(",")]
+                short_name_list = [s.strip() for s in short_names.split(",")] if short_names else [None] * len(username_list)
+
+                if len(username_list) != len(short_name_list):
+                    message = "The number of usernames and short names must match."
+                else:
+                    requested = [{"username": u, "short_name": s} for u, s in zip(username_list, short_name_list)]
+
+                    # Add the users to the group and assign their role in one transaction each
+                    services.store.add_members(group, requested)
+                    services.store.set_roles(group, username_list, role)
+
+                    # Create the RoleBindings for many users in a background job
+                    def user_message(username, k8s_message):
+                        return f"User '{username}' added to group '{group}' with role '{role}'. {k8s_message}\n"
+
+                    def provision(username):
+                        return user_message(username, services.create_user_rolebinding(
+                            namespace=group, username=username, role_name=role
+                        ))
+
+                    async def provision_async(engine, username):
+                        return user_message(username, await engine.create_user_rolebinding(
+                            namespace=group, username=username, role_name=role
+                        ))
+
+                    job = services.submit_job(
+                        f"Add {len(username_list)} users to group '{group}' with role '{role}'",
+                        username_list, group, provision, provision_async,
+                    )
+                    job_id = job.id
+                    message += f"Queued job '{job.id}' for {len(username_list)} users. Track progress at /jobs/{job.id}.\n"
+
+        return render_template("add_users.html", message=message, job_id=job_id)
+
+    return bp
+
+
+# Per-user RoleBindings and ServiceAccounts, with the JSON API (sa-appl.py)
+def service_account_blueprint(services):
+    bp = Blueprint("service_account", __name__)
+    bp.add_url_rule("/add_group", view_func=_add_group_view(services, False), methods=["GET", "POST"])
+
+    def user_message(user, group, role, separator, k8s_message, sa_message):
+        return (
+            f"User '{user['username']}' (short name: '{user['short_name']}') added to group '{group}' with role '{role}'. "
+            f"{k8s_message}{separator}{sa_message}"
+        )
+
+    def provision(user, group, role, separator):
+        username, short_name = user["username"], user["short_name"]
+        k8s_message = services.create_user_rolebinding(namespace=group, username=username, role_name=role)
+        sa_message = services.create_service_account(namespace=group, short_name=short_name, username=username)
+        return user_message(user, group, role, separator, k8s_message, sa_message)
+
+    async def provision_async(engine, user, group, role, separator):
+        username, short_name = user["username"], user["short_name"]
+        k8s_message = await engine.create_user_rolebinding(namespace=group, username=username, role_name=role)
+        sa_message = await engine.create_service_account(namespace=group, short_name=short_name, username=username)
+        return user_message(user, group, role, separator, k8s_message, sa_message)
+
+    @bp.route("/add_users", methods=["GET", "POST"])
+    def add_users():
+        message = ""
+        job_id = None
+        if request.method == "POST":
+            usernames = request.form.get("usernames")  # Comma-separated usernames
+            short_names = request.form.get("short_names")  # Comma-separated short names
+            group = request.form.get("group")
+            role = request.form.get("role")
+
+            if usernames and group and role:
+                username_list = [u.strip() for u in usernames.split(",")]
+                short_name_list = [s.strip() for s in short_names.split(",")] if short_names else [None] * len(username_list)
+
+                if len(username_list) != len(short_name_list):
+                    message = "The number of usernames and short names must match."
+                else:
+                    # Check the short names typed in and generate the missing ones
+                    requested = [{"username": u, "short_name": s} for u, s in zip(username_list, short_name_list)]
+                    requested, errors = services.assign_short_names(group, requested)
+                    message += "".join(f"{error}\n" for error in errors)
+
+                    # Add the users to the group in one transaction; existing members are skipped
+                    new_users = services.store.add_members(group, requested)
+                    added = {u["username"] for u in new_users}
+                    for user in requested:
+                        if user["username"] not in added:
+                            message += f"User '{user['username']}' is already in group '{group}'.\n"
+
+                    # Assign the role to the users in the namespace
+                    services.store.set_roles(group, [u["username"] for u in new_users], role)
+
+                    # Create the RoleBinding and ServiceAccount for many users in a background job
+                    async def provision_job_user(engine, user):
+                        return await provision_async(engine, user, group, role, "\n") + "\n"
+
+                    if new_users:
+                        job = services.submit_job(
+                            f"Add {len(new_users)} users to group '{group}' with role '{role}'",
+                            new_users, group,
+                            lambda user: provision(user, group, role, "\n") + "\n",
+                            provision_job_user,
+                        )
+                        job_id = job.id
+                        message += f"Queued job '{job.id}' for {len(new_users)} users. Track progress at /jobs/{job.id}.\n"
+
+        return render_template("add_users_short.html", message=message, job_id=job_id)
+
+    # Add one user record from the JSON API: membership, role, RoleBinding and
+    # ServiceAccount. The objects are created (or skipped) for existing
+    # members too.
+    def provision_user_record(record):
+        record, error = services.with_short_name(record)
+        if error:
+            return error
+        username, short_name, group, role = record["username"], record["short_name"], record["group"], record["role"]
+        services.store.add_member(group, username, short_name)
+        services.store.set_role(username, group, role)
+        return provision(record, group, role, " ")
+
+    bp.register_blueprint(create_api_blueprint(
+        services.create_namespace, provision_user_record, services,
+        required=("username", "group", "role"),
+        delete_group=services.remove_group,
+    ))
+    return bp
+
+
+# Group RoleBindings and ServiceAccounts with an imagePullSecret, with the
+# JSON API (image-pull-app.py)
+def image_pull_blueprint(services):
+    bp = Blueprint("image_pull", __name__)
+
+    # Copy the pull secret into a new group's namespace
+    def copy_pull_secret(group):
+        return summary(services.replicate_pull_secret([group]))
+
+    def create_group(name):
+        message, created = services.create_namespace(name)
+        if created:
+            message += f" {copy_pull_secret(name)}"
+        return message, created
+
+    bp.add_url_rule(
+        "/add_group", view_func=_add_group_view(services, True, on_created=copy_pull_secret), methods=["GET", "POST"]
+    )
+
+    def provision(user, group):
+        service_account_message = services.create_service_account(
+            group, user["short_name"], user["username"], pull_secret=IMAGE_PULL_SECRET
+        )
+        return f"User '{user['username']}' added to group '{group}'. {service_account_message}"
+
+    async def provision_async(engine, user, group):
+        service_account_message = await engine.create_service_account(
+            group, user["short_name"], user["username"], pull_secret=IMAGE_PULL_SECRET
+        )
+        return f"User '{user['username']}' added to group '{group}'. {service_account_message}"
+
+    @bp.route("/add_user", methods=["GET", "POST"])
+    def add_user():
+        message = ""
+        job_id = None
+        if request.method == "POST":
+            group = request.form.get("group")
+            users = request.form.get("users")  # Expecting "username:shortname, username2" (short name optional)
+            if group and users:
+                requested = []
+                for user in (user.strip() for user in users.split(",")):
+                    username, _, shortname = user.partition(":")
+                    if username:
+                        requested.append({"username": username.strip(), "short_name": shortname.strip() or None})
+                    else:
+                        message += f"Invalid format for user '{user}'. Use 'username' or 'username:shortname'.\n"
+
+                # Check the short names typed in and generate the missing ones
+                requested, errors = services.assign_short_names(group, requested)
+                message += "".join(f"{error}\n" for error in errors)
+                new_users = []
+                for user in requested:
+                    if services.store.add_member(group, user["username"], user["short_name"]):
+                        new_users.append(user)
+                    else:
+                        message += f"User '{user['username']}' already exists in group '{group}'.\n"
+
+                # Create the ServiceAccounts in a background job
+                if new_users:
+                    job = services.submit_job(
+                        f"Add {len(new_users)} users to group '{group}'",
+                        new_users, group,
+                        lambda user: provision(user, group),
+                        lambda engine, user: provision_async(engine, user, group),
+                        prepare=copy_pull_secret,
+                    )
+                    job_id = job.id
+                    message += f"Queued job '{job.id}' for {len(new_users)} users. Track progress at /jobs/{job.id}.\n"
+        return render_template("add_pull_users.html", message=message, job_id=job_id)
+
+    # Add one user record from the JSON API: membership and ServiceAccount.
+    # The ServiceAccount is created (or skipped) for existing members too.
+    def provision_user_record(record):
+        record, error = services.with_short_name(record)
+        if error:
+            return error
+        services.store.add_member(record["group"], record["username"], record["short_name"])
+        return provision(record, record["group"])
+
+    # Copy the pull secret into every managed namespace, e.g. after rotating
+    # it; only copies whose content hash differs are written
+    @bp.route("/api/v1/pull-secret:sync", methods=["POST"])
+    def api_sync_pull_secret():
+        dry_run = request.args.get("dry_run", "").lower() in ("1", "true")
+        result = services.replicate_pull_secret(dry_run=dry_run)
+        if not result["source_found"]:
+            return json_response(result, 404)
+        return json_response(result, 500 if result["errors"] else 200)
+
+    bp.register_blueprint(create_api_blueprint(
+        create_group, provision_user_record, services,
+        required=("username", "group"),
+        delete_group=services.remove_group,
+    ))
+    return bp
+
+
+# Moving and deleting users, one at a time or in bulk (edit-user-app.py)
+def edit_blueprint(services):
+    bp = Blueprint("edit", __name__)
+
+    # Resolve "group/short_name/username" checkbox values into user records
+    def selected_users(values):
+        users = []
+        for value in values:
+            group, short_name, username = value.split("/", 2)
+            role = services.store.get_role(username)
+            users.append({
+                "username": username,
+                "short_name": short_name or None,
+                "group": group,
+                "role": role["role"] if role else None,
+            })
+        return users
+
+    # Delete many users concurrently, then drop them from the mappings in one pass
+    def remove_users(users):
+        store = services.store
+        results = delete_users(services.v1, services.rbac_api, users, subjects=services.subjects)
+        removed = [r["user"] for r in results if r["ok"]]
+        store.remove_members([(u["group"], u["username"]) for u in removed])
+        store.delete_roles([u["username"] for u in removed])
+        return results
+
+    # Move many users concurrently, then update the mappings in one pass
+    def move_users(users, new_group, new_role):
+        store = services.store
+
+        def move(user):
+            _, message = move_user(
+                services.v1, services.rbac_api, user["username"], user["short_name"], user["group"], user["role"],
+                new_group or user["group"], new_role or user["role"], subjects=services.subjects,
+            )
+            return message
+
+        results, _ = provision_users(users, move, max_in_flight=BULK_EDIT_PARALLELISM)
+        moved = [r["user"] for r in results if r["ok"]]
+        store.remove_members([(u["group"], u["username"]) for u in moved if new_group and new_group != u["group"]])
+        if new_group:
+            store.add_members(new_group, [u for u in moved if new_group != u["group"]])
+        store.set_role_rows([
+            (u["username"], new_group or u["group"], new_role or u["role"]) for u in moved if new_role or u["role"]
+        ])
+        return results
+
+    @bp.route("/edit_users", methods=["GET", "POST"])
+    def edit_users():
+        store = services.store
+        message = ""
+        results = []
+        if request.method == "POST":
+            action = request.form.get("action")
+            username = request.form.get("username")
+            short_name = request.form.get("short_name")
+            old_group = request.form.get("old_group")
+            new_group = request.form.get("new_group")
+            new_role = request.form.get("new_role")
+
+            if action == "bulk_delete":
+                results = remove_users(selected_users(request.form.getlist("selected")))
+            elif action == "bulk_update":
+                if new_group or new_role:
+                    results = move_users(selected_users(request.form.getlist("selected")), new_group, new_role)
+                else:
+                    message = "Enter a new group and/or a new role for the selected users."
+            elif action == "update":
+                # Group-binding and image-pull users have no role (and so no
+                # RoleBinding) unless one is given here
+                old_role = (store.get_role(username) or {}).get("role")
+                new_group = new_group or old_group
+                new_role = new_role or old_role
+
+                # Create the new RoleBinding/ServiceAccount before removing the old ones
+                moved, message = move_user(
+                    services.v1, services.rbac_api, username, short_name, old_group, old_role, new_group, new_role,
+                    subjects=services.subjects,
+                )
+
+                # Update user mapping
+                if moved:
+                    if new_group != old_group:
+                        store.remove_member(old_group, username)
+                        store.add_member(new_group, username, short_name)
+                    if new_role:
+                        store.set_role(username, new_group, new_role)
+
+            elif action == "delete":
+                # Delete Kubernetes resources
+                role = (store.get_role(username) or {}).get("role")
+                messages = []
+                if role:
+                    messages.append(services.delete_rolebinding(old_group, username, role))
+                if short_name:
+                    messages.append(services.delete_service_account(old_group, short_name))
+                message = " ".join(messages) or f"User '{username}' removed from group '{old_group}'."
+
+                # Remove the user from the group and mappings
+                store.remove_member(old_group, username)
+                store.delete_role(username)
+
+        return render_template(
+            "edit_users.html", message=message, results=results,
+            user_groups=store.user_groups(), user_roles=store.user_roles(),
+        )
+
+    # Bulk delete from automation: a JSON array or NDJSON stream of
+    # {"username", "group"} records, with optional "short_name" and "role"
+    @bp.route("/api/v1/users:delete", methods=["POST"])
+    def api_delete_users():
+        store = services.store
+        try:
+            records = list(iter_records())
+        except BODY_ERRORS as e:
+            return error_response(f"Invalid request body: {e}")
+        users = []
+        for record in records:
+            if not isinstance(record, dict) or not record.get("username") or not record.get("group"):
+                return error_response("Each record needs a username and a group.")
+            member = store.get_member(record["group"], record["username"]) or {}
+            role = store.get_role(record["username"]) or {}
+            users.append({
+                "username": record["username"],
+                "group": record["group"],
+                "short_name": record.get("short_name") or member.get("short_name"),
+                "role": record.get("role") or role.get("role"),
+            })
+        results = remove_users(users)
+        failed = sum(1 for r in results if not r["ok"])
+        return json_response({"total": len(results), "failed": failed, "results": results})
+
+    return bp
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        Profile("group-binding", "Group RoleBindings", group_binding_blueprint,
+                [("Add Group", "add_group"), ("Add User", "add_user")]),
+        Profile("user-binding", "User RoleBindings", user_binding_blueprint,
+                [("Add Group", "add_group"), ("Add User", "add_user"), ("Add Users", "add_users")]),
+        Profile("service-account", "ServiceAccounts", service_account_blueprint,
+                [("Add Group", "add_group"), ("Add Users", "add_users")], rebuild_store=True),
+        Profile("image-pull", "Image-pull ServiceAccounts", image_pull_blueprint,
+                [("Add Group", "add_group"), ("Add Users", "add_user")], rebuild_store=True),
+        Profile("edit", "Edit Users", edit_blueprint, [("Edit Users", "edit_users")]),
+    )
+}
@@ -0,0 +1,200 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client
+
+from cluster_sync import iter_pages
+from k8s_writes import MANAGED_BY, MANAGED_BY_LABEL, MANAGED_SELECTOR, created_by_app, mark_managed
+
+# Secret attached to the ServiceAccounts of the image-pull profile
+IMAGE_PULL_SECRET = os.environ.get("IMAGE_PULL_SECRET", "gcr-cred")
+
+# Namespace holding the source copy of IMAGE_PULL_SECRET, which is replicated
+# into every managed namespace
+PULL_SECRET_SOURCE_NAMESPACE = os.environ.get("PULL_SECRET_SOURCE_NAMESPACE", "default")
+
+# Writes issued at the same time while replicating
+PULL_SECRET_PARALLELISM = int(os.environ.get("PULL_SECRET_PARALLELISM", "32"))
+
+# Annotations on every copy: the hash of the content it was written with and
+# the secret it was copied from
+CONTENT_HASH_ANNOTATION = "hpc/content-hash"
+REPLICATED_FROM_ANNOTATION = "hpc/replicated-from"
+
+
+# Stable hash of a secret's type and data
+def content_hash(secret):
+    data = {"type": secret.type, "data": secret.data or {}}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _annotations(source, digest):
+    return {
+        CONTENT_HASH_ANNOTATION: digest,
+        REPLICATED_FROM_ANNOTATION: f"{source.metadata.namespace}/{source.metadata.name}",
+    }
+
+
+def _copy_body(source, namespace, digest):
+    return mark_managed(client.V1Secret(
+        metadata=client.V1ObjectMeta(
+            name=source.metadata.name, namespace=namespace, annotations=_annotations(source, digest)
+        ),
+        type=source.type,
+        data=source.data,
+    ))
+
+
+# Patch turning a copy into the source's content: its data, with keys the
+# source no longer has set to null so they are removed
+def _patch_body(source, copy, digest):
+    data = {key: None for key in copy.data or {} if key not in (source.data or {})}
+    data.update(source.data or {})
+    return {
+        "metadata": {"labels": {MANAGED_BY_LABEL: MANAGED_BY}, "annotations": _annotations(source, digest)},
+        "data": data,
+    }
+
+
+# Names of the namespaces the apps created
+def managed_namespaces(v1):
+    return {
+        ns.metadata.name for items in iter_pages(v1.list_namespace, MANAGED_SELECTOR) for ns in items if created_by_app(ns)
+    }
+
+
+# Existing copies of the secret by namespace, from one paginated list (of a
+# single namespace when only one is wanted) instead of a read per namespace
+def current_copies(v1, name, namespaces):
+    if len(namespaces) == 1:
+        list_fn = functools.partial(v1.list_namespaced_secret, next(iter(namespaces)))
+    else:
+        list_fn = v1.list_secret_for_all_namespaces
+    return {
+        secret.metadata.namespace: secret
+        for items in iter_pages(list_fn, None, field_selector=f"metadata.name={name}")
+        for secret in items
+        if secret.metadata.namespace in namespaces
+    }
+
+
+# Minimal set of writes: create the missing copies and patch those whose
+# recorded or actual content differs from the source. A copy of another type
+# is replaced, as the type of a secret cannot be changed.
+def plan(source, namespaces, copies):
+    digest = content_hash(source)
+    creates, patches, replaces = [], [], []
+    unchanged = 0
+    for namespace in sorted(namespaces):
+        copy = copies.get(namespace)
+        if copy is None:
+            creates.append(namespace)
+        elif copy.type != source.type:
+            replaces.append(namespace)
+        elif (copy.metadata.annotations or {}).get(CONTENT_HASH_ANNOTATION) != digest or content_hash(copy) != digest:
+            patches.append(namespace)
+        else:
+            unchanged += 1
+    return {"create": creates, "patch": patches, "replace": replaces, "unchanged": unchanged, "hash": digest}
+
+
+def _apply_one(v1, source, digest, action, namespace, copy):
+    name = source.metadata.name
+    if action == "patch":
+        v1.patch_namespaced_secret(name=name, namespace=namespace, body=_patch_body(source, copy, digest))
+        return
+    if action == "replace":
+        v1.delete_namespaced_secret(name=name, namespace=namespace)
+    v1.create_namespaced_secret(namespace=namespace, body=_copy_body(source, namespace, digest))
+
+
+# Copy the source secret into the given namespaces (default: every managed
+# namespace), writing only the copies that are missing or out of date, many
+# at a time. Returns the namespaces in each bucket, any errors, the source's
+# content hash and how long it took; source_found is False (and nothing is
+# written) when the source secret does not exist.
+def replicate(v1, namespaces=None, name=IMAGE_PULL_SECRET, source_namespace=PULL_SECRET_SOURCE_NAMESPACE,
+              dry_run=False, parallelism=PULL_SECRET_PARALLELISM):
+    start = time.monotonic()
+    result = {
+        "name": name, "source_namespace": source_namespace, "source_found": True,
+        "create": [], "patch": [], "replace": [], "unchanged": 0, "errors": [], "hash": None, "dry_run": dry_run,
+    }
+    try:
+        source = v1.read_namespaced_secret(name=name, namespace=source_namespace)
+        targets = set(namespaces if namespaces is not None else managed_namespaces(v1)) - {source_namespace}
+        copies = current_copies(v1, name, targets) if targets else {}
+    except client.exceptions.ApiException as e:
+        if e.status == 404:
+            result["source_found"] = False
+        else:
+            result["errors"].append(f"An error occurred while reading secret '{name}' from namespace '{source_namespace}': {e}")
+        result["seconds"] = time.monotonic() - start
+        return result
+    result.update(plan(source, targets, copies))
+
+    def run(operation):
+        action, namespace = operation
+        try:
+            _apply_one(v1, source, result["hash"], action, namespace, copies.get(namespace))
+            return None
+        except client.exceptions.ApiException as e:
+            return f"An error occurred while trying to {action} secret '{name}' in namespace '{namespace}': {e}"
+
+    if not dry_run:
+        operations = [(action, namespace) for action in ("create", "patch", "replace") for namespace in result[action]]
+        if operations:
+            with ThreadPoolExecutor(max_workers=min(parallelism, len(operations))) as executor:
+                result["errors"] += [error for error in executor.map(run, operations) if error]
+    result["seconds"] = time.monotonic() - start
+    return result
+
+
+# One-line summary of a replicate() result for the web pages
+def summary(result):
+    if not result["source_found"]:
+        return f"Pull secret '{result['source_namespace']}/{result['name']}' not found; nothing to replicate."
+    if result["errors"] and result["hash"] is None:
+        return result["errors"][0]
+    message = (
+        f"Pull secret '{result['name']}': {len(result['create'])} created, "
+        f"{len(result['patch']) + len(result['replace'])} updated, {result['unchanged']} unchanged."
+    )
+    if result["errors"]:
+        message += f" {len(result['errors'])} failed: {result['errors'][0]}"
+    return message
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy the image pull secret into every managed namespace.")
+    parser.add_argument("--name", default=IMAGE_PULL_SECRET, help="secret to replicate")
+    parser.add_argument("--source-namespace", default=PULL_SECRET_SOURCE_NAMESPACE, help="namespace of the source secret")
+    parser.add_argument("--namespace", action="append", help="only replicate into this namespace (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="only print which copies would be written")
+    args = parser.parse_args(argv)
+
+    import audit
+    import k8s_client
+
+    result = replicate(
+        k8s_client.core_api(), namespaces=args.namespace, name=args.name,
+        source_namespace=args.source_namespace, dry_run=args.dry_run,
+    )
+    if not args.dry_run:
+        audit.journal.record(
+            action="replicate", kind="Secret", name=args.name, namespaces=args.namespace,
+            ok=not result["errors"], message=summary(result),
+        )
+        audit.journal.close()
+    print(json.dumps(result, indent=2))
+    return 1 if result["errors"] or not result["source_found"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import time
+
+from cluster_sync import PAGE_SIZE
+from informer import Informer
+from metrics import timed_call
+
+# Seconds a query waits for the initial list before answering from what it has
+RBAC_INDEX_SYNC_TIMEOUT = float(os.environ.get("RBAC_INDEX_SYNC_TIMEOUT", "30"))
+
+
+def _subject(subject):
+    return (subject.kind, subject.name, subject.namespace if subject.kind == "ServiceAccount" else None)
+
+
+def _subject_json(subject):
+    kind, name, namespace = subject
+    return {"kind": kind, "name": name, "namespace": namespace} if namespace else {"kind": kind, "name": name}
+
+
+# In-process index of who has which role where, built from every RoleBinding
+# in the cluster and kept current by a list and a watch (see Informer), so
+# access reviews are answered without an API call.
+#
+# Subjects are (kind, name, namespace) with the namespace only set for
+# ServiceAccounts. The index maps each subject to the (namespace, role) pairs
+# it holds and each namespace to the subjects of each of its roles, both down
+# to the names of the granting bindings, so a subject listed in two bindings
+# keeps its access until both are gone.
+class RbacIndex(Informer):
+    kind = "RoleBindings"
+
+    def __init__(self, rbac_api, watch_timeout=300, retry_delay=5, page_size=PAGE_SIZE):
+        super().__init__(
+            rbac_api.list_role_binding_for_all_namespaces, "rbac-index", watch_timeout, retry_delay, page_size
+        )
+        self.rbac_api = rbac_api
+        self._bindings = {}
+        self._by_subject = {}
+        self._by_namespace = {}
+        self._namespace_views = {}
+        self.queries = 0
+
+    def _add(self, namespace, name, role, subjects):
+        self._bindings[(namespace, name)] = (role, subjects)
+        roles = self._by_namespace.setdefault(namespace, {}).setdefault(role, {})
+        for subject in subjects:
+            self._by_subject.setdefault(subject, {}).setdefault((namespace,) + role, set()).add(name)
+            roles.setdefault(subject, set()).add(name)
+        self._namespace_views.pop(namespace, None)
+
+    def _remove(self, namespace, name):
+        binding = self._bindings.pop((namespace, name), None)
+        if binding is None:
+            return
+        role, subjects = binding
+        roles = self._by_namespace[namespace]
+        for subject in subjects:
+            grants = self._by_subject[subject]
+            grants[(namespace,) + role].discard(name)
+            if not grants[(namespace,) + role]:
+                del grants[(namespace,) + role]
+                if not grants:
+                    del self._by_subject[subject]
+            roles[role][subject].discard(name)
+            if not roles[role][subject]:
+                del roles[role][subject]
+        if not roles[role]:
+            del roles[role]
+            if not roles:
+                del self._by_namespace[namespace]
+        self._namespace_views.pop(namespace, None)
+
+    def _put(self, rb):
+        role = (rb.role_ref.kind, rb.role_ref.name)
+        subjects = frozenset(_subject(s) for s in rb.subjects or [])
+        self._remove(rb.metadata.namespace, rb.metadata.name)
+        self._add(rb.metadata.namespace, rb.metadata.name, role, subjects)
+
+    @timed_call("list_role_bindings")
+    def _relist(self):
+        super()._relist()
+
+    def _replace(self, items):
+        self._bindings, self._by_subject, self._by_namespace, self._namespace_views = {}, {}, {}, {}
+        for rb in items:
+            self._put(rb)
+
+    def _apply(self, event_type, rb):
+        if event_type == "DELETED":
+            self._remove(rb.metadata.namespace, rb.metadata.name)
+        else:
+            self._put(rb)
+
+    # Roles a subject holds, one entry per (namespace, role), sorted
+    def access(self, name, kind="User", namespace=None):
+        self._synced.wait(RBAC_INDEX_SYNC_TIMEOUT)
+        subject = (kind, name, namespace if kind == "ServiceAccount" else None)
+        with self._lock:
+            self.queries += 1
+            grants = sorted(self._by_subject.get(subject, {}).items())
+            return [
+                {"namespace": ns, "role_kind": role_kind, "role": role_name, "bindings": sorted(names)}
+                for (ns, role_kind, role_name), names in grants
+            ]
+
+    # Subjects of each role in a namespace, sorted. The view is built once per
+    # change to the namespace's bindings, so repeated queries cost a lookup.
+    def namespace_access(self, namespace):
+        self._synced.wait(RBAC_INDEX_SYNC_TIMEOUT)
+        with self._lock:
+            self.queries += 1
+            view = self._namespace_views.get(namespace)
+            if view is None:
+                view = [
+                    {
+                        "role_kind": role_kind,
+                        "role": role_name,
+                        "subjects": [
+                            {**_subject_json(subject), "bindings": sorted(names)}
+                            for subject, names in sorted(subjects.items(), key=lambda item: tuple(map(str, item[0])))
+                        ],
+                    }
+                    for (role_kind, role_name), subjects in sorted(self._by_namespace.get(namespace, {}).items())
+                ]
+                self._namespace_views[namespace] = view
+            return view
+
+    def stats(self):
+        with self._lock:
+            age = time.time() - self.last_sync if self.last_sync else None
+            return {
+                "synced": self._synced.is_set(),
+                "role_bindings": len(self._bindings),
+                "subjects": len(self._by_subject),
+                "namespaces": len(self._by_namespace),
+                "queries": self.queries,
+                "resource_version": self._resource_version,
+                "age_seconds": age,
+            }
@@ -0,0 +1,248 @@
+import argparse
+import functools
+import hashlib
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client
+
+import aggregated_bindings
+import audit
+from cluster_sync import LONG_ACCOUNT_LABEL, iter_pages
+from k8s_writes import (
+    AGGREGATED_ROLE_LABEL,
+    MANAGED_BY_LABEL,
+    aggregated_role_binding_body,
+    ensure_namespace,
+    merge_patch,
+    serialize,
+    service_account_body,
+    user_role_binding_body,
+)
+
+# Annotation holding the hash of the spec the object was last written with
+SPEC_HASH_ANNOTATION = "hpc/spec-hash"
+
+# Writes issued at the same time while applying a plan
+APPLY_PARALLELISM = 16
+
+# ensure_namespace with a journal record; "skip" when the namespace existed
+_ensure_namespace = audit.audited(
+    "create", "Namespace", skipped=audit.already_existed, group="name", name="name"
+)(ensure_namespace)
+
+# Documents naming at most this many namespaces are read with a list per
+# namespace instead of cluster-wide lists
+NAMESPACED_LIST_MAX = 8
+
+# Fields of each kind set only from the document; a patch removes them when
+# the desired object no longer has them
+OWNED_FIELDS = {"ServiceAccount": ("imagePullSecrets",), "RoleBinding": ("subjects",)}
+
+# API paths the patches are sent to
+PATHS = {
+    "ServiceAccount": "/api/v1/namespaces/{namespace}/serviceaccounts/{name}",
+    "RoleBinding": "/apis/rbac.authorization.k8s.io/v1/namespaces/{namespace}/rolebindings/{name}",
+}
+
+
+# Stable hash of everything we manage on an object except the hash itself
+def spec_hash(body):
+    data = serialize(body)
+    metadata = data.get("metadata", {})
+    data["metadata"] = {"name": metadata.get("name"), "labels": metadata.get("labels")}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _hash_of(obj):
+    return (obj.metadata.annotations or {}).get(SPEC_HASH_ANNOTATION)
+
+
+def _with_hash(body):
+    body.metadata.annotations = {SPEC_HASH_ANNOTATION: spec_hash(body)}
+    return body
+
+
+# Labels the apps write; labels added by anyone else are left alone
+def _own_label(key):
+    return key.startswith("hpc/") or key == MANAGED_BY_LABEL
+
+
+# JSON merge patch turning the live object into body: the owned fields and
+# own labels that body no longer has are set to null, so a patch converges
+# on the document instead of only adding to the object
+def patch_body(kind, body, live):
+    patch = serialize(body)
+    labels = patch["metadata"].setdefault("labels", {})
+    for key in live.metadata.labels or {}:
+        if _own_label(key):
+            labels.setdefault(key, None)
+    for field in OWNED_FIELDS[kind]:
+        patch.setdefault(field, None)
+    return patch
+
+
+# Desired ServiceAccounts and RoleBindings keyed by (kind, namespace, name).
+# With aggregated RoleBindings there is one per namespace and role, and any
+# per-user RoleBinding left in the cluster is pruned.
+#
+# The document looks like:
+#   {"groups": [{"name": "physics", "users": [
+#       {"username": "alice", "short_name": "alice", "role": "admin", "pull_secret": "gcr-cred"}]}]}
+def desired_objects(document, aggregated=None):
+    aggregated = aggregated_bindings.aggregated() if aggregated is None else aggregated
+    objects = {}
+    for group in document.get("groups", []):
+        namespace = group["name"]
+        role_users = {}
+        for user in group.get("users", []):
+            username = user["username"]
+            if user.get("short_name"):
+                body = service_account_body(user["short_name"], username, user.get("pull_secret"))
+                body.metadata.namespace = namespace
+                objects[("ServiceAccount", namespace, body.metadata.name)] = _with_hash(body)
+            if user.get("role") and aggregated:
+                role_users.setdefault(user["role"], []).append(username)
+            elif user.get("role"):
+                body = user_role_binding_body(namespace, username, user["role"])
+                objects[("RoleBinding", namespace, body.metadata.name)] = _with_hash(body)
+        for role_name, usernames in role_users.items():
+            body = aggregated_role_binding_body(namespace, role_name, usernames)
+            objects[("RoleBinding", namespace, body.metadata.name)] = _with_hash(body)
+    return objects
+
+
+# Current managed objects in the given namespaces, fetched with paginated
+# lists instead of per-object reads: one per namespace for a few namespaces,
+# cluster-wide otherwise.
+def current_objects(v1, rbac_api, namespaces):
+    if len(namespaces) <= NAMESPACED_LIST_MAX:
+        sources = [
+            (functools.partial(v1.list_namespaced_service_account, namespace),
+             functools.partial(rbac_api.list_namespaced_role_binding, namespace))
+            for namespace in sorted(namespaces)
+        ]
+    else:
+        sources = [(v1.list_service_account_for_all_namespaces, rbac_api.list_role_binding_for_all_namespaces)]
+    objects = {}
+    for list_service_accounts, list_role_bindings in sources:
+        for kind, list_fn, label in (
+            ("ServiceAccount", list_service_accounts, LONG_ACCOUNT_LABEL),
+            ("RoleBinding", list_role_bindings, LONG_ACCOUNT_LABEL),
+            ("RoleBinding", list_role_bindings, AGGREGATED_ROLE_LABEL),
+        ):
+            for items in iter_pages(list_fn, label):
+                for item in items:
+                    if item.metadata.namespace in namespaces:
+                        objects[(kind, item.metadata.namespace, item.metadata.name)] = item
+    return objects
+
+
+# Minimal set of changes: create what is missing, patch what changed, and
+# delete managed objects that are no longer wanted when prune is set.
+def plan(desired, current, prune=True):
+    creates, patches, deletes = [], [], []
+    unchanged = 0
+    for key, body in desired.items():
+        live = current.get(key)
+        if live is None:
+            creates.append((key, body))
+        elif _hash_of(live) != _hash_of(body):
+            patches.append((key, patch_body(key[0], body, live)))
+        else:
+            unchanged += 1
+    if prune:
+        deletes = [(key, None) for key in current if key not in desired]
+    return {"create": creates, "patch": patches, "delete": deletes, "unchanged": unchanged}
+
+
+def _apply_one(v1, rbac_api, action, key, body):
+    kind, namespace, name = key
+    if action == "patch":
+        merge_patch(v1 if kind == "ServiceAccount" else rbac_api, PATHS[kind], body, namespace=namespace, name=name)
+    elif kind == "ServiceAccount":
+        if action == "create":
+            v1.create_namespaced_service_account(namespace=namespace, body=body)
+        else:
+            v1.delete_namespaced_service_account(name=name, namespace=namespace)
+    else:
+        if action == "create":
+            rbac_api.create_namespaced_role_binding(namespace=namespace, body=body)
+        else:
+            rbac_api.delete_namespaced_role_binding(name=name, namespace=namespace)
+
+
+# The namespaces that get new objects are ensured first (a new group has
+# none yet), then creates and patches go, and deletes only once they are
+# done, so that replacing per-user RoleBindings with aggregated ones never
+# drops access. Returns the namespaces created and any errors.
+def apply_plan(v1, rbac_api, changes, parallelism=APPLY_PARALLELISM):
+    # Every write is recorded in the audit journal
+    def run(operation):
+        action, (kind, namespace, name), body = operation
+        error = None
+        try:
+            _apply_one(v1, rbac_api, action, (kind, namespace, name), body)
+        except client.exceptions.ApiException as e:
+            error = f"An error occurred while trying to {action} {kind} '{name}' in namespace '{namespace}': {e}"
+        audit.journal.record(action=action, kind=kind, group=namespace, name=name, ok=error is None, message=error)
+        return error
+
+    created, errors = [], []
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        namespaces = sorted({key[1] for key, _ in changes["create"]})
+        results = executor.map(lambda namespace: _ensure_namespace(v1, namespace), namespaces)
+        for namespace, (message, was_created) in zip(namespaces, results):
+            if was_created:
+                created.append(namespace)
+            elif "An error occurred" in message:
+                errors.append(f"{message} (namespace '{namespace}')")
+        for actions in (("create", "patch"), ("delete",)):
+            operations = [(action, key, body) for action in actions for key, body in changes[action]]
+            errors += [error for error in executor.map(run, operations) if error]
+    return created, errors
+
+
+# Reconcile the cluster to a desired-state document. Returns the objects in
+# each bucket, the namespaces created, any errors, and how long it took.
+def reconcile(v1, rbac_api, document, prune=True, dry_run=False):
+    start = time.monotonic()
+    namespaces = {group["name"] for group in document.get("groups", [])}
+    desired = desired_objects(document)
+    changes = plan(desired, current_objects(v1, rbac_api, namespaces), prune)
+    created, errors = ([], []) if dry_run else apply_plan(v1, rbac_api, changes)
+    return {
+        "namespaces": created,
+        "create": [list(key) for key, _ in changes["create"]],
+        "patch": [list(key) for key, _ in changes["patch"]],
+        "delete": [list(key) for key, _ in changes["delete"]],
+        "unchanged": changes["unchanged"],
+        "errors": errors,
+        "dry_run": dry_run,
+        "seconds": time.monotonic() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile groups, users and bindings to a desired-state document.")
+    parser.add_argument("path", help="JSON desired-state document")
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan")
+    parser.add_argument("--no-prune", action="store_true", help="never delete objects missing from the document")
+    args = parser.parse_args(argv)
+
+    import k8s_client
+
+    with open(args.path) as f:
+        document = json.load(f)
+    result = reconcile(
+        k8s_client.core_api(), k8s_client.rbac_api(), document, prune=not args.no_prune, dry_run=args.dry_run
+    )
+    audit.journal.close()
+    print(json.dumps(result, indent=2))
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import os
+import threading
+import time
+
+from kubernetes import client
+
+import aggregated_bindings
+import audit
+import k8s_client
+import metrics
+from aggregated_bindings import SubjectBatcher
+from async_provisioning import create_engine
+from cluster_sync import rebuild_on_startup
+from group_teardown import delete_group
+from jobs import JOB_DRAIN_TIMEOUT, JobQueue
+from k8s_writes import (
+    aggregated_role_binding_name,
+    apply_role_binding,
+    apply_service_account,
+    ensure_namespace,
+    group_role_binding_body,
+    service_account_body,
+    user_role_binding_body,
+)
+from namespace_cache import NamespaceCache
+from pull_secrets import IMAGE_PULL_SECRET, replicate
+from rbac_index import RbacIndex
+from short_names import ShortNameIndex
+from user_store import USER_STORE_PATH, create_store
+
+# Only one worker process rebuilds the store from the cluster per this many seconds
+REBUILD_LEASE_SECONDS = int(os.environ.get("REBUILD_LEASE_SECONDS", "300"))
+
+# Seconds a readiness result is reused before the store and API server are checked again
+READINESS_CACHE_SECONDS = float(os.environ.get("READINESS_CACHE_SECONDS", "5"))
+
+
+# Kubernetes clients, namespace cache, store and job queue shared by every
+# profile in the process, together with the Kubernetes helpers the profiles
+# call. Each component is created on first use, so the namespace watch, the
+# store rebuild and the job workers only start once a workflow needs them.
+class Services:
+    def __init__(self, store_path=USER_STORE_PATH, rebuild_store=False):
+        self.store_path = store_path
+        self.rebuild_store = rebuild_store
+        self.draining = False
+        self._components = {}
+        self._lock = threading.RLock()
+        self._readiness = (0.0, None)
+
+    def _get(self, name, create):
+        with self._lock:
+            if name not in self._components:
+                self._components[name] = create()
+            return self._components[name]
+
+    # The component if it has been created, else None (e.g. for /metrics)
+    def loaded(self, name):
+        return self._components.get(name)
+
+    @property
+    def v1(self):
+        return self._get("v1", k8s_client.core_api)
+
+    @property
+    def rbac_api(self):
+        return self._get("rbac_api", k8s_client.rbac_api)
+
+    @property
+    def namespace_cache(self):
+        return self._get("namespace_cache", lambda: NamespaceCache(self.v1).start())
+
+    # ServiceAccount names per namespace, for allocating short names
+    @property
+    def short_names(self):
+        return self._get("short_names", lambda: ShortNameIndex(self.v1).start())
+
+    # Who holds which role in which namespace, for access reviews
+    @property
+    def rbac_index(self):
+        return self._get("rbac_index", lambda: RbacIndex(self.rbac_api).start())
+
+    # Writer for the aggregated RoleBindings, or None unless
+    # K8S_BINDING_MODE=aggregated
+    @property
+    def subjects(self):
+        if not aggregated_bindings.aggregated():
+            return None
+        return self._get("subjects", lambda: SubjectBatcher(self.rbac_api))
+
+    # The asyncio provisioning engine, or None unless K8S_ASYNC_PROVISIONING=1
+    # and kubernetes_asyncio is installed
+    @property
+    def async_engine(self):
+        return self._get("async_engine", lambda: create_engine(short_names=lambda: self.loaded("short_names")))
+
+    @property
+    def job_queue(self):
+        return self._get("job_queue", lambda: JobQueue(store=self.store))
+
+    # Group memberships, user roles and job state shared by every worker.
+    # When a profile that creates labelled objects is enabled, the store is
+    # rebuilt from the cluster on open by whichever worker gets there first.
+    @property
+    def store(self):
+        def open_store():
+            store = create_store(self.store_path)
+            if self.rebuild_store and store.claim("rebuild", REBUILD_LEASE_SECONDS):
+                rebuild_on_startup(self.v1, self.rbac_api, store)
+            return store
+
+        return self._get("store", open_store)
+
+    # Readiness: not shutting down, the store answers and the API server is
+    # reachable (the namespace cache has synced, or a one-item list works).
+    # Returns (ready, checks).
+    def readiness(self):
+        checked, result = self._readiness
+        if result is not None and time.monotonic() - checked < READINESS_CACHE_SECONDS and not self.draining:
+            return result
+        checks = {"draining": self.draining}
+        try:
+            self.store.ping()
+            checks["store"] = "ok"
+        except Exception as e:
+            checks["store"] = f"An error occurred: {e}"
+        namespace_cache = self.loaded("namespace_cache")
+        try:
+            if namespace_cache is None or not namespace_cache.stats()["synced"]:
+                self.v1.list_namespace(limit=1, _request_timeout=2)
+            checks["kubernetes"] = "ok"
+        except Exception as e:
+            checks["kubernetes"] = f"An error occurred: {e}"
+        ready = not self.draining and checks["store"] == "ok" and checks["kubernetes"] == "ok"
+        self._readiness = (time.monotonic(), (ready, checks))
+        return ready, checks
+
+    # Graceful shutdown: report not ready, let running onboarding jobs finish
+    # (up to the drain timeout), stop the watches and flush the audit journal
+    def drain(self, timeout=JOB_DRAIN_TIMEOUT):
+        self.draining = True
+        job_queue = self.loaded("job_queue")
+        if job_queue is not None:
+            interrupted = job_queue.drain(timeout)
+            print(f"Drained onboarding jobs; {interrupted} left unfinished.")
+        namespace_cache = self.loaded("namespace_cache")
+        if namespace_cache is not None:
+            namespace_cache.stop()
+        for name in ("short_names", "rbac_index"):
+            index = self.loaded(name)
+            if index is not None:
+                index.stop()
+        async_engine = self.loaded("async_engine")
+        if async_engine is not None:
+            async_engine.stop()
+        audit.journal.flush()
+
+    # Give every user in group a short name: names typed in are checked
+    # against the ServiceAccount index, missing ones are generated from the
+    # usernames. Returns (users with their short name, error messages).
+    def assign_short_names(self, group, users):
+        generated = iter(self.short_names.allocate(group, [u["username"] for u in users if not u.get("short_name")]))
+        assigned, errors = [], []
+        for user in users:
+            if not user.get("short_name"):
+                assigned.append({**user, "short_name": next(generated)})
+                continue
+            error = self.short_names.claim(group, user["username"], user["short_name"])
+            if error:
+                errors.append(error)
+            else:
+                assigned.append(user)
+        return assigned, errors
+
+    # The record of one user with its short name: for an existing member the
+    # one on file, so that provisioning them again (e.g. an import resumed
+    # after their writes failed) re-creates or skips the same objects;
+    # otherwise the record's own, checked, or a generated one. Returns
+    # (record, error).
+    def with_short_name(self, record):
+        member = self.store.get_member(record["group"], record["username"])
+        if member is not None and member["short_name"]:
+            return {**record, "short_name": member["short_name"]}, None
+        assigned, errors = self.assign_short_names(record["group"], [record])
+        if errors:
+            return None, f"An error occurred: {errors[0]}"
+        return assigned[0], None
+
+    # Queue an onboarding batch. provision_async is the coroutine counterpart
+    # of provision_one, taking the engine and the user; when the async engine
+    # is enabled the namespace setup and the whole batch run on it. prepare,
+    # if given, runs after the namespace setup and returns a message too.
+    def submit_job(self, description, users, group, provision_one, provision_async, prepare=None):
+        engine = self.async_engine
+        if engine is None:
+            create = lambda: self.create_namespace(group)[0]
+        else:
+            create = lambda: engine.run(engine.create_namespace(group))[0]
+        setup = create if prepare is None else lambda: f"{create()} {prepare(group)}"
+        if engine is None:
+            return self.job_queue.submit(description, users, provision_one, setup=setup)
+        return self.job_queue.submit(
+            description, users, provision_one, setup=setup,
+            runner=engine.runner(lambda user: provision_async(engine, user)),
+        )
+
+    # Utility function to create a namespace (group)
+    @metrics.timed_call("create_namespace")
+    @audit.audited("create", "Namespace", skipped=audit.already_existed, group="name", name="name")
+    def create_namespace(self, name):
+        return ensure_namespace(self.v1, name)
+
+    # Copy the image pull secret into the given namespaces (default: every
+    # managed namespace), writing only the copies that differ
+    @metrics.timed_call("replicate_pull_secret")
+    @audit.audited("replicate", "Secret", namespaces="namespaces")
+    def replicate_pull_secret(self, namespaces=None, dry_run=False):
+        return replicate(self.v1, namespaces=namespaces, dry_run=dry_run)
+
+    # Utility function to create a RoleBinding for a group in a namespace
+    @metrics.timed_call("create_rolebinding")
+    @audit.audited(
+        "create", "RoleBinding", group="namespace", name=lambda a: f"{a['group']}-rolebinding", role="role_name"
+    )
+    def create_rolebinding(self, namespace, group, role_name="admin"):
+        try:
+            apply_role_binding(self.rbac_api, namespace, group_role_binding_body(namespace, group, role_name))
+            return f"RoleBinding '{group}-rolebinding' created in namespace '{namespace}'."
+        except client.exceptions.ApiException as e:
+            return f"An error occurred: {e}"
+
+    # Utility function to create a RoleBinding for a user in a namespace, or
+    # add the user to the aggregated RoleBinding of the role
+    @metrics.timed_call("create_user_rolebinding")
+    @audit.audited("create", "RoleBinding", group="namespace", user="username", role="role_name")
+    def create_user_rolebinding(self, namespace, username, role_name="admin"):
+        try:
+            if self.subjects is not None:
+                self.subjects.add(namespace, role_name, username)
+                return (
+                    f"User '{username}' added to RoleBinding '{aggregated_role_binding_name(role_name)}' "
+                    f"in namespace '{namespace}'."
+                )
+            apply_role_binding(self.rbac_api, namespace, user_role_binding_body(namespace, username, role_name))
+            return f"RoleBinding '{username}-{role_name}-binding' created in namespace '{namespace}'."
+        except client.exceptions.ApiException as e:
+            return f"An error occurred: {e}"
+
+    # Utility function to create a service account for a user, optionally
+    # with an imagePullSecret. A short name reserved for it is given back if
+    # the create fails.
+    @metrics.timed_call("create_service_account")
+    @audit.audited("create", "ServiceAccount", group="namespace", name="short_name", user="username")
+    def create_service_account(self, namespace, short_name, username, pull_secret=None):
+        try:
+            apply_service_account(self.v1, namespace, service_account_body(short_name, username, pull_secret))
+        except client.exceptions.ApiException as e:
+            if self.loaded("short_names") is not None:
+                self.short_names.release(namespace, short_name)
+            return f"An error occurred while creating the ServiceAccount: {e}"
+        if pull_secret:
+            return f"ServiceAccount '{short_name}' created with imagePullSecret '{pull_secret}' in namespace '{namespace}'."
+        return f"ServiceAccount '{short_name}' created in namespace '{namespace}' with label 'hpc/long-account: {username}'."
+
+    # Utility function to delete a service account
+    @metrics.timed_call("delete_service_account")
+    @audit.audited("delete", "ServiceAccount", group="namespace", name="name")
+    def delete_service_account(self, namespace, name):
+        try:
+            self.v1.delete_namespaced_service_account(name=name, namespace=namespace)
+            return f"ServiceAccount '{name}' deleted successfully from namespace '{namespace}'."
+        except client.exceptions.ApiException as e:
+            return f"An error occurred while deleting the ServiceAccount: {e}"
+
+    # Utility function to delete a RoleBinding, or remove the user from the
+    # aggregated RoleBinding of the role
+    @metrics.timed_call("delete_rolebinding")
+    @audit.audited("delete", "RoleBinding", group="namespace", user="username", role="role_name")
+    def delete_rolebinding(self, namespace, username, role_name):
+        rolebinding_name = f"{username}-{role_name}-binding"
+        try:
+            if self.subjects is not None:
+                self.subjects.remove(namespace, role_name, username)
+                return f"User '{username}' removed from RoleBinding '{aggregated_role_binding_name(role_name)}'."
+            self.rbac_api.delete_namespaced_role_binding(name=rolebinding_name, namespace=namespace)
+            return f"RoleBinding '{rolebinding_name}' deleted successfully."
+        except client.exceptions.ApiException as e:
+            return f"An error occurred while deleting the RoleBinding: {e}"
+
+    # Tear down a group and drop its memberships once the objects are gone
+    @metrics.timed_call("delete_group")
+    @audit.audited("delete", "Group", group="group_name", delete_namespace="delete_namespace")
+    def remove_group(self, group_name, delete_namespace=False):
+        message, deleted = delete_group(
+            self.v1, self.rbac_api, group_name, delete_namespace=delete_namespace,
+            members=self.store.group_members(group_name),
+        )
+        if deleted:
+            self.store.remove_group(group_name)
+        return message, deleted
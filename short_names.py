@@ -0,0 +1,161 @@
+import os
+import re
+import time
+
+from cluster_sync import LONG_ACCOUNT_LABEL, PAGE_SIZE
+from informer import Informer
+from metrics import timed_call
+
+# Longest short name handed out. ServiceAccount names are DNS-1123
+# subdomains, but short names double as account names, so they are kept to a
+# DNS-1123 label (at most 63 characters) or less.
+SHORT_NAME_MAX_LENGTH = min(63, int(os.environ.get("SHORT_NAME_MAX_LENGTH", "63")))
+
+# Seconds allocate() waits for the initial list before allocating anyway
+SHORT_NAME_SYNC_TIMEOUT = float(os.environ.get("SHORT_NAME_SYNC_TIMEOUT", "30"))
+
+_DNS_1123_LABEL = re.compile(r"[a-z0-9]([-a-z0-9]*[a-z0-9])?")
+
+
+def is_valid_short_name(name):
+    return bool(name) and len(name) <= SHORT_NAME_MAX_LENGTH and bool(_DNS_1123_LABEL.fullmatch(name))
+
+
+# DNS-1123 form of a username: the part before any "@", lowercased, with
+# runs of other characters turned into "-" and trimmed to the maximum length
+def short_name_base(username, max_length=SHORT_NAME_MAX_LENGTH):
+    name = re.sub(r"[^a-z0-9]+", "-", username.split("@")[0].lower()).strip("-")
+    return name[:max_length].rstrip("-") or "user"
+
+
+# In-process index of every ServiceAccount name per namespace, used to hand
+# out unique short names without an API call per name. It is kept current by
+# a list and a watch (see Informer).
+#
+# For each namespace the index holds name -> long account name (from the
+# hpc/long-account label, None for other ServiceAccounts) and the reverse
+# map, so a user who already has a ServiceAccount gets the same name back.
+class ShortNameIndex(Informer):
+    kind = "ServiceAccounts"
+
+    def __init__(self, core_api, watch_timeout=300, retry_delay=5, page_size=PAGE_SIZE):
+        super().__init__(
+            core_api.list_service_account_for_all_namespaces, "short-name-index", watch_timeout, retry_delay, page_size
+        )
+        self.core_api = core_api
+        self._names = {}
+        self._accounts = {}
+        self._reserved = {}
+        self.allocated = 0
+        self.collisions = 0
+
+    # _accounts maps each user to their ServiceAccount or reserved name
+    def _add(self, namespace, name, username):
+        self._names.setdefault(namespace, {})[name] = username
+        if username:
+            self._accounts.setdefault(namespace, {})[username] = name
+        reserved = self._reserved.get(namespace)
+        if reserved:
+            reserved.pop(name, None)
+
+    def _reserve(self, namespace, name, username):
+        self._reserved.setdefault(namespace, {})[name] = username
+        self._accounts.setdefault(namespace, {})[username] = name
+
+    def _remove(self, namespace, name):
+        username = self._names.get(namespace, {}).pop(name, None)
+        if username and self._accounts.get(namespace, {}).get(username) == name:
+            del self._accounts[namespace][username]
+
+    @timed_call("list_service_accounts")
+    def _relist(self):
+        super()._relist()
+
+    # Reserved names whose ServiceAccount is still missing stay reserved
+    def _replace(self, items):
+        names, accounts = {}, {}
+        for sa in items:
+            username = (sa.metadata.labels or {}).get(LONG_ACCOUNT_LABEL)
+            names.setdefault(sa.metadata.namespace, {})[sa.metadata.name] = username
+            if username:
+                accounts.setdefault(sa.metadata.namespace, {})[username] = sa.metadata.name
+        for namespace, reserved in self._reserved.items():
+            for name, username in list(reserved.items()):
+                if name in names.get(namespace, {}):
+                    del reserved[name]
+                else:
+                    accounts.setdefault(namespace, {}).setdefault(username, name)
+        self._names, self._accounts = names, accounts
+
+    def _apply(self, event_type, sa):
+        if event_type == "DELETED":
+            self._remove(sa.metadata.namespace, sa.metadata.name)
+        else:
+            self._add(sa.metadata.namespace, sa.metadata.name, (sa.metadata.labels or {}).get(LONG_ACCOUNT_LABEL))
+
+    def _taken(self, namespace, name):
+        return name in self._names.get(namespace, {}) or name in self._reserved.get(namespace, {})
+
+    def _allocate(self, namespace, username):
+        existing = self._accounts.get(namespace, {}).get(username)
+        if existing is not None:
+            return existing
+        base = short_name_base(username)
+        name = base
+        suffix = 1
+        while self._taken(namespace, name):
+            self.collisions += 1
+            suffix += 1
+            tail = f"-{suffix}"
+            name = base[:SHORT_NAME_MAX_LENGTH - len(tail)].rstrip("-") + tail
+        self._reserve(namespace, name, username)
+        self.allocated += 1
+        return name
+
+    # Short names for usernames in a namespace, in order. A user who already
+    # has a ServiceAccount (or a reserved name) keeps it; everyone else gets
+    # the DNS-1123 form of their username, with -2, -3, ... appended when
+    # that is taken. New names stay reserved until the watch sees the
+    # ServiceAccount or release() gives them back.
+    def allocate(self, namespace, usernames):
+        self._synced.wait(SHORT_NAME_SYNC_TIMEOUT)
+        with self._lock:
+            return [self._allocate(namespace, username) for username in usernames]
+
+    # Reserve a short name chosen by hand. Returns None if it is free (or
+    # already the user's), else an error message.
+    def claim(self, namespace, username, name):
+        if not is_valid_short_name(name):
+            return (
+                f"Invalid short name '{name}': use at most {SHORT_NAME_MAX_LENGTH} lowercase letters, "
+                "digits and '-', starting and ending with a letter or digit."
+            )
+        self._synced.wait(SHORT_NAME_SYNC_TIMEOUT)
+        with self._lock:
+            owner = self._reserved.get(namespace, {}).get(name, self._names.get(namespace, {}).get(name, username))
+            if owner != username:
+                return f"Short name '{name}' is already used by '{owner or 'another ServiceAccount'}' in group '{namespace}'."
+            if name not in self._names.get(namespace, {}):
+                self._reserve(namespace, name, username)
+            return None
+
+    # Give back a reserved name whose ServiceAccount was not created
+    def release(self, namespace, name):
+        with self._lock:
+            username = self._reserved.get(namespace, {}).pop(name, None)
+            if username and self._accounts.get(namespace, {}).get(username) == name:
+                del self._accounts[namespace][username]
+
+    def stats(self):
+        with self._lock:
+            age = time.time() - self.last_sync if self.last_sync else None
+            return {
+                "synced": self._synced.is_set(),
+                "namespaces": len(self._names),
+                "service_accounts": sum(len(names) for names in self._names.values()),
+                "reserved": sum(len(names) for names in self._reserved.values()),
+                "allocated": self.allocated,
+                "collisions": self.collisions,
+                "resource_version": self._resource_version,
+                "age_seconds": age,
+            }
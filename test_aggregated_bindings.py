@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+
+import pytest
+
+import aggregated_bindings
+import k8s_client
+from aggregated_bindings import SubjectBatcher
+from k8s_writes import aggregated_role_binding_name, namespace_body, serialize
+
+
+@pytest.fixture
+def rbac_api(fake_api):
+    k8s_client.core_api().create_namespace(body=serialize(namespace_body("team")))
+    return k8s_client.rbac_api()
+
+
+def _users(rbac_api, role_name="edit"):
+    response = rbac_api.read_namespaced_role_binding(
+        aggregated_role_binding_name(role_name), "team", _preload_content=False
+    )
+    return {s["name"] for s in json.loads(response.data)["subjects"]}
+
+
+# Lock calling on_release after every release, to run code in the window
+# between two locked blocks
+class HookedLock:
+    def __init__(self, on_release):
+        self._lock = threading.Lock()
+        self.on_release = on_release
+
+    def acquire(self, *args, **kwargs):
+        return self._lock.acquire(*args, **kwargs)
+
+    def release(self):
+        self._lock.release()
+        self.on_release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _run_all(targets, timeout=10):
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout)
+    return [thread for thread in threads if thread.is_alive()]
+
+
+# A change that looks like a no-op against the cached binding is checked
+# against the cluster: another worker may have added the user since
+def test_remove_sees_subjects_added_by_another_writer(rbac_api):
+    first, second = SubjectBatcher(rbac_api), SubjectBatcher(rbac_api)
+    first.add("team", "edit", "seed")
+    second.add("team", "edit", "alice")
+
+    assert first.remove("team", "edit", "alice") is True
+    assert _users(rbac_api) == {"seed"}
+
+
+# A caller arriving right after the writer found the queue empty must not
+# wait for a writer that is about to stop
+def test_no_waiter_is_lost_between_batches(monkeypatch):
+    writes = []
+
+    def update_subjects(rbac_api, namespace, role_name, add=(), remove=(), known=None):
+        writes.append(add)
+        return {}, set(add) | set(remove)
+
+    monkeypatch.setattr(aggregated_bindings, "update_subjects", update_subjects)
+    results = {}
+    late = threading.Thread(target=lambda: results.update(late=batcher.add("team", "edit", "late")), daemon=True)
+    releases = []
+
+    # The writer's second release after its write leaves the block that
+    # found the queue empty; the late caller arrives right then
+    def on_release():
+        if threading.current_thread() is first and len(writes) == 1:
+            releases.append(None)
+            if len(releases) == 2:
+                late.start()
+                late.join(2)
+
+    batcher = SubjectBatcher(None)
+    batcher._lock = HookedLock(on_release)
+    batcher._written = threading.Condition(batcher._lock)
+    first = threading.Thread(target=lambda: results.update(first=batcher.add("team", "edit", "first")), daemon=True)
+
+    first.start()
+    first.join(10)
+    late.join(10)
+    assert not first.is_alive()
+    assert not late.is_alive()
+    assert results == {"first": True, "late": True}
+
+
+# Errors other than ApiException (e.g. a urllib3 timeout) reach every caller
+# of the batch instead of leaving them waiting
+def test_write_errors_of_any_type_wake_waiters(monkeypatch):
+    def update_subjects(rbac_api, namespace, role_name, add=(), remove=(), known=None):
+        time.sleep(0.01)
+        raise TimeoutError("read timed out")
+
+    monkeypatch.setattr(aggregated_bindings, "update_subjects", update_subjects)
+    batcher = SubjectBatcher(None)
+    errors = []
+
+    def add(username):
+        try:
+            batcher.add("team", "edit", username)
+        except TimeoutError as e:
+            errors.append(e)
+
+    hung = _run_all([lambda i=i: add(f"user{i}") for i in range(20)])
+    assert not hung
+    assert len(errors) == 20
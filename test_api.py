@@ -0,0 +1,78 @@
+import gzip
+import time
+
+import pytest
+
+import k8s_client
+from app_factory import create_app
+
+ROWS = "username,short_name,group,role\nalice,alice,physics,edit\nbob,bob,physics,edit\n"
+
+
+@pytest.fixture
+def api(services):
+    return create_app(["service-account"], services=services).test_client()
+
+
+def _wait(services, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = services.job_queue.snapshot(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def _service_accounts(namespace):
+    return {sa.metadata.name for sa in k8s_client.core_api().list_namespaced_service_account(namespace).items}
+
+
+# The import runs as a job whose offset is kept in the store, and a row whose
+# membership was stored before its writes failed still gets its objects
+def test_import_runs_as_a_job_and_provisions_existing_members(services, api):
+    services.create_namespace("physics")
+    services.store.add_member("physics", "alice", "alice")
+    response = api.post("/api/v1/users:import", data=ROWS, content_type="text/csv")
+
+    assert response.status_code == 202
+    job = _wait(services, response.get_json()["job"])
+    assert job["status"] == "finished", job["messages"]
+    assert job["progress"]["succeeded"] == 2, job["progress"]["failures"]
+    assert services.store.get_job(job["id"])["offset"] == 2
+    assert _service_accounts("physics") == {"alice", "bob"}
+
+    resumed = api.post(f"/api/v1/users:import?resume={job['id']}", data=ROWS, content_type="text/csv")
+    assert resumed.get_json()["offset"] == 2
+    assert _wait(services, resumed.get_json()["job"])["progress"]["processed"] == 0
+
+
+def test_corrupt_gzip_upload_is_a_client_error(api):
+    body = gzip.compress(ROWS.encode())[:-8]
+    response = api.post(
+        "/api/v1/users:import", data=body, content_type="text/csv", headers={"Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 400
+
+
+# A corrupt or truncated gzip body is the client's error on every endpoint
+# that reads records
+@pytest.mark.parametrize("path", ["/api/v1/groups", "/api/v1/users", "/api/v1/users:batch"])
+@pytest.mark.parametrize(
+    "body", [b"not gzip at all", gzip.compress(b'[{"name": "physics"}]')[:-8]], ids=["corrupt", "truncated"]
+)
+def test_corrupt_gzip_records_are_a_client_error(api, path, body):
+    response = api.post(path, data=body, content_type="application/json", headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/api/v1/groups", "/api/v1/users", "/api/v1/users:batch"])
+@pytest.mark.parametrize("body", ["5", '"alice"', "null", '{"items": "alice"}'])
+def test_body_that_is_not_an_array_or_object_is_a_client_error(api, path, body):
+    response = api.post(path, data=body, content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_unknown_import_format_is_a_client_error(api):
+    response = api.post("/api/v1/users:import?format=xlsx", data=ROWS, content_type="text/csv")
+    assert response.status_code == 400
@@ -0,0 +1,42 @@
+import pytest
+
+import audit
+import k8s_client
+import reconcile
+from services import Services
+
+
+@pytest.fixture
+def journal(fake_api, monkeypatch, tmp_path):
+    journal = audit.AuditJournal(str(tmp_path / "audit"))
+    monkeypatch.setattr(audit, "journal", journal)
+    yield journal
+    journal.close()
+
+
+def _records(journal):
+    journal.flush()
+    return [
+        {key: entry.get(key) for key in ("action", "kind", "group", "name", "ok")}
+        for entry in audit.read(journal.directory)
+    ]
+
+
+def test_existing_namespace_is_recorded_as_a_skip(journal, tmp_path):
+    services = Services(store_path=str(tmp_path / "users.db"))
+    services.create_namespace("physics")
+    services.create_namespace("physics")
+
+    assert [r["action"] for r in _records(journal)] == ["create", "skip"]
+
+
+def test_reconcile_writes_are_journalled(journal):
+    document = {"groups": [{"name": "physics", "users": [{"username": "alice", "short_name": "alice", "role": "edit"}]}]}
+    reconcile.reconcile(k8s_client.core_api(), k8s_client.rbac_api(), document)
+
+    records = _records(journal)
+    assert {"action": "create", "kind": "Namespace", "group": "physics", "name": "physics", "ok": True} in records
+    assert {"action": "create", "kind": "ServiceAccount", "group": "physics", "name": "alice", "ok": True} in records
+    assert {
+        "action": "create", "kind": "RoleBinding", "group": "physics", "name": "alice-edit-binding", "ok": True
+    } in records
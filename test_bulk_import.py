@@ -0,0 +1,27 @@
+import io
+
+import pytest
+
+from bulk_import import iter_rows, make_cli_provisioner, run_import, validate_row
+
+
+# The command line creates the namespace, generates missing short names and
+# writes the same objects as the web apps
+def test_cli_provisioner_generates_short_names(services):
+    rows = io.BytesIO(b"username,short_name,group,role\nAlice@example.org,,physics,edit\nbob,bobby,physics,\n")
+    summary = run_import(iter_rows(rows), make_cli_provisioner(services))
+
+    assert summary["failed"] == 0, summary["failures"]
+    accounts = {sa.metadata.name for sa in services.v1.list_namespaced_service_account("physics").items}
+    assert accounts == {"alice", "bobby"}
+    assert services.store.get_member("physics", "Alice@example.org")["short_name"] == "alice"
+    assert services.store.get_role("Alice@example.org")["role"] == "edit"
+
+
+# A trailing newline does not make a group or short name valid
+@pytest.mark.parametrize("record", [
+    {"username": "alice", "group": "physics\n"},
+    {"username": "alice", "group": "physics", "short_name": "alice\n"},
+])
+def test_names_with_a_trailing_newline_are_rejected(record):
+    assert validate_row(record) is not None
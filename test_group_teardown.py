@@ -0,0 +1,79 @@
+import time
+
+import pytest
+from kubernetes import client
+
+import k8s_client
+import k8s_writes
+from group_teardown import _wait_for_namespace_deletion, delete_group
+from k8s_writes import ensure_namespace
+
+
+@pytest.fixture
+def v1(fake_api):
+    return k8s_client.core_api()
+
+
+# Adding a group named after a namespace the app did not create must not
+# make that namespace deletable, whatever the write mode
+def test_foreign_namespace_is_never_deleted(v1, monkeypatch):
+    monkeypatch.setattr(k8s_writes, "WRITE_MODE", "apply")
+    v1.create_namespace(client.V1Namespace(metadata=client.V1ObjectMeta(name="prod")))
+
+    assert ensure_namespace(v1, "prod") == ("Namespace 'prod' already exists.", False)
+    message, ok = delete_group(v1, k8s_client.rbac_api(), "prod", delete_namespace=True)
+    assert not ok
+    assert v1.read_namespace("prod").metadata.name == "prod"
+
+
+def test_created_namespace_is_deleted(v1):
+    assert ensure_namespace(v1, "team")[1] is True
+    message, ok = delete_group(v1, k8s_client.rbac_api(), "team", delete_namespace=True)
+    assert ok, message
+
+
+def test_wait_returns_at_once_when_namespace_is_gone(v1):
+    start = time.monotonic()
+    assert _wait_for_namespace_deletion(v1, "missing", timeout=30) is True
+    assert time.monotonic() - start < 5
+
+
+# Objects from before the managed-by label are not selected by the
+# collection deletes; those the store knows of are deleted by name, and
+# anything else in the namespace is left alone
+def test_known_objects_without_the_label_are_deleted(v1):
+    rbac_api = k8s_client.rbac_api()
+    ensure_namespace(v1, "team")
+    legacy = k8s_writes.service_account_body("alice", "alice")
+    legacy.metadata.labels = {"hpc/long-account": "alice"}
+    v1.create_namespaced_service_account("team", legacy)
+    binding = k8s_writes.user_role_binding_body("team", "alice", "edit")
+    binding.metadata.labels = {}
+    rbac_api.create_namespaced_role_binding("team", binding)
+    rbac_api.create_namespaced_role_binding("team", k8s_writes.group_role_binding_body("team", "team"))
+    v1.create_namespaced_service_account("team", client.V1ServiceAccount(metadata=client.V1ObjectMeta(name="ci")))
+    v1.create_namespaced_service_account("team", k8s_writes.mark_managed(k8s_writes.service_account_body("bob", "bob")))
+
+    members = [{"username": "alice", "short_name": "alice", "role": "edit"}]
+    message, ok = delete_group(v1, rbac_api, "team", members=members)
+
+    assert ok, message
+    assert {sa.metadata.name for sa in v1.list_namespaced_service_account("team").items} == {"ci"}
+    assert rbac_api.list_namespaced_role_binding("team").items == []
+
+
+# Services passes the group's members from the store, and drops them only
+# once their objects are gone
+def test_remove_group_deletes_the_store_members_objects(services):
+    services.create_namespace("team")
+    legacy = k8s_writes.service_account_body("alice", "alice")
+    legacy.metadata.labels = {"hpc/long-account": "alice"}
+    services.v1.create_namespaced_service_account("team", legacy)
+    services.store.add_member("team", "alice", "alice")
+    services.store.set_role("alice", "team", "edit")
+
+    message, ok = services.remove_group("team")
+
+    assert ok, message
+    assert services.v1.list_namespaced_service_account("team").items == []
+    assert services.store.group_members("team") == []
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+import k8s_client
+from k8s_writes import namespace_body, service_account_body, user_role_binding_body
+from namespace_cache import NamespaceCache
+from rbac_index import RbacIndex
+from short_names import ShortNameIndex
+
+
+@pytest.fixture
+def apis(fake_api):
+    v1 = k8s_client.core_api()
+    v1.create_namespace(namespace_body("physics"))
+    return v1, k8s_client.rbac_api()
+
+
+def _eventually(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+# Each index is filled by the initial list and then follows the watch
+def test_indexes_list_then_watch(apis):
+    v1, rbac_api = apis
+    indexes = [NamespaceCache(v1).start(), ShortNameIndex(v1).start(), RbacIndex(rbac_api).start()]
+    try:
+        _eventually(lambda: all(index.synced for index in indexes))
+        namespaces, short_names, rbac = indexes
+        assert namespaces.names() == ["physics"]
+
+        v1.create_namespace(namespace_body("chemistry"))
+        v1.create_namespaced_service_account("physics", service_account_body("alice", "alice@example.org"))
+        rbac_api.create_namespaced_role_binding("physics", user_role_binding_body("physics", "alice", "edit"))
+
+        _eventually(lambda: "chemistry" in namespaces)
+        _eventually(lambda: rbac.access("alice"))
+        _eventually(lambda: short_names.allocate("physics", ["alice@example.org"]) == ["alice"])
+        assert short_names.allocate("physics", ["alice@other.org"]) == ["alice-2"]
+        assert rbac.access("alice")[0]["role"] == "edit"
+    finally:
+        for index in indexes:
+            index.stop()
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+import jobs
+from app_factory import create_app
+from jobs import JobQueue
+
+
+class Store:
+    def __init__(self):
+        self.saved = []
+        self.jobs = {}
+
+    def save_job(self, job_id, data):
+        self.saved.append(data)
+        self.jobs[job_id] = data
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+
+def _wait(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while queue.snapshot(job_id)["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+    return queue.snapshot(job_id)
+
+
+# Progress writes carry the counts but not the per-user results, which are
+# written once with the finished job
+def test_progress_saves_leave_out_results(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_PROGRESS_INTERVAL", 0)
+    store = Store()
+    queue = JobQueue(store=store)
+    job = queue.submit("batch", ["a", "b", "c"], lambda user: f"An error occurred: {user}" if user == "b" else "ok")
+    _wait(queue, job.id)
+
+    progress = [data for data in store.saved if data["status"] == "running" and data["done"]]
+    assert [data["done"] for data in progress] == [1, 2, 3]
+    assert all(data["results"] == [] for data in progress)
+    final = store.saved[-1]
+    assert (final["status"], final["done"], final["failed"], len(final["results"])) == ("finished", 3, 1, 3)
+
+
+# Finished jobs are dropped from memory past the cap or the retention time,
+# and are still read back from the store
+@pytest.mark.parametrize("retention, retention_max, kept", [(3600, 2, 2), (0, 100, 0)])
+def test_finished_jobs_are_evicted(retention, retention_max, kept):
+    store = Store()
+    queue = JobQueue(workers=1, store=store, retention=retention, retention_max=retention_max)
+    submitted = [queue.submit(f"batch {i}", ["a"], lambda user: "ok") for i in range(4)]
+    for job in submitted:
+        _wait(queue, job.id)
+
+    in_memory = [job.id for job in submitted if queue.get(job.id) is not None]
+    assert in_memory == [job.id for job in submitted][len(submitted) - kept:]
+    assert all(queue.snapshot(job.id)["status"] == "finished" for job in submitted)
+
+
+# Adding only users who are already members queues no job
+def test_add_users_without_new_users_queues_no_job(services):
+    app = create_app(["service-account"], services=services).test_client()
+    form = {"usernames": "alice", "group": "physics", "role": "edit"}
+    services.create_namespace("physics")
+    first = app.post("/add_users", data=form).get_data(as_text=True)
+    assert "Queued job" in first
+
+    second = app.post("/add_users", data=form).get_data(as_text=True)
+    assert "already in group" in second
+    assert "Queued job" not in second
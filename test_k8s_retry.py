@@ -0,0 +1,111 @@
+import pytest
+from kubernetes import client
+
+import k8s_retry
+from k8s_retry import RetryPolicy, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(k8s_retry.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(k8s_retry.time, "sleep", clock.sleep)
+    return clock
+
+
+def _error(status, retry_after=None):
+    error = client.exceptions.ApiException(status=status)
+    error.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return error
+
+
+# The burst is served at once; after that calls are spaced 1/qps apart, and
+# tokens refill while idle up to the burst
+def test_token_bucket_burst_then_refill(clock):
+    bucket = TokenBucket(qps=10, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.1)]
+
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.sleeps) == 1
+
+
+def test_token_bucket_without_limit_never_waits(clock):
+    bucket = TokenBucket(qps=0, burst=1)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+# Without Retry-After the delay is drawn from [0, base * 2^attempt], capped
+def test_backoff_has_full_jitter(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(k8s_retry.random, "uniform", lambda low, high: bounds.append((low, high)) or high)
+    policy = RetryPolicy(base_delay=0.5, max_delay=3)
+
+    assert [policy.delay(attempt, _error(503)) for attempt in range(4)] == [0.5, 1, 2, 3]
+    assert bounds == [(0, 0.5), (0, 1), (0, 2), (0, 3)]
+
+
+# Retry-After from the server is used as is, up to max_delay
+@pytest.mark.parametrize("retry_after, expected", [("2", 2), ("120", 30)])
+def test_retry_after_is_honored(retry_after, expected):
+    assert RetryPolicy(max_delay=30).delay(0, _error(429, retry_after)) == expected
+
+
+def test_throttled_call_is_retried_until_it_succeeds(clock):
+    responses = [_error(429, "1"), _error(500, "2"), "ok"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert RetryPolicy(max_retries=5).call(call) == "ok"
+    assert clock.sleeps == [1, 2]
+
+
+def test_retries_stop_after_max_retries(clock):
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise _error(503, "1")
+
+    with pytest.raises(client.exceptions.ApiException):
+        RetryPolicy(max_retries=2).call(call)
+    assert len(attempts) == 3
+
+
+# Client errors such as a conflict are not retried
+def test_non_retryable_status_is_raised_at_once(clock):
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise _error(409)
+
+    with pytest.raises(client.exceptions.ApiException):
+        RetryPolicy().call(call)
+    assert attempts == [1]
+    assert clock.sleeps == []
@@ -0,0 +1,62 @@
+import pytest
+from kubernetes import client
+
+import k8s_client
+from async_provisioning import AsyncProvisioner
+from k8s_writes import apply_service_account, namespace_body, service_account_body
+
+
+@pytest.fixture
+def v1(fake_api):
+    v1 = k8s_client.core_api()
+    v1.create_namespace(namespace_body("team"))
+    v1.create_namespaced_service_account("team", service_account_body("u1", "alice"))
+    return v1
+
+
+@pytest.mark.parametrize("mode", ["create", "apply"])
+def test_existing_service_account_of_the_same_user_is_kept(v1, mode):
+    apply_service_account(v1, "team", service_account_body("u1", "alice"), mode=mode)
+
+
+# A short name that collides with another user's ServiceAccount is an error,
+# and the account keeps its owner
+@pytest.mark.parametrize("mode", ["create", "apply"])
+def test_service_account_of_another_user_is_a_conflict(v1, mode):
+    with pytest.raises(client.exceptions.ApiException) as error:
+        apply_service_account(v1, "team", service_account_body("u1", "bob"), mode=mode)
+
+    assert error.value.status == 409
+    assert v1.read_namespaced_service_account("u1", "team").metadata.labels["hpc/long-account"] == "alice"
+
+
+def test_async_service_account_of_another_user_is_a_conflict(v1):
+    engine = AsyncProvisioner().start()
+    try:
+        message = engine.run(engine.create_service_account("team", "u1", "bob"))
+        assert "An error occurred" in message
+        assert "An error occurred" not in engine.run(engine.create_service_account("team", "u1", "alice"))
+    finally:
+        engine.stop()
+
+
+class ShortNames:
+    def __init__(self):
+        self.released = []
+
+    def release(self, namespace, name):
+        self.released.append((namespace, name))
+
+
+# Like Services.create_service_account, a failed create gives the reserved
+# short name back
+def test_async_failed_service_account_releases_its_short_name(v1):
+    short_names = ShortNames()
+    engine = AsyncProvisioner(short_names=lambda: short_names).start()
+    try:
+        engine.run(engine.create_service_account("team", "u1", "bob"))
+        engine.run(engine.create_service_account("missing", "u2", "carol"))
+        engine.run(engine.create_service_account("team", "u3", "dave"))
+    finally:
+        engine.stop()
+    assert short_names.released == [("team", "u1"), ("missing", "u2")]
@@ -0,0 +1,68 @@
+import pytest
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+from app_factory import create_app
+
+
+def _value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def app(services):
+    return create_app(["service-account"], services=services).test_client()
+
+
+def _scrape(app):
+    response = app.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    return {family.name: family for family in text_string_to_metric_families(response.get_data(as_text=True))}
+
+
+# Requests are timed by route rule, method and status
+def test_route_latency_is_recorded(app):
+    before = _value("k8s_user_http_request_duration_seconds_count", route="/healthz", method="GET", status="200")
+    app.get("/healthz")
+    after = _value("k8s_user_http_request_duration_seconds_count", route="/healthz", method="GET", status="200")
+    assert after == before + 1
+
+
+# Helper calls are timed, and reported errors are counted as failures
+def test_helper_calls_are_timed_and_errors_counted(app, services):
+    count = "k8s_user_k8s_call_duration_seconds_count"
+    errors = "k8s_user_k8s_call_errors_total"
+    before = _value(count, call="create_service_account"), _value(errors, call="create_service_account")
+
+    services.create_namespace("physics")
+    services.create_service_account("physics", "alice", "alice")
+    services.create_service_account("missing", "bob", "bob")
+
+    assert _value(count, call="create_service_account") == before[0] + 2
+    assert _value(errors, call="create_service_account") == before[1] + 1
+
+
+def test_raised_errors_are_counted():
+    @metrics.timed_call("test_raises")
+    def fails():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        fails()
+    assert _value("k8s_user_k8s_call_errors_total", call="test_raises") == 1
+
+
+# The scrape includes the API server request counters, and the namespace
+# cache and job queue once they exist
+def test_scrape_reports_cache_and_jobs(app, services):
+    families = _scrape(app)
+    assert "k8s_user_api_requests" in families
+    assert "k8s_user_namespace_cache_hits" not in families
+
+    services.namespace_cache.names()
+    services.job_queue
+    families = _scrape(app)
+    assert "k8s_user_namespace_cache_hit_ratio" in families
+    assert "k8s_user_onboarding_pending_users" in families
@@ -0,0 +1,65 @@
+import pytest
+
+import k8s_client
+from app_factory import create_app
+from cluster_sync import iter_pages
+from k8s_writes import MANAGED_SELECTOR, namespace_body
+from pagination import Page, decode_cursor, iter_sorted_names
+
+NAMES = ["astro", "bio", "chem", "phys-a", "phys-b", "phys-c", "zoo"]
+
+
+def _walk(names, prefix, limit):
+    pages = []
+    after = None
+    while True:
+        page = Page(iter_sorted_names(names, prefix, after), limit, prefix)
+        pages.append(list(page))
+        if page.next_cursor is None:
+            return pages
+        after = decode_cursor(page.next_cursor)
+
+
+# Following next_cursor visits every matching name once, limit at a time
+@pytest.mark.parametrize("prefix, expected", [
+    ("", [["astro", "bio"], ["chem", "phys-a"], ["phys-b", "phys-c"], ["zoo"]]),
+    ("phys-", [["phys-a", "phys-b"], ["phys-c"]]),
+    ("none", [[]]),
+])
+def test_cursor_walks_sorted_names(prefix, expected):
+    assert _walk(NAMES, prefix, 2) == expected
+
+
+# A page that ends exactly at the last item has no next cursor
+def test_full_last_page_has_no_cursor():
+    page = Page(iter_sorted_names(["a", "b"]), 2)
+    assert list(page) == ["a", "b"]
+    assert page.next_cursor is None
+
+
+# /api/v1/users pages through the store by group
+def test_users_api_pages_by_group(services):
+    for group in ("g1", "g2", "g3"):
+        services.store.add_members(group, [{"username": f"{group}-user", "short_name": f"{group}-user"}])
+    api = create_app(["service-account"], services=services).test_client()
+
+    groups = []
+    cursor = ""
+    while True:
+        body = api.get("/api/v1/users", query_string={"limit": 2, "cursor": cursor}).get_json()
+        groups.append([item["group"] for item in body["items"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert groups == [["g1", "g2"], ["g3"]]
+
+
+# iter_pages follows the API server's continue token until the last page
+def test_iter_pages_follows_continue(fake_api):
+    v1 = k8s_client.core_api()
+    for i in range(5):
+        v1.create_namespace(namespace_body(f"ns{i}"))
+
+    pages = [[ns.metadata.name for ns in items] for items in iter_pages(v1.list_namespace, MANAGED_SELECTOR, 2)]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(sum(pages, [])) == [f"ns{i}" for i in range(5)]
@@ -0,0 +1,59 @@
+import pytest
+from kubernetes import client
+
+import k8s_client
+import pull_secrets
+from k8s_writes import namespace_body
+
+
+@pytest.fixture
+def v1(fake_api):
+    v1 = k8s_client.core_api()
+    for name in ("default", "physics", "chemistry"):
+        v1.create_namespace(namespace_body(name))
+    v1.create_namespaced_secret("default", client.V1Secret(
+        metadata=client.V1ObjectMeta(name="gcr-cred"),
+        type="kubernetes.io/dockerconfigjson",
+        data={".dockerconfigjson": "e30="},
+    ))
+    return v1
+
+
+# Record the (action, namespace) of every write replicate makes
+def _writes(monkeypatch):
+    writes = []
+    apply_one = pull_secrets._apply_one
+
+    def recording(v1, source, digest, action, namespace, copy):
+        writes.append((action, namespace))
+        apply_one(v1, source, digest, action, namespace, copy)
+
+    monkeypatch.setattr(pull_secrets, "_apply_one", recording)
+    return writes
+
+
+# A namespace whose copy already has the source's content hash is skipped
+# without a write; only missing or changed copies are written
+def test_copies_with_the_same_hash_are_not_written(v1, monkeypatch):
+    writes = _writes(monkeypatch)
+    first = pull_secrets.replicate(v1, source_namespace="default", name="gcr-cred")
+    assert first["create"] == ["chemistry", "physics"]
+    assert first["errors"] == []
+
+    second = pull_secrets.replicate(v1, source_namespace="default", name="gcr-cred")
+    assert second["unchanged"] == 2
+    assert second["hash"] == first["hash"]
+    assert writes == [("create", "chemistry"), ("create", "physics")]
+
+    v1.patch_namespaced_secret("gcr-cred", "physics", {"data": {".dockerconfigjson": "e30K", "extra": "eA=="}})
+    third = pull_secrets.replicate(v1, source_namespace="default", name="gcr-cred")
+    assert third["patch"] == ["physics"]
+    assert third["unchanged"] == 1
+    assert v1.read_namespaced_secret("gcr-cred", "physics").data == {".dockerconfigjson": "e30="}
+
+
+def test_missing_source_writes_nothing(v1, monkeypatch):
+    writes = _writes(monkeypatch)
+    result = pull_secrets.replicate(v1, source_namespace="default", name="missing")
+    assert result["source_found"] is False
+    assert writes == []
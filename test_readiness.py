@@ -0,0 +1,63 @@
+import os
+import runpy
+import signal
+import time
+
+import pytest
+
+from app_factory import create_app
+
+GUNICORN_CONF = os.path.join(os.path.dirname(__file__), "gunicorn.conf.py")
+
+
+@pytest.fixture
+def app(services):
+    return create_app(["service-account"], services=services)
+
+
+def _eventually(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+# /readyz turns 503 as soon as the worker drains, even with a cached result
+def test_readyz_reports_draining(app, services):
+    client = app.test_client()
+    services.namespace_cache.names()
+    _eventually(lambda: client.get("/readyz").status_code == 200)
+    assert client.get("/readyz").get_json()["checks"]["draining"] is False
+
+    services.draining = True
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["checks"]["draining"] is True
+    assert client.get("/healthz").status_code == 200
+
+
+class Worker:
+    def __init__(self, app):
+        self.wsgi = app
+        self.alive = True
+
+    def handle_exit(self, sig, frame):
+        self.alive = False
+
+
+# SIGTERM marks the worker as draining at once and stops it only after the
+# notice period, so /readyz is still served while it reports draining
+def test_sigterm_reports_draining_before_the_worker_stops(app, services, monkeypatch):
+    handlers = {}
+    monkeypatch.setattr(signal, "signal", lambda signum, handler: handlers.__setitem__(signum, handler))
+    conf = runpy.run_path(GUNICORN_CONF)
+    conf["post_worker_init"].__globals__["DRAIN_NOTICE_SECONDS"] = 0.2
+    worker = Worker(app)
+    conf["post_worker_init"](worker)
+
+    handlers[signal.SIGTERM](signal.SIGTERM, None)
+    assert services.draining
+    assert worker.alive
+    assert app.test_client().get("/readyz").status_code == 503
+
+    _eventually(lambda: not worker.alive)
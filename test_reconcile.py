@@ -0,0 +1,50 @@
+import pytest
+
+import k8s_client
+import reconcile
+
+DOCUMENT = {"groups": [{"name": "physics", "users": [{"username": "alice", "short_name": "alice", "role": "edit"}]}]}
+
+
+@pytest.fixture
+def apis(fake_api):
+    return k8s_client.core_api(), k8s_client.rbac_api()
+
+
+# A new group's namespace is created before its objects, and a second run
+# finds nothing to do
+@pytest.mark.parametrize("namespaced_list_max", [0, reconcile.NAMESPACED_LIST_MAX])
+def test_new_group_is_created_with_its_namespace(apis, monkeypatch, namespaced_list_max):
+    monkeypatch.setattr(reconcile, "NAMESPACED_LIST_MAX", namespaced_list_max)
+    v1, rbac_api = apis
+    result = reconcile.reconcile(v1, rbac_api, DOCUMENT)
+
+    assert result["errors"] == []
+    assert result["namespaces"] == ["physics"]
+    assert len(result["create"]) == 2
+
+    again = reconcile.reconcile(v1, rbac_api, DOCUMENT)
+    assert again["errors"] == [] and again["namespaces"] == []
+    assert again["create"] == [] and again["patch"] == [] and again["unchanged"] == 2
+
+
+# A patch removes what the document no longer has: the imagePullSecret of a
+# ServiceAccount and the app's own labels, but not labels set by others
+def test_patch_removes_fields_dropped_from_the_document(apis):
+    v1, rbac_api = apis
+    document = {"groups": [{"name": "physics", "users": [
+        {"username": "alice", "short_name": "alice", "role": "edit", "pull_secret": "gcr-cred"},
+    ]}]}
+    reconcile.reconcile(v1, rbac_api, document)
+    v1.patch_namespaced_service_account("alice", "physics", {"metadata": {"labels": {"hpc/stale": "x", "team": "a"}}})
+
+    del document["groups"][0]["users"][0]["pull_secret"]
+    result = reconcile.reconcile(v1, rbac_api, document)
+
+    assert result["errors"] == []
+    assert result["patch"] == [["ServiceAccount", "physics", "alice"]]
+    account = v1.read_namespaced_service_account("alice", "physics")
+    assert account.image_pull_secrets is None
+    assert "hpc/stale" not in account.metadata.labels
+    assert account.metadata.labels["team"] == "a"
+    assert reconcile.reconcile(v1, rbac_api, document)["unchanged"] == 2
@@ -0,0 +1,16 @@
+import pytest
+
+from short_names import is_valid_short_name
+
+
+@pytest.mark.parametrize("name, valid", [
+    ("alice", True),
+    ("a-1", True),
+    ("alice\n", False),
+    ("-alice", False),
+    ("Alice", False),
+    ("a" * 64, False),
+    ("", False),
+])
+def test_short_names_are_dns_1123_labels(name, valid):
+    assert is_valid_short_name(name) is valid
@@ -0,0 +1,87 @@
+import pytest
+from kubernetes import client
+
+import k8s_client
+from k8s_writes import namespace_body, service_account_body
+from pull_secrets import IMAGE_PULL_SECRET, PULL_SECRET_SOURCE_NAMESPACE
+from user_moves import delete_users, move_user
+
+
+@pytest.fixture
+def apis(fake_api):
+    v1 = k8s_client.core_api()
+    for name in ("old", "new"):
+        v1.create_namespace(namespace_body(name))
+    v1.create_namespaced_service_account("old", service_account_body("u1", "alice"))
+    return v1, k8s_client.rbac_api()
+
+
+def _binding_names(rbac_api, namespace):
+    return {rb.metadata.name for rb in rbac_api.list_namespaced_role_binding(namespace).items}
+
+
+def _account_names(v1, namespace):
+    return {sa.metadata.name for sa in v1.list_namespaced_service_account(namespace).items}
+
+
+# A user without a role (image-pull, group-binding) only has their
+# ServiceAccount moved; no "<user>-None-binding" is created
+def test_move_without_role_moves_only_the_service_account(apis):
+    v1, rbac_api = apis
+    ok, message = move_user(v1, rbac_api, "alice", "u1", "old", None, "new", None)
+
+    assert ok, message
+    assert "None" not in message
+    assert _account_names(v1, "new") == {"u1"}
+    assert "u1" not in _account_names(v1, "old")
+    assert _binding_names(rbac_api, "new") == set()
+
+
+def test_move_without_role_creates_a_binding_for_a_new_role(apis):
+    v1, rbac_api = apis
+    ok, message = move_user(v1, rbac_api, "alice", "u1", "old", None, "old", "edit")
+
+    assert ok, message
+    assert _binding_names(rbac_api, "old") == {"alice-edit-binding"}
+
+
+def test_delete_without_role_removes_the_service_account(apis):
+    v1, rbac_api = apis
+    [result] = delete_users(v1, rbac_api, [{"username": "alice", "short_name": "u1", "group": "old", "role": None}])
+
+    assert result["ok"], result["message"]
+    assert "u1" not in _account_names(v1, "old")
+
+
+# An image-pull user keeps their imagePullSecrets, and the secret is copied
+# into the new group
+def test_move_carries_pull_secrets_over(apis):
+    v1, rbac_api = apis
+    v1.create_namespace(namespace_body(PULL_SECRET_SOURCE_NAMESPACE))
+    v1.create_namespaced_secret(PULL_SECRET_SOURCE_NAMESPACE, client.V1Secret(
+        metadata=client.V1ObjectMeta(name=IMAGE_PULL_SECRET), type="Opaque", data={"token": "c2VjcmV0"},
+    ))
+    v1.create_namespaced_service_account("old", service_account_body("u2", "bob", IMAGE_PULL_SECRET))
+
+    ok, message = move_user(v1, rbac_api, "bob", "u2", "old", None, "new", None)
+
+    assert ok, message
+    account = v1.read_namespaced_service_account("u2", "new")
+    assert [ref.name for ref in account.image_pull_secrets] == [IMAGE_PULL_SECRET]
+    assert v1.read_namespaced_secret(IMAGE_PULL_SECRET, "new").data == {"token": "c2VjcmV0"}
+
+
+# A ServiceAccount of the same name owned by another user in the new group
+# fails the move; the role binding created for it is rolled back and the
+# user keeps their old objects
+def test_move_onto_another_users_service_account_is_rolled_back(apis):
+    v1, rbac_api = apis
+    v1.create_namespaced_service_account("new", service_account_body("u1", "carol"))
+
+    ok, message = move_user(v1, rbac_api, "alice", "u1", "old", None, "new", "edit")
+
+    assert not ok
+    assert "An error occurred" in message
+    assert v1.read_namespaced_service_account("u1", "new").metadata.labels["hpc/long-account"] == "carol"
+    assert "u1" in _account_names(v1, "old")
+    assert _binding_names(rbac_api, "new") == set()
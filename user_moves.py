@@ -0,0 +1,213 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client
+
+import audit
+from k8s_writes import aggregated_role_binding_name, apply_service_account, service_account_body, user_role_binding_body
+from pull_secrets import replicate
+
+# Deletes in flight at once during a bulk edit/delete
+BULK_EDIT_PARALLELISM = int(os.environ.get("BULK_EDIT_PARALLELISM", "16"))
+
+
+# Create an object and report whether this call created it. An object that
+# already exists is left alone and never rolled back.
+def _create(create_fn, namespace, body):
+    try:
+        create_fn(namespace=namespace, body=body)
+        return True
+    except client.exceptions.ApiException as e:
+        if e.status == 409:
+            return False
+        raise
+
+
+def _delete(delete_fn, namespace, name):
+    try:
+        delete_fn(name=name, namespace=namespace)
+    except client.exceptions.ApiException as e:
+        if e.status != 404:
+            raise
+
+
+# Run calls concurrently; returns (results, first error)
+def _run_parallel(calls):
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [executor.submit(fn, *args) for fn, *args in calls]
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except client.exceptions.ApiException as e:
+            results.append(None)
+            error = error or e
+    return results, error
+
+
+# Names of the imagePullSecrets of a user's ServiceAccount; none if it is gone
+def _pull_secrets(v1, namespace, short_name):
+    try:
+        account = v1.read_namespaced_service_account(name=short_name, namespace=namespace)
+    except client.exceptions.ApiException as e:
+        if e.status == 404:
+            return []
+        raise
+    return [ref.name for ref in account.image_pull_secrets or []]
+
+
+# Copy pull secrets into a user's new group, from the source of the
+# replicated pull secret or, failing that, the copy in the old group.
+# Returns the first error.
+def _copy_pull_secrets(v1, names, old_group, new_group):
+    for name in names:
+        result = replicate(v1, namespaces=[new_group], name=name)
+        if not result["source_found"]:
+            result = replicate(v1, namespaces=[new_group], name=name, source_namespace=old_group)
+        if not result["source_found"]:
+            return f"Pull secret '{name}' not found in namespace '{old_group}'."
+        if result["errors"]:
+            return result["errors"][0]
+    return None
+
+
+# Move a user to a new group and/or role without a window where they have no
+# access: the new objects are created first, in parallel, and the old ones are
+# removed only once that succeeded. If a create fails (including a
+# ServiceAccount name taken by another user in the new group), whatever this
+# move created is deleted again and the old objects are kept. The imagePullSecrets
+# of the user's ServiceAccount are carried over, and the secrets copied into
+# the new group first.
+#
+# A role change inside the same namespace only swaps the RoleBinding (roleRef
+# is immutable, and the binding name carries the role); the ServiceAccount is
+# left untouched. With subjects (aggregated RoleBindings) the user is added
+# to the binding of the new role and removed from that of the old one. A user
+# without a role (old_role None) has no RoleBinding to remove, and one is only
+# created when new_role is given; likewise a user without a short_name has no
+# ServiceAccount to move.
+#
+# Returns (ok, message).
+@audit.audited(
+    "move", "User", group="new_group", user="username", role="new_role", from_group="old_group", from_role="old_role"
+)
+def move_user(v1, rbac_api, username, short_name, old_group, old_role, new_group, new_role, subjects=None):
+    target = f"group '{new_group}' with role '{new_role}'" if new_role else f"group '{new_group}'"
+    if old_group == new_group and old_role == new_role:
+        return True, f"User '{username}' is already in {target}."
+
+    creates, rollbacks, deletes = [], [], []
+    if subjects is not None:
+        if new_role:
+            creates.append((subjects.add, new_group, new_role, username))
+            rollbacks.append((subjects.remove, new_group, new_role, username))
+        if old_role:
+            deletes.append((subjects.remove, old_group, old_role, username))
+    else:
+        if new_role:
+            creates.append((
+                _create, rbac_api.create_namespaced_role_binding, new_group,
+                user_role_binding_body(new_group, username, new_role),
+            ))
+            rollbacks.append((
+                _delete, rbac_api.delete_namespaced_role_binding, new_group, f"{username}-{new_role}-binding",
+            ))
+        if old_role:
+            deletes.append((
+                _delete, rbac_api.delete_namespaced_role_binding, old_group, f"{username}-{old_role}-binding",
+            ))
+    if old_group != new_group and short_name:
+        try:
+            pull_secrets = _pull_secrets(v1, old_group, short_name)
+        except client.exceptions.ApiException as e:
+            return False, f"An error occurred while moving user '{username}'; no changes were kept: {e}"
+        error = _copy_pull_secrets(v1, pull_secrets, old_group, new_group)
+        if error is not None:
+            return False, f"An error occurred while copying the pull secrets of user '{username}': {error}"
+        account = service_account_body(short_name, username)
+        account.image_pull_secrets = [client.V1LocalObjectReference(name=name) for name in pull_secrets] or None
+        # apply_service_account fails if the name belongs to another user's
+        # ServiceAccount in the new group, which rolls the move back
+        creates.append((apply_service_account, v1, new_group, account))
+        rollbacks.append((_delete, v1.delete_namespaced_service_account, new_group, short_name))
+        deletes.append((_delete, v1.delete_namespaced_service_account, old_group, short_name))
+
+    created, error = _run_parallel(creates) if creates else ([], None)
+    if error is not None:
+        undo = [rollback for rollback, was_created in zip(rollbacks, created) if was_created]
+        if undo:
+            _, rollback_error = _run_parallel(undo)
+            if rollback_error is not None:
+                return False, (
+                    f"An error occurred while moving user '{username}': {error}. "
+                    f"Rolling back also failed: {rollback_error}"
+                )
+        return False, f"An error occurred while moving user '{username}'; no changes were kept: {error}"
+
+    _, error = _run_parallel(deletes) if deletes else ([], None)
+    if error is not None:
+        return True, (
+            f"User '{username}' moved to {target}, "
+            f"but removing the old objects from '{old_group}' failed: {error}"
+        )
+    return True, f"User '{username}' moved to {target}."
+
+
+# Delete the RoleBindings and ServiceAccounts of many users at once. users
+# holds {"username", "short_name", "group", "role"} dicts; every delete is
+# issued concurrently with at most parallelism in flight. Objects that are
+# already gone count as deleted. With subjects, users are removed from the
+# aggregated RoleBindings instead, which folds the removals from one binding
+# into a few writes. Returns one result per user, in order.
+def delete_users(v1, rbac_api, users, parallelism=BULK_EDIT_PARALLELISM, subjects=None):
+    operations = []
+    for index, user in enumerate(users):
+        namespace = user["group"]
+        if user.get("role") and subjects is not None:
+            name = aggregated_role_binding_name(user["role"])
+            operations.append((
+                index, namespace, name,
+                lambda user=user: subjects.remove(user["group"], user["role"], user["username"]),
+            ))
+        elif user.get("role"):
+            name = f"{user['username']}-{user['role']}-binding"
+            operations.append((
+                index, namespace, name,
+                lambda namespace=namespace, name=name: _delete(rbac_api.delete_namespaced_role_binding, namespace, name),
+            ))
+        if user.get("short_name"):
+            name = user["short_name"]
+            operations.append((
+                index, namespace, name,
+                lambda namespace=namespace, name=name: _delete(v1.delete_namespaced_service_account, namespace, name),
+            ))
+
+    def run(operation):
+        index, namespace, name, delete = operation
+        try:
+            delete()
+            return index, None
+        except client.exceptions.ApiException as e:
+            return index, f"An error occurred while deleting '{name}' from namespace '{namespace}': {e}"
+
+    errors = {}
+    if operations:
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(operations)))) as executor:
+            for index, error in executor.map(run, operations):
+                if error:
+                    errors.setdefault(index, []).append(error)
+
+    results = []
+    for index, user in enumerate(users):
+        if index in errors:
+            results.append({"user": user, "ok": False, "message": " ".join(errors[index])})
+        else:
+            results.append({
+                "user": user, "ok": True,
+                "message": f"User '{user['username']}' removed from group '{user['group']}'.",
+            })
+        audit.journal.record(
+            action="delete", kind="User", group=user["group"], user=user["username"], role=user.get("role"),
+            ok=results[-1]["ok"], message=results[-1]["message"],
+        )
+    return results
@@ -0,0 +1,285 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from itertools import groupby
+
+# Location of the SQLite database shared by every worker process
+USER_STORE_PATH = os.environ.get("USER_STORE_PATH", "k8s_user.db")
+
+
+# Storage interface for group memberships and user roles. Replaces the
+# module-level user_group_mapping / user_role_mapping dicts so state survives
+# restarts and is shared by every worker.
+class UserStore(ABC):
+    # Add one member; returns False if the user is already in the group
+    @abstractmethod
+    def add_member(self, group, username, short_name=None):
+        ...
+
+    # Add many members in one transaction; returns the members actually added
+    @abstractmethod
+    def add_members(self, group, members):
+        ...
+
+    @abstractmethod
+    def remove_member(self, group, username):
+        ...
+
+    # Remove many (group, username) memberships in one transaction
+    @abstractmethod
+    def remove_members(self, memberships):
+        ...
+
+    # Drop every membership and role that points at the group
+    @abstractmethod
+    def remove_group(self, group):
+        ...
+
+    # {"username", "short_name"} for one membership, or None
+    @abstractmethod
+    def get_member(self, group, username):
+        ...
+
+    @abstractmethod
+    def set_role(self, username, group, role):
+        ...
+
+    # Set many roles at once from (username, group, role) rows
+    @abstractmethod
+    def set_role_rows(self, rows):
+        ...
+
+    def set_roles(self, group, usernames, role):
+        self.set_role_rows([(username, group, role) for username in usernames])
+
+    @abstractmethod
+    def get_role(self, username):
+        ...
+
+    @abstractmethod
+    def delete_role(self, username):
+        ...
+
+    @abstractmethod
+    def delete_roles(self, usernames):
+        ...
+
+    # Group -> list of {"username", "short_name"}
+    @abstractmethod
+    def user_groups(self):
+        ...
+
+    # Lazily yield (group, (group, users)) in group order, starting after the group
+    # named by after and limited to groups beginning with prefix
+    @abstractmethod
+    def iter_user_groups(self, prefix="", after=None):
+        ...
+
+    # {"username", "short_name", "role"} for every member of one group; role
+    # is None for members without a role in it
+    @abstractmethod
+    def group_members(self, group):
+        ...
+
+    # Username -> {"group", "role"}
+    @abstractmethod
+    def user_roles(self):
+        ...
+
+    # Onboarding job state as a JSON-ready dict, so any worker can report on
+    # a job another worker runs
+    @abstractmethod
+    def save_job(self, job_id, data):
+        ...
+
+    @abstractmethod
+    def get_job(self, job_id):
+        ...
+
+    # Take a named lease for ttl seconds. Returns True for the one caller
+    # that gets it, e.g. the worker that runs the startup rebuild.
+    @abstractmethod
+    def claim(self, name, ttl):
+        ...
+
+    # Cheap round trip for readiness checks; raises if the store is unusable
+    @abstractmethod
+    def ping(self):
+        ...
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memberships (
+    group_name TEXT NOT NULL,
+    username TEXT NOT NULL,
+    short_name TEXT,
+    PRIMARY KEY (group_name, username)
+);
+CREATE INDEX IF NOT EXISTS memberships_username ON memberships (username);
+CREATE INDEX IF NOT EXISTS memberships_short_name ON memberships (short_name);
+CREATE TABLE IF NOT EXISTS user_roles (
+    username TEXT PRIMARY KEY,
+    group_name TEXT NOT NULL,
+    role TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+);
+"""
+
+
+# SQLite-backed store. Each thread gets its own connection; WAL mode lets
+# several gunicorn workers read while one writes.
+class SQLiteUserStore(UserStore):
+    def __init__(self, path=USER_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_member(self, group, username, short_name=None):
+        return bool(self.add_members(group, [{"username": username, "short_name": short_name}]))
+
+    def add_members(self, group, members):
+        added = []
+        with self._connection() as conn:
+            for member in members:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO memberships (group_name, username, short_name) VALUES (?, ?, ?)",
+                    (group, member["username"], member.get("short_name")),
+                )
+                if cursor.rowcount:
+                    added.append(member)
+        return added
+
+    def remove_member(self, group, username):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM memberships WHERE group_name = ? AND username = ?", (group, username))
+
+    def remove_members(self, memberships):
+        with self._connection() as conn:
+            conn.executemany("DELETE FROM memberships WHERE group_name = ? AND username = ?", memberships)
+
+    def remove_group(self, group):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM memberships WHERE group_name = ?", (group,))
+            conn.execute("DELETE FROM user_roles WHERE group_name = ?", (group,))
+
+    def get_member(self, group, username):
+        row = self._connection().execute(
+            "SELECT username, short_name FROM memberships WHERE group_name = ? AND username = ?", (group, username)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def set_role(self, username, group, role):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_roles (username, group_name, role) VALUES (?, ?, ?)",
+                (username, group, role),
+            )
+
+    def set_role_rows(self, rows):
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_roles (username, group_name, role) VALUES (?, ?, ?)", rows
+            )
+
+    def get_role(self, username):
+        row = self._connection().execute(
+            "SELECT group_name AS 'group', role FROM user_roles WHERE username = ?", (username,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def delete_role(self, username):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM user_roles WHERE username = ?", (username,))
+
+    def delete_roles(self, usernames):
+        with self._connection() as conn:
+            conn.executemany("DELETE FROM user_roles WHERE username = ?", [(username,) for username in usernames])
+
+    def user_groups(self):
+        groups = {}
+        rows = self._connection().execute(
+            "SELECT group_name, username, short_name FROM memberships ORDER BY group_name, username"
+        )
+        for row in rows:
+            groups.setdefault(row["group_name"], []).append(
+                {"username": row["username"], "short_name": row["short_name"]}
+            )
+        return groups
+
+    def iter_user_groups(self, prefix="", after=None):
+        query = "SELECT group_name, username, short_name FROM memberships WHERE group_name >= ?"
+        params = [prefix]
+        if prefix:
+            query += " AND group_name < ?"
+            params.append(prefix + "\U0010ffff")
+        if after is not None:
+            query += " AND group_name > ?"
+            params.append(after)
+        query += " ORDER BY group_name, username"
+        rows = self._connection().execute(query, params)
+        for group, group_rows in groupby(rows, key=lambda row: row["group_name"]):
+            users = [{"username": row["username"], "short_name": row["short_name"]} for row in group_rows]
+            yield group, (group, users)
+
+    def group_members(self, group):
+        rows = self._connection().execute(
+            "SELECT m.username, m.short_name, r.role FROM memberships m "
+            "LEFT JOIN user_roles r ON r.username = m.username AND r.group_name = m.group_name "
+            "WHERE m.group_name = ? ORDER BY m.username",
+            (group,),
+        )
+        return [dict(row) for row in rows]
+
+    def user_roles(self):
+        rows = self._connection().execute("SELECT username, group_name, role FROM user_roles ORDER BY username")
+        return {row["username"]: {"group": row["group_name"], "role": row["role"]} for row in rows}
+
+    def save_job(self, job_id, data):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, data, updated) VALUES (?, ?, ?)",
+                (job_id, json.dumps(data), time.time()),
+            )
+
+    def get_job(self, job_id):
+        row = self._connection().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def claim(self, name, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO leases (name, expires) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET expires = excluded.expires WHERE leases.expires < ?",
+                (name, now + ttl, now),
+            )
+        return cursor.rowcount == 1
+
+    def ping(self):
+        self._connection().execute("SELECT 1").fetchone()
+
+
+def create_store(path=USER_STORE_PATH):
+    return SQLiteUserStore(path)
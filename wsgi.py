@@ -0,0 +1,9 @@
+from app_factory import create_app
+
+# Production entry point, served by gunicorn with the settings in gunicorn.conf.py:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Profiles come from K8S_USER_PROFILES (default: all). Every worker builds its
+# own app; memberships, roles and job state are shared through the store.
+app = create_app()